@@ -32,11 +32,52 @@ CREATE TABLE IF NOT EXISTS tspdb.pindices_stats (
    PRIMARY KEY (index_name, column_name)
 );
 
+CREATE TABLE IF NOT EXISTS tspdb.tslb_calibration (
+  n int not NULL,
+  size int not NULL,
+  samples int not NULL,
+  slope double precision not NULL,
+  intercept double precision not NULL,
+   PRIMARY KEY (n, size)
+);
+
+CREATE TABLE IF NOT EXISTS tspdb.pindices_groups (
+  index_name text not NULL,
+  value_column text not NULL,
+  group_index text not NULL,
+   PRIMARY KEY (index_name, value_column)
+);
+
+-- bumped every time a pindex is written, kept when the pindex is deleted so versions only increase
+CREATE TABLE IF NOT EXISTS tspdb.pindices_versions (
+  index_name text PRIMARY key,
+  version bigint not NULL
+);
+
+-- predict results shared by all sessions (see predict_cache_config), stamp is the state of the rows read by forecasts
+CREATE UNLOGGED TABLE IF NOT EXISTS tspdb.predict_cache (
+  key text PRIMARY key,
+  version bigint not NULL,
+  prediction double precision[] not NULL,
+  interval double precision[],
+  seconds double precision not NULL,
+  stamp text
+);
+
+CREATE UNLOGGED TABLE IF NOT EXISTS tspdb.predict_cache_stats (
+  index_name text,
+  column_name text,
+  hits bigint not NULL,
+  misses bigint not NULL,
+  saved_seconds double precision not NULL,
+   PRIMARY KEY (index_name, column_name)
+);
 
 
 
 
-CREATE or REPLACE FUNCTION create_pindex (table_name text, time_column text, value_column text[], index_name text, fill_in_missing boolean DEFAULT true,"normalize" boolean DEFAULT true,auto_update boolean DEFAULT true, timescale boolean DEFAULT false, t_var int DEFAULT -1 ,k int DEFAULT Null , k_var int DEFAULT 1, t int DEFAULT 2500000, t0 int DEFAULT 1000,var_direct boolean DEFAULT true,gamma numeric DEFAULT 0.5, col_to_row_ratio int DEFAULT 10, agg_interval numeric DEFAULT NULL, l int DEFAULT 0 )
+
+CREATE or REPLACE FUNCTION create_pindex (table_name text, time_column text, value_column text[], index_name text, fill_in_missing boolean DEFAULT true,"normalize" boolean DEFAULT true,auto_update boolean DEFAULT true, timescale boolean DEFAULT false, t_var int DEFAULT -1 ,k int DEFAULT Null , k_var int DEFAULT 1, t int DEFAULT 2500000, t0 int DEFAULT 1000,var_direct boolean DEFAULT true,gamma numeric DEFAULT 0.5, col_to_row_ratio int DEFAULT 10, agg_interval numeric DEFAULT NULL, l int DEFAULT 0, materialize boolean DEFAULT false, model text DEFAULT 'svd', memory_budget text DEFAULT NULL, svd_method text DEFAULT NULL )
 RETURNS void AS $$
 from tspdb.src.pindex.predict import get_prediction_range, get_prediction
 from tspdb.src.pindex.pindex_managment import TSPI
@@ -50,94 +91,174 @@ else:
 # Build index 
 L, T0 = l, t0
 if L == 0:
-  TSPD = TSPI(T = t,T_var = t, rank = k, rank_var =  k_var, gamma = gamma, col_to_row_ratio = col_to_row_ratio, interface= plpyimp(plpy) ,time_column = time_column, value_column = value_column, time_series_table_name = table_name, recreate = True, direct_var = var_direct, index_name = index_name, agg_interval = agg_interval, normalize = normalize, auto_update = auto_update, fill_in_missing = fill_in_missing)
+  TSPD = TSPI(T = t,T_var = t, rank = k, rank_var =  k_var, gamma = gamma, col_to_row_ratio = col_to_row_ratio, interface= plpyimp(plpy) ,time_column = time_column, value_column = value_column, time_series_table_name = table_name, recreate = True, direct_var = var_direct, index_name = index_name, agg_interval = agg_interval, normalize = normalize, auto_update = auto_update, fill_in_missing = fill_in_missing, materialize_denoised = materialize, model_type = model, svd_method = svd_method, memory_budget = memory_budget)
 else:
-  TSPD = TSPI(T = t,T_var = t, rank = k, rank_var =  k_var, gamma = gamma, L = L, interface= plpyimp(plpy) ,time_column = time_column, value_column =value_column , time_series_table_name = table_name, recreate = True, direct_var = var_direct, index_name = index_name, agg_interval = agg_interval, normalize = normalize, auto_update = auto_update, fill_in_missing = fill_in_missing)
+  TSPD = TSPI(T = t,T_var = t, rank = k, rank_var =  k_var, gamma = gamma, L = L, interface= plpyimp(plpy) ,time_column = time_column, value_column =value_column , time_series_table_name = table_name, recreate = True, direct_var = var_direct, index_name = index_name, agg_interval = agg_interval, normalize = normalize, auto_update = auto_update, fill_in_missing = fill_in_missing, materialize_denoised = materialize, model_type = model, svd_method = svd_method, memory_budget = memory_budget)
 plpy.notice('createing pindex: T = %s, L =%s'%(TSPD.ts_model.T,TSPD.ts_model.L,))
+if TSPD.plan is not None:
+  from tspdb.src.pindex.planner import format_memory
+  plpy.notice('memory_budget %s: k = %s, svd_method = %s, estimated peak memory %s'%(memory_budget, TSPD.k, TSPD.svd_method, format_memory(TSPD.plan['estimate']['total'])))
 TSPD.create_index()
 
 $$ LANGUAGE plpython3u;
 
+CREATE or REPLACE FUNCTION create_group_pindex (table_name text, time_column text, value_column text[], index_name text, groups int[] DEFAULT NULL, no_groups int DEFAULT NULL, workers int DEFAULT NULL, fill_in_missing boolean DEFAULT true,"normalize" boolean DEFAULT true,auto_update boolean DEFAULT true, k int DEFAULT Null , k_var int DEFAULT 1, t int DEFAULT 2500000, t0 int DEFAULT 1000,var_direct boolean DEFAULT true,gamma numeric DEFAULT 0.5, col_to_row_ratio int DEFAULT 10, agg_interval numeric DEFAULT NULL, l int DEFAULT 0, model text DEFAULT 'svd' )
+RETURNS setof text AS $$
+from tspdb.src.pindex.group_pindex import create_group_pindex
+from tspdb.src.database_module.plpy_imp import plpyimp
+
+# Build one pindex per group of columns
+kwargs = dict(T = t,T_var = t, rank = k, rank_var =  k_var, gamma = gamma, col_to_row_ratio = col_to_row_ratio, direct_var = var_direct, normalize = normalize, auto_update = auto_update, fill_in_missing = fill_in_missing, model_type = model)
+if l != 0:
+  kwargs['L'] = l
+group_names = create_group_pindex(plpyimp(plpy), table_name, time_column, value_column, index_name, groups = groups, no_groups = no_groups, workers = workers, agg_interval = agg_interval, **kwargs)
+plpy.notice('created column-group pindex %s with %s groups'%(index_name, len(group_names)))
+return group_names
+$$ LANGUAGE plpython3u;
+
+CREATE or REPLACE FUNCTION tune_pindex (table_name text, time_column text, value_column text[], t int[] DEFAULT '{250000,2500000}', l int[] DEFAULT NULL, k int[] DEFAULT NULL, col_to_row_ratio int[] DEFAULT '{1,10,50}', holdout double precision DEFAULT 0.2, eta int DEFAULT 3, t0 int DEFAULT 1000, workers int DEFAULT NULL, agg_interval numeric DEFAULT NULL,
+  OUT best boolean, OUT t_ bigint, OUT l_ bigint, OUT k_ bigint, OUT col_to_row_ratio_ double precision, OUT training_size bigint, OUT score double precision, OUT imputation_score double precision, OUT fit_seconds double precision, OUT no_parameters bigint)
+RETURNS setof record AS $$
+from tspdb.src.pindex.tune import tune_pindex
+from tspdb.src.database_module.plpy_imp import plpyimp
+# search the candidate parameters of create_pindex by successive halving, return the cost/accuracy frontier
+best, frontier = tune_pindex(plpyimp(plpy), table_name, time_column, value_column, T = t, L = l or [None], k = k or [None], col_to_row_ratio = col_to_row_ratio,
+                             holdout = holdout, eta = eta, T0 = t0, workers = workers, agg_interval = agg_interval)
+plpy.notice('best parameters: t = %s, l = %s, k = %s, col_to_row_ratio = %s'%(best['T'], best['L'], best['k'], best['col_to_row_ratio']))
+rows = []
+for row in frontier.to_dict('records'):
+  params = {key: row[key] for key in ['T', 'L', 'k', 'col_to_row_ratio']}
+  rows.append((params == best, row['T'], row['L'], row['k'], row['col_to_row_ratio'], row['budget'], row['score'], row['imputation_score'], row['fit_seconds'], row['no_parameters']))
+return rows
+$$ LANGUAGE plpython3u;
+
 
 
 
 CREATE or REPLACE FUNCTION predict (table_name text, value_column text, t int,  index_name text, uq boolean DEFAULT true, uq_method text DEFAULT 'Gaussian', c double precision DEFAULT 95, projected boolean DEFAULT false,  OUT prediction numeric, OUT LB numeric,OUT UB numeric)
 AS $$
 
-from tspdb.src.pindex.predict import get_prediction
-from tspdb.src.database_module.plpy_imp import plpyimp
+from tspdb.src.database_module.plpy_cache import get_interface, get_function
+get_prediction = get_function(GD, 'tspdb.src.pindex.predict', 'get_prediction')
 #check if index exist or if there exist index that is implemented for column 
 
 # get 
 index_name_ = 'tspdb.'+index_name
 if not uq:
-  prediction = get_prediction( index_name_, table_name, value_column, plpyimp(plpy), t, uq, projected = projected)
+  prediction = get_prediction( index_name_, table_name, value_column, get_interface(GD, plpy), t, uq, projected = projected)
   return prediction, 0,0
 else: 
-  prediction,interval = get_prediction( index_name_, table_name, value_column,  plpyimp(plpy), t, uq, projected = projected, uq_method = uq_method, c = c)
+  prediction,interval = get_prediction( index_name_, table_name, value_column,  get_interface(GD, plpy), t, uq, projected = projected, uq_method = uq_method, c = c)
   return prediction, prediction-interval, prediction+ interval
 $$ LANGUAGE plpython3u;
 
 CREATE or REPLACE FUNCTION predict (table_name text, value_column text, t text,  index_name text, uq boolean DEFAULT true, uq_method text DEFAULT 'Gaussian', c double precision DEFAULT 95,projected boolean DEFAULT false,  OUT prediction numeric, OUT LB numeric,OUT UB numeric)
 AS $$
 
-from tspdb.src.pindex.predict import get_prediction
-from tspdb.src.database_module.plpy_imp import plpyimp
+from tspdb.src.database_module.plpy_cache import get_interface, get_function
+get_prediction = get_function(GD, 'tspdb.src.pindex.predict', 'get_prediction')
 #check if index exist or if there exist index that is implemented for column 
 
 # get 
 index_name_ = 'tspdb.'+index_name
 if not uq:
-  prediction = get_prediction( index_name_, table_name, value_column, plpyimp(plpy), t, uq, projected = projected)
+  prediction = get_prediction( index_name_, table_name, value_column, get_interface(GD, plpy), t, uq, projected = projected)
   return prediction, 0,0
 else: 
-  prediction,interval = get_prediction( index_name_, table_name, value_column, plpyimp(plpy), t, uq, projected = projected, uq_method = uq_method, c = c)
+  prediction,interval = get_prediction( index_name_, table_name, value_column, get_interface(GD, plpy), t, uq, projected = projected, uq_method = uq_method, c = c)
   return prediction, prediction-interval, prediction+ interval
 $$ LANGUAGE plpython3u;
 
 CREATE or REPLACE FUNCTION predict (table_name text, value_column text,  t1 int, t2 int,  index_name text, uq boolean DEFAULT true, uq_method text DEFAULT 'Gaussian', c double precision DEFAULT 95, projected boolean DEFAULT false,OUT prediction numeric, OUT LB numeric,OUT UB numeric)
 RETURNS SETOF record AS $$
-from tspdb.src.pindex.predict import get_prediction_range
-from tspdb.src.database_module.plpy_imp import plpyimp
+from tspdb.src.database_module.plpy_cache import get_interface, get_function
+from tspdb.src.database_module.predict_cache import cached_prediction_range
+get_prediction_range = get_function(GD, 'tspdb.src.pindex.predict', 'get_prediction_range')
 
 #check if index exist or if there exist index that is implemented for column 
 index_name_ = 'tspdb.'+index_name
-# get 
+# get, reusing the result of an identical query if the pindex was not updated since
 if not uq:
-  prediction = get_prediction_range( index_name_, table_name, value_column, plpyimp(plpy), t1,t2, uq, projected = projected)
+  prediction = cached_prediction_range(GD, plpy, get_prediction_range, get_interface(GD, plpy), index_name_, table_name, value_column, t1, t2, uq, projected = projected)
   return zip(prediction, prediction,prediction)
 else: 
-  prediction,interval = get_prediction_range( index_name_, table_name, value_column, plpyimp(plpy), t1,t2,uq, projected = projected, uq_method = uq_method, c = c)
+  prediction,interval = cached_prediction_range(GD, plpy, get_prediction_range, get_interface(GD, plpy), index_name_, table_name, value_column, t1, t2, uq, uq_method = uq_method, c = c, projected = projected)
   return zip(prediction, prediction-interval, prediction+ interval)
 $$ LANGUAGE plpython3u;
 
 CREATE or REPLACE FUNCTION predict (table_name text, value_column text,  t1 text, t2 text,  index_name text, uq boolean DEFAULT true, uq_method text DEFAULT 'Gaussian', c double precision DEFAULT 95,projected boolean DEFAULT false, OUT prediction numeric, OUT LB numeric,OUT UB numeric)
 RETURNS SETOF record AS $$
-from tspdb.src.pindex.predict import get_prediction_range
-from tspdb.src.database_module.plpy_imp import plpyimp
+from tspdb.src.database_module.plpy_cache import get_interface, get_function
+from tspdb.src.database_module.predict_cache import cached_prediction_range
+get_prediction_range = get_function(GD, 'tspdb.src.pindex.predict', 'get_prediction_range')
 
 #check if index exist or if there exist index that is implemented for column 
 index_name_ = 'tspdb.'+index_name
-# get 
+# get, reusing the result of an identical query if the pindex was not updated since
 if not uq:
-  prediction = get_prediction_range( index_name_, table_name, value_column, plpyimp(plpy), t1,t2, uq,projected = projected)
+  prediction = cached_prediction_range(GD, plpy, get_prediction_range, get_interface(GD, plpy), index_name_, table_name, value_column, t1, t2, uq, projected = projected)
   return zip(prediction, prediction,prediction)
 else: 
-  prediction,interval = get_prediction_range( index_name_, table_name, value_column,  plpyimp(plpy), t1,t2,uq, uq_method = uq_method, c = c,projected = projected)
+  prediction,interval = cached_prediction_range(GD, plpy, get_prediction_range, get_interface(GD, plpy), index_name_, table_name, value_column, t1, t2, uq, uq_method = uq_method, c = c, projected = projected)
   return zip(prediction, prediction-interval, prediction+ interval)
 $$ LANGUAGE plpython3u;
 
 CREATE or REPLACE FUNCTION forecast_next (table_name text, value_column text, time_column text ,  index_name text, ahead int DEFAULT 1,  averaging text DEFAULT 'average', uq boolean DEFAULT true, uq_method text DEFAULT 'Gaussian', c double precision DEFAULT 95)
 RETURNS setof numeric AS $$
-from tspdb.src.database_module.plpy_imp import plpyimp
-from tspdb.src.pindex.predict import forecast_next
+from tspdb.src.database_module.plpy_cache import get_interface, get_function
+forecast_next = get_function(GD, 'tspdb.src.pindex.predict', 'forecast_next')
 
 #check if index exist or if there exist index that is implemented for column 
 index_name_ = 'tspdb.'+index_name
-a = forecast_next(index_name_,table_name, value_column, time_column, plpyimp(plpy), ahead = ahead,  averaging = averaging)
+a = forecast_next(index_name_,table_name, value_column, time_column, get_interface(GD, plpy), ahead = ahead,  averaging = averaging)
 return a
 $$ LANGUAGE plpython3u;
 
+CREATE or REPLACE FUNCTION backtest_pindex(index_name text, value_columns text[], origins bigint[], horizon int, uq boolean DEFAULT true, uq_method text DEFAULT 'Gaussian', c double precision DEFAULT 95, averaging text DEFAULT 'average', projected boolean DEFAULT false, OUT column_name text, OUT horizon_step int, OUT wape double precision, OUT rmse double precision, OUT coverage double precision, OUT no_origins bigint)
+RETURNS setof record AS $$
+from tspdb.src.database_module.plpy_cache import get_interface, get_function
+backtest_pindex = get_function(GD, 'tspdb.src.pindex.backtest', 'backtest_pindex')
+# forecast horizon points after every origin, for all columns, and return the error metrics per column and horizon
+result = backtest_pindex(get_interface(GD, plpy), 'tspdb.'+index_name, value_columns, origins, horizon, uq = uq, uq_method = uq_method, c = c, averaging = averaging, projected = projected)
+return [(row.column, int(row.horizon), float(row.wape), float(row.rmse), float(row.coverage), int(row.no_origins)) for row in result.itertuples(index = False)]
+$$ LANGUAGE plpython3u;
+
+CREATE or REPLACE FUNCTION backtest_pindex(index_name text, value_columns text[], origins timestamp[], horizon int, uq boolean DEFAULT true, uq_method text DEFAULT 'Gaussian', c double precision DEFAULT 95, averaging text DEFAULT 'average', projected boolean DEFAULT false, OUT column_name text, OUT horizon_step int, OUT wape double precision, OUT rmse double precision, OUT coverage double precision, OUT no_origins bigint)
+RETURNS setof record AS $$
+from tspdb.src.database_module.plpy_cache import get_interface, get_function
+backtest_pindex = get_function(GD, 'tspdb.src.pindex.backtest', 'backtest_pindex')
+# forecast horizon points after every origin, for all columns, and return the error metrics per column and horizon
+result = backtest_pindex(get_interface(GD, plpy), 'tspdb.'+index_name, value_columns, origins, horizon, uq = uq, uq_method = uq_method, c = c, averaging = averaging, projected = projected)
+return [(row.column, int(row.horizon), float(row.wape), float(row.rmse), float(row.coverage), int(row.no_origins)) for row in result.itertuples(index = False)]
+$$ LANGUAGE plpython3u;
+
+CREATE or REPLACE FUNCTION export_pindex(index_name text, path text, format text DEFAULT NULL)
+RETURNS void AS $$
+from tspdb.src.database_module.plpy_cache import get_interface, get_function
+export_pindex = get_function(GD, 'tspdb.src.pindex.snapshot', 'export_pindex')
+# write a snapshot of the pindex tables on the database server: a directory of .npy files, or an HDF5 file if path ends with .h5
+export_pindex(get_interface(GD, plpy), 'tspdb.'+index_name, path, format = format)
+$$ LANGUAGE plpython3u;
+
+CREATE or REPLACE FUNCTION import_pindex(path text, index_name text DEFAULT NULL, format text DEFAULT NULL)
+RETURNS text AS $$
+from tspdb.src.database_module.plpy_cache import get_interface, get_function
+import_pindex = get_function(GD, 'tspdb.src.pindex.snapshot', 'import_pindex')
+# create a pindex from a snapshot written by export_pindex, e.g. in another database
+return import_pindex(get_interface(GD, plpy), path, index_name, format = format)
+$$ LANGUAGE plpython3u;
+
+-- export_pindex and import_pindex write and read arbitrary paths on the database server as the server's OS user, like
+-- COPY TO/FROM a file: only superusers may call them unless granted, e.g. GRANT EXECUTE ON FUNCTION export_pindex(text, text, text) TO some_role
+REVOKE EXECUTE ON FUNCTION export_pindex(text, text, text) FROM PUBLIC;
+REVOKE EXECUTE ON FUNCTION import_pindex(text, text, text) FROM PUBLIC;
+
+CREATE or REPLACE FUNCTION tspdb_warmup(full boolean DEFAULT true, OUT module text, OUT import_seconds double precision)
+RETURNS setof record AS $$
+from tspdb.src.database_module.plpy_cache import warmup
+return warmup(GD, plpy, full)
+$$ LANGUAGE plpython3u;
+
 
 
 CREATE or REPLACE FUNCTION update_pindex(index_name text)
@@ -199,11 +320,25 @@ $$;
 
 
 
-CREATE or REPLACE FUNCTION pindices_stat(OUT index_name text,OUT column_name text, OUT number_of_observations bigint, OUT number_of_trained_models bigint, OUT imputation_score double precision,  OUT forecast_score double precision, OUT test_forecast_score double precision)
-RETURNS setof record LANGUAGE SQL AS $$
-select * from tspdb.pindices_stats;
+CREATE or REPLACE FUNCTION pindices_stat(OUT index_name text,OUT column_name text, OUT number_of_observations bigint, OUT number_of_trained_models bigint, OUT imputation_score double precision,  OUT forecast_score double precision, OUT test_forecast_score double precision, OUT cache_hits bigint, OUT cache_misses bigint, OUT cache_hit_ratio double precision, OUT cache_saved_seconds double precision)
+RETURNS setof record LANGUAGE plpython3u AS $$
+from tspdb.src.database_module.predict_cache import get_cache, flush_stats
+# add the predict cache statistics of this session before reporting them
+flush_stats(plpy, get_cache(GD))
+return plpy.execute("""select a.*, coalesce(b.hits, 0) as cache_hits, coalesce(b.misses, 0) as cache_misses,
+  case when coalesce(b.hits + b.misses, 0) = 0 then NULL else b.hits::double precision/(b.hits + b.misses) end as cache_hit_ratio,
+  coalesce(b.saved_seconds, 0) as cache_saved_seconds
+  from tspdb.pindices_stats as a left join tspdb.predict_cache_stats as b
+  on a.index_name = b.index_name and a.column_name = b.column_name""")
 $$;
 
+CREATE or REPLACE FUNCTION predict_cache_config(max_values bigint DEFAULT 1000000, shared boolean DEFAULT false)
+RETURNS void AS $$
+# size (in predicted values) of the predict cache of this session, and whether results are shared through tspdb.predict_cache
+from tspdb.src.database_module.predict_cache import configure
+configure(GD, max_values, shared)
+$$ LANGUAGE plpython3u;
+
 
 CREATE or REPLACE FUNCTION get_lowerbound(table_name text, value_column text, time_column text, number_of_observations int DEFAULT 1000, samples int DEFAULT 100, k int DEFAULT 3, discretization_method text DEFAULT 'quantization')
 RETURNS  numeric LANGUAGE plpython3u AS $$
@@ -218,7 +353,26 @@ nan_sum = np.sum(pd.isna(df[value_column]))
 if nan_sum>0:
   plpy.notice('THe lower bound cannot be estimated if there are missing values. The column you selected has %s NaNs in the last %s observations'%(nan_sum,number_of_observations))
   return np.nan
-lb = get_lower_bound(df[value_column], samples=samples, k=k, discretization_method=discretization_method)
+# calibrations of the compression ratio -> entropy regression: shipped ones and the ones stored in tspdb.tslb_calibration
+from tspdb.src.tslb.src.calibration import db_calibration, store_db_calibration
+calibration = db_calibration(GD, plpy)
+lb = get_lower_bound(df[value_column], samples=samples, k=k, discretization_method=discretization_method, calibration=calibration)
+# store the calibrations fitted by this call
+store_db_calibration(plpy, calibration)
 return lb
 $$;
 
+CREATE or REPLACE FUNCTION get_lowerbounds(table_name text, value_columns text[], time_column text, "window" int DEFAULT 1000, step int DEFAULT NULL, samples int DEFAULT 100, k int DEFAULT 3, discretization_method text DEFAULT 'quantization', OUT column_name text, OUT window_start text, OUT window_end text, OUT lower_bound double precision)
+RETURNS SETOF record LANGUAGE plpython3u AS $$
+import pandas as pd
+from tspdb.src.tslb.tslb import get_lower_bounds
+from tspdb.src.tslb.src.calibration import db_calibration, store_db_calibration
+sql_query = "Select " + time_column + "," + ",".join(value_columns) + " from " + table_name + " order by " + time_column
+df = pd.DataFrame([row for row in plpy.execute(sql_query)], columns = [time_column] + list(value_columns)).set_index(time_column)
+calibration = db_calibration(GD, plpy)
+result = get_lower_bounds(df, window, step=step, samples=samples, k=k, discretization_method=discretization_method, calibration=calibration)
+store_db_calibration(plpy, calibration)
+for row in result.itertuples(index=False):
+  yield (row.column, str(row.window_start), str(row.window_end), None if pd.isna(row.lower_bound) else float(row.lower_bound))
+$$;
+
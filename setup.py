@@ -9,4 +9,4 @@ setup(name='tspdb',
       install_requires=['numpy','h5py', 'pandas','sklearn','scikit-learn', 'scipy','sqlalchemy'],
       zip_safe=False,
       include_package_data=True,
-      package_data={'tspdb': ['tests/testdata/tables/*.csv']})
+      package_data={'tspdb': ['tests/testdata/tables/*.csv', 'src/tslb/src/calibration.npz']})
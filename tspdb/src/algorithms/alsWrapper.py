@@ -8,23 +8,50 @@ from tspdb.src import tsUtils
 
 class ALSWrapper:
 
-    def __init__(self, matrix, method='als'):
-        if (type(matrix) != np.ndarray):
+    # matrix:   (np.ndarray) the matrix to factorize, missing entries are NaN.
+    #           (scipy.sparse matrix) the stored entries are the observations, all other entries are missing.
+    # sparse:   (Boolean) defaults to False. If True, the observation mask and the observed values are kept in
+    #           sparse (CSR) matrices, so that each iteration costs O(nnz * k^2) instead of O(N * M * k^2).
+    #           It is always True for scipy.sparse input.
+    def __init__(self, matrix, method='als', sparse=False):
+        from scipy import sparse as sp
+        if sp.issparse(matrix):
+            coo = matrix.tocoo()
+            self.sparse = True
+            (self.N, self.M) = coo.shape
+            rows, cols, values = coo.row, coo.col, coo.data.astype(np.float64)
+
+        elif (type(matrix) != np.ndarray):
             raise Exception('ALSWrapper required matrix to be of type np.ndarray')
 
+        else:
+            self.sparse = sparse
+            (self.N, self.M) = np.shape(matrix)
+            mask = np.isnan(matrix)
+            if self.sparse:
+                (rows, cols) = np.nonzero(~mask)
+                values = matrix[rows, cols].astype(np.float64)
+
         self.methods = ['als']
 
-        self.matrix = matrix
+        if self.sparse:
+            # observed entries, and the mask/values in CSR format (values are zero at missing entries)
+            self.rows, self.cols, self.values = rows, cols, values
+            self.W = sp.csr_matrix((np.ones(len(values)), (rows, cols)), shape=(self.N, self.M))
+            self.matrix = sp.csr_matrix((values, (rows, cols)), shape=(self.N, self.M))
+
+        else:
+            self.matrix = matrix
 
-        (self.N, self.M) = np.shape(matrix)
+            self.W = np.zeros([self.N, self.M])
+            self.W[mask == True] = 0.0
+            self.W[mask == False] = 1.0
+            self.W = self.W.astype(np.float64, copy=False)
 
-        self.W = np.zeros([self.N, self.M])
-        mask = np.isnan(self.matrix)
-        self.W[mask == True] = 0.0
-        self.W[mask == False] = 1.0
-        self.W = self.W.astype(np.float64, copy=False)
+            self.matrix[mask == True] = 0.0
 
-        self.matrix[mask == True] = 0.0
+        self.U = None
+        self.V = None
 
         if (method not in self.methods):
             print("The methods specified (%s) if not a valid option. Defaulting to ALS" %method)
@@ -33,15 +60,47 @@ class ALSWrapper:
         else:
             self.method = method
 
+    # solve the regularized least squares problems of all rows of X at once, with the factors F fixed:
+    #   min_f ||W_r * (X_r - f F)||^2 + lambda_ ||f||^2  for each row r
+    # the k x k normal equations of all rows are formed with one product W (F o F)^T, where (F o F) stacks the
+    # k^2 products of pairs of factor rows, and solved with a batched np.linalg.solve
+    # W:        (N x M) observation mask (np.ndarray or scipy.sparse)
+    # X:        (N x M) observations, zero at missing entries
+    # F:        (k x M) fixed factors
+    # returns an (N x k) array
+    def _solveRows(self, W, X, F, lambda_):
+        k = F.shape[0]
+        FF = (F[:, None, :] * F[None, :, :]).reshape(k * k, -1)
+        A = np.asarray(W.dot(FF.T)).reshape(-1, k, k) + lambda_ * np.eye(k)
+        b = np.asarray(X.dot(F.T))
+        try:
+            return np.linalg.solve(A, b[:, :, None])[:, :, 0]
+        except np.linalg.LinAlgError:
+            # singular systems (e.g. rows with no observations and lambda_ = 0): use the pseudo-inverse
+            return np.matmul(np.linalg.pinv(A), b[:, :, None])[:, :, 0]
+
     # run the ALS algorithm
     # k is the number of factors
-    def decompose(self, k, lambda_, iterations, tol):
-
-        middleVal = 0.5 * (np.max(self.matrix) + np.min(self.matrix))
-
-        # initialize randomly
-        U = middleVal * np.random.rand(self.N, k) 
-        V = middleVal * np.random.rand(k, self.M)
+    # U, V: (optional) initial factors (N x k and k x M), e.g. the factors of a previous decomposition (warm start).
+    #       Only one of them is needed: if V is given the first iteration starts from it, otherwise V is first solved from U.
+    #       If both are None, V is initialized randomly.
+    def decompose(self, k, lambda_, iterations, tol, U=None, V=None, verbose=True):
+
+        WT = self.W.T
+        XT = self.matrix.T
+        if self.sparse:
+            WT, XT = WT.tocsr(), XT.tocsr()
+
+        if V is None:
+            if U is None:
+                observed = self.values if self.sparse else self.matrix[self.W == 1]
+                middleVal = 0.5 * (np.max(observed) + np.min(observed)) if len(observed) > 0 else 0.0
+
+                # initialize randomly
+                V = middleVal * np.random.rand(k, self.M)
+            else:
+                V = self._solveRows(WT, XT, np.asarray(U, dtype=np.float64).T, lambda_).T
+        V = np.array(V, dtype=np.float64)
 
         # fix max iterations
         maxIter = iterations
@@ -49,23 +108,11 @@ class ALSWrapper:
         pastError = np.inf
         for ii in range(maxIter):
             # first U matrix with V fixed
-            for u, Wu in enumerate(self.W):
-                left = np.linalg.pinv(np.dot(V, np.dot(np.diag(Wu), V.T)) + lambda_ * np.eye(k))
-                right = np.dot(V, np.dot(np.diag(Wu), self.matrix[u].T))
-                U[u] = np.dot(left, right).T
-
-                    #np.linalg.solve(np.dot(V, np.dot(np.diag(Wu), V.T)) + lambda_ * np.eye(k),
-                              # np.dot(V, np.dot(np.diag(Wu), self.matrix[u].T))).T
+            U = self._solveRows(self.W, self.matrix, V, lambda_)
 
             # now V matrix with U fixed
-            for i, Wi in enumerate(self.W.T):
-                left = np.linalg.pinv(np.dot(U.T, np.dot(np.diag(Wi), U)) + lambda_ * np.eye(k))
-                right = np.dot(U.T, np.dot(np.diag(Wi), self.matrix[:, i]))
-                V[:,i] = np.dot(left, right).T
-
-                #np.linalg.solve(np.dot(U.T, np.dot(np.diag(Wi), U)) + lambda_ * np.eye(k),
-                          #       np.dot(U.T, np.dot(np.diag(Wi), self.matrix[:, i])))
-            
+            V = self._solveRows(WT, XT, U.T, lambda_).T
+
             # compute MSE
             err = self.getError(self.matrix, U, V, self.W)
 
@@ -76,18 +123,28 @@ class ALSWrapper:
             else:
                 pastError = err
 
-            if (ii%10 == 0):
+            if (ii%10 == 0 and verbose):
                 print("Iteration %d, Err = %0.4f, DeltaErr = %0.4f" %(ii+1, pastError, deltaErr))
 
-        print('Total Iterations = %d' %(ii+1))
+        if verbose:
+            print('Total Iterations = %d' %(ii+1))
+        self.U, self.V = U, V
         return (U,V)
         
 
 
+    # solve the column factors (k x M) with the row factors U (N x k) fixed, e.g. to add new columns to a decomposition
+    def foldIn(self, U, lambda_):
+        WT = self.W.T
+        XT = self.matrix.T
+        if self.sparse:
+            WT, XT = WT.tocsr(), XT.tocsr()
+        return self._solveRows(WT, XT, np.asarray(U, dtype=np.float64).T, lambda_).T
+
     # get the matrix reconstruction using k factors and missing data
-    def reconstructMatrix(self, k, lambda_, returnMatrix=True, iterations=1000, tol=1e-6):
+    def reconstructMatrix(self, k, lambda_, returnMatrix=True, iterations=1000, tol=1e-6, U=None, V=None, verbose=True):
 
-        (Uk, Vk) = self.decompose(k, lambda_, iterations, tol)
+        (Uk, Vk) = self.decompose(k, lambda_, iterations, tol, U=U, V=V, verbose=verbose)
         if (returnMatrix == True):
             return np.dot(Uk, Vk)
         else:
@@ -96,6 +153,10 @@ class ALSWrapper:
 
     # MSE function for the ALS algorithm
     def getError(self, Q, U, V, W):
+        if self.sparse:
+            # only the observed entries contribute to the error
+            residuals = self.values - np.einsum('ij,ji->i', U[self.rows], V[:, self.cols])
+            return np.sum(residuals**2) / (self.N * self.M)
         return np.mean((W * (Q - np.dot(U, V)))**2)
 
 # ##################################################
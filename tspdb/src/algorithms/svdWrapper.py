@@ -12,7 +12,10 @@ class SVDWrapper:
         if (type(matrix) != np.ndarray):
             raise Exception('SVDWrapper required matrix to be of type np.ndarray')
 
-        self.methods = ['numpy']
+        # 'numpy': full thin SVD (LAPACK gesdd). 'gram': eigendecomposition of the smaller Gram matrix, the singular
+        # vectors of the larger dimension are only computed for the top k singular values, which avoids the
+        # min(N,M) x max(N,M) factor and the gesdd workspace
+        self.methods = ['numpy', 'gram']
 
         self.matrix = matrix
         self.U = None
@@ -33,9 +36,13 @@ class SVDWrapper:
     # method will set the self.U and self.V singular vector matrices and the singular value array: self.s
     # U, s, V can then be access separately as attributed of the SVDWrapper class
     def decompose(self):
-        # default is numpy's linear algebra library
-        (self.U, self.s, self.V) = np.linalg.svd(self.matrix, full_matrices=False)
-        
+        if self.method == 'gram':
+            self._decomposeGram()
+        else:
+            # default is numpy's linear algebra library
+            (self.U, self.s, self.V) = np.linalg.svd(self.matrix, full_matrices=False)
+            # correct the dimensions of V
+            self.V = self.V.T
         # S = np.cumsum(self.s**2)
         # S = S/S[-1]
         # k = np.argmax(S>self.threshold)+1
@@ -43,9 +50,23 @@ class SVDWrapper:
         omega = 0.56*b**3-0.95*b**2+1.43+1.82*b
         thre = omega*np.median(self.s)
         k = max(len(self.s[self.s>thre]), 1)
-        # correct the dimensions of V
-        self.V = self.V.T
         return k
+
+    # singular values and the singular vectors of the smaller dimension from the eigendecomposition of the Gram matrix.
+    # the other singular vectors are set in decomposeTopK
+    def _decomposeGram(self):
+        transposed = self.N > self.M
+        gram = np.dot(self.matrix.T, self.matrix) if transposed else np.dot(self.matrix, self.matrix.T)
+        eigenvalues, vectors = np.linalg.eigh(gram)
+        del gram
+        order = np.argsort(eigenvalues)[::-1]
+        self.s = np.sqrt(np.clip(eigenvalues[order], 0, None))
+        vectors = vectors[:, order]
+        if transposed:
+            self.U, self.V = None, vectors
+        else:
+            self.U, self.V = vectors, None
+        self._transposed = transposed
     # get the top K singular values and corresponding singular vector matrices
     def decomposeTopK(self, k):
 
@@ -58,7 +79,7 @@ class SVDWrapper:
             elif (k > np.min([self.M, self.N])):
                 k = np.min([self.M, self.N])
 
-        if ((self.U is None) | (self.V is None) | (self.s is None)):
+        if (self.s is None):
             est_k = self.decompose() # first perform the full decomposition
         if k is None:
             k = est_k
@@ -67,6 +88,16 @@ class SVDWrapper:
         else: self.next_sigma  = 0
         
         sk = self.s[0:k]
+        if self.method == 'gram':
+            # singular vectors of the larger dimension, only for the top k (zero for null singular values)
+            inverse = np.divide(1., sk, out = np.zeros(len(sk)), where = sk > 0)
+            if self._transposed:
+                Vk = self.V[:, 0:k]
+                Uk = np.dot(self.matrix, Vk) * inverse
+            else:
+                Uk = self.U[:, 0:k]
+                Vk = np.dot(self.matrix.T, Uk) * inverse
+            return (sk, Uk, Vk)
         Uk = self.U[:, 0:k]
         Vk = self.V[:, 0:k]
 
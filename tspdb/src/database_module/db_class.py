@@ -197,6 +197,36 @@ class Interface(object):
         pass
 
 
+    @abc.abstractmethod
+    def get_factor_rows(self, table_names, factor, ks, predicate, order = 'row_id'):
+        """
+        query the factor matrix (U, S or V) of several pindex tables, e.g. of the mean and variance models, in a single
+        query. Every table is filtered with the same predicate (see db_utils.factor_rows_sql)
+        ----------
+        Parameters
+        ----------
+        table_names: list of strings
+            names of the queried tables
+        
+        factor: string
+            'u', 's' or 'v'
+        
+        ks: list of int
+            number of singular values retained in each table
+
+        predicate: string
+            predicate written as string e.g.  'modelno >= 0 and modelno <= 2'
+
+        order: string optional (default = 'row_id')
+            column ordering the rows of each table
+        ----------
+        Returns
+        ---------- 
+        list of arrays
+            queried values of each table, with the submodel numbers in the first column
+        """
+        pass
+
     @abc.abstractmethod
     def get_coeff(self, table_name, column = 'average'):
         """
@@ -0,0 +1,166 @@
+import numpy as np
+
+
+def interval_microseconds(interval):
+    """
+    bucket width interval (in seconds) in integer microseconds, the resolution of PostgreSQL timestamps. Buckets are
+    computed in integer microseconds both in SQL and in numpy, so that rows on a bucket edge fall in the same bucket
+    """
+    return max(int(round(interval * 10**6)), 1)
+
+
+def bucket_range(origin, interval, start, end):
+    """
+    return the first and last bucket index (inclusive) covering [start, end], where bucket b spans
+    [origin + b*interval, origin + (b+1)*interval). This reproduces the intervals produced by
+    generate_series(origin, end, interval) filtered on end_time > start.
+    ----------
+    Parameters
+    ----------
+    origin: pd.Timestamp
+        timestamp at which bucket 0 starts
+
+    interval: float
+        bucket width in seconds
+
+    start: pd.Timestamp
+        start of the queried range
+
+    end: pd.Timestamp
+        end of the queried range
+    ----------
+    Returns
+    ----------
+    first_bucket, last_bucket: int
+        first and last bucket index in the queried range (last_bucket < first_bucket if the range is empty)
+    """
+    interval_us = interval_microseconds(interval)
+    first_bucket = max((start.value // 1000 - origin.value // 1000) // interval_us, 0)
+    last_bucket = (end.value // 1000 - origin.value // 1000) // interval_us
+    return int(first_bucket), int(last_bucket)
+
+
+def bucket_bounds(origin, interval, first_bucket, last_bucket):
+    """
+    return the [lower, upper) time bounds of the rows falling in buckets first_bucket to last_bucket
+    """
+    import pandas as pd
+    interval_us = interval_microseconds(interval)
+    lower = pd.Timestamp(origin.value // 1000 + first_bucket * interval_us, unit='us')
+    upper = pd.Timestamp(origin.value // 1000 + (last_bucket + 1) * interval_us, unit='us')
+    return lower, upper
+
+
+def bucket_sql(name, index_column, value_columns, agg_function, origin, interval):
+    """
+    build a single-pass aggregation query that assigns each row to its bucket arithmetically and aggregates
+    with one GROUP BY. The bucket is the integer division of the row's offset from origin by the interval, both in
+    microseconds, as bucket_range computes it. The query has two %s placeholders for the lower and upper time bounds
+    (in that order).
+    ----------
+    Parameters
+    ----------
+    name: string
+        quoted name of the time series table
+
+    index_column: string
+        quoted name of the time column
+
+    value_columns: list of strings
+        quoted names of the aggregated columns
+
+    agg_function: string
+        SQL aggregate function (AVG, MIN or MAX)
+
+    origin: pd.Timestamp
+        timestamp at which bucket 0 starts
+
+    interval: float
+        bucket width in seconds
+    """
+    origin_str = origin.strftime('%Y-%m-%d %H:%M:%S.%f')
+    bucket = "(extract(epoch from (m." + index_column + " - '" + origin_str + "'::timestamp))*1000000)::bigint/" + str(interval_microseconds(interval))
+    queried_columns = ','.join([agg_function + "(m." + value + ') "ag_' + value[1:-1] + '"' for value in value_columns])
+    return "select " + bucket + " as bucket, " + queried_columns + " from " + name + " m where m." + index_column + " >= %s::timestamp and m." + index_column + " < %s::timestamp group by bucket order by bucket"
+
+
+def fill_buckets(rows, first_bucket, last_bucket, no_columns, desc=False):
+    """
+    scatter aggregated rows (bucket, value_1, ..., value_n) into a dense array covering all buckets in
+    [first_bucket, last_bucket]. Buckets with no rows are filled with NaN, as the right join would
+    have returned NULL for them.
+    ----------
+    Parameters
+    ----------
+    rows: list of lists
+        queried rows, the first entry of each row is the bucket index
+
+    first_bucket, last_bucket: int
+        bucket range (inclusive)
+
+    no_columns: int
+        number of aggregated columns
+
+    desc: boolean optional (default=false)
+        if true, return the buckets in descending order
+    ----------
+    Returns
+    ----------
+    array, shape [last_bucket - first_bucket + 1, no_columns]
+    """
+    no_buckets = max(last_bucket - first_bucket + 1, 0)
+    output = np.full([no_buckets, no_columns], np.nan)
+    if len(rows) > 0 and no_buckets > 0:
+        rows = np.array(rows, dtype=float)
+        index = rows[:, 0].astype(np.int64) - first_bucket
+        valid = (index >= 0) & (index < no_buckets)
+        output[index[valid], :] = rows[valid, 1:]
+    if desc:
+        output = output[::-1]
+    return output
+
+
+def factor_rows_sql(table_names, factor, ks, predicate, order='row_id'):
+    """
+    build one UNION ALL query that reads the factor columns (factor1 ... factork) of several pindex tables with the
+    same predicate, e.g. the U tables of the mean and variance models. Tables with fewer columns are padded with NULL.
+    ----------
+    Parameters
+    ----------
+    table_names: list of strings
+        names of the queried tables
+
+    factor: string
+        prefix of the factor columns ('u', 's' or 'v')
+
+    ks: list of int
+        number of factor columns of each table
+
+    predicate: string
+        predicate applied to every table
+
+    order: string optional (default='row_id')
+        column ordering the rows of each table
+    ----------
+    Returns
+    ----------
+    query: string
+
+    columns: list of strings
+        names of the returned columns: table_no, modelno and the factor columns
+    """
+    width = max(ks)
+    selects = []
+    for table_no, (table_name, k) in enumerate(zip(table_names, ks)):
+        columns = [factor + str(i) if i <= k else 'NULL::double precision as ' + factor + str(i) for i in range(1, width + 1)]
+        selects.append("SELECT %s as table_no, %s as order_key, modelno, %s FROM %s WHERE %s" % (table_no, order, ','.join(columns), table_name, predicate))
+    columns = ['table_no', 'modelno'] + [factor + str(i) for i in range(1, width + 1)]
+    return ' UNION ALL '.join(selects) + ' order by table_no, order_key;', columns
+
+
+def split_factor_rows(rows, ks):
+    """
+    split the rows returned by a factor_rows_sql query into one array (modelno, factor1 ... factork) per table
+    """
+    rows = np.array(rows, dtype=float).reshape(-1, 2 + max(ks))
+    return [rows[rows[:, 0] == table_no, 1:2 + k] for table_no, k in enumerate(ks)]
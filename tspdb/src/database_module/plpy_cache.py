@@ -0,0 +1,73 @@
+import importlib
+import time
+
+# modules imported by the predict functions, and by the pindex creation and update functions
+PREDICT_MODULES = ['numpy', 'tspdb.src.database_module.plpy_imp', 'tspdb.src.pindex.predict']
+PINDEX_MODULES = ['pandas', 'tspdb.src.pindex.pindex_managment']
+
+def get_interface(GD, plpy):
+    """
+    return the plpyimp interface cached in GD (the plpython global dictionary of the session), creating it on first use
+    ----------
+    Parameters
+    ----------
+    GD: dict
+        plpython global dictionary shared by all functions in the session
+
+    plpy: module
+        plpython module used to execute queries
+    """
+    if 'tspdb_interface' not in GD:
+        from tspdb.src.database_module.plpy_imp import plpyimp
+        GD['tspdb_interface'] = plpyimp(plpy)
+    return GD['tspdb_interface']
+
+def get_function(GD, module, name):
+    """
+    return the function name of module, importing the module on first use and caching the function in GD
+    ----------
+    Parameters
+    ----------
+    GD: dict
+        plpython global dictionary shared by all functions in the session
+
+    module: string
+        full name of the module, e.g. 'tspdb.src.pindex.predict'
+
+    name: string
+        name of the function in module
+    """
+    key = 'tspdb_' + module + '.' + name
+    if key not in GD:
+        GD[key] = getattr(importlib.import_module(module), name)
+    return GD[key]
+
+def warmup(GD, plpy, full = True):
+    """
+    import the modules used by tspdb functions and cache the interface in GD, so that the first query of the session
+    does not pay the import time
+    ----------
+    Parameters
+    ----------
+    GD: dict
+        plpython global dictionary shared by all functions in the session
+
+    plpy: module
+        plpython module used to execute queries
+
+    full: boolean optional (default=true)
+        if true, also import the modules used to create and update pindices (pandas, sklearn, ...)
+    ----------
+    Returns
+    ----------
+    list of (module, seconds)
+        time spent importing each module
+    """
+    modules = PREDICT_MODULES + (PINDEX_MODULES if full else [])
+    timings = []
+    for module in modules:
+        t = time.time()
+        importlib.import_module(module)
+        timings.append((module, time.time() - t))
+    get_interface(GD, plpy)
+    return timings
@@ -1,7 +1,7 @@
 import numpy as np
-import pandas as pd
 from tspdb.src.database_module.db_class import Interface
-from sqlalchemy.types import *
+from tspdb.src.database_module.db_utils import bucket_range, bucket_bounds, bucket_sql, fill_buckets, factor_rows_sql, split_factor_rows
+# pandas and sqlalchemy are imported where used, so that the predict path only imports numpy
 #######################TO DO##########################
 #1 get SUV instead of all getU,getS, getV
 ######################################################
@@ -12,7 +12,7 @@ class plpyimp(Interface):
 
             pass
 
-    def get_time_series(self, name, start, end = None, start_ts = '1970/01/01 00:00:00', value_column="ts", index_column='row_id', Desc=False, interval = 60, aggregation_method = 'average' ):
+    def get_time_series(self, name, start, end = None, start_ts = '1970/01/01 00:00:00', value_column="ts", index_column='row_id', Desc=False, interval = 60, aggregation_method = 'average', bucketed = True ):
 
         """
         query time series table to return equally-spaced time series values from a certain range  [start to end]
@@ -43,6 +43,10 @@ class plpyimp(Interface):
         
         desc: boolean optional (default=false) 
             if true(false),  the returned values are sorted descendingly (ascendingly) according to index_column 
+
+        bucketed: boolean optional (default=true) 
+            if true, timestamps are aggregated by computing each row's bucket arithmetically in a single GROUP BY
+            and empty buckets are filled with NaN in numpy. Otherwise, the rows are range-joined with generate_series intervals.
         ----------
         Returns
         ----------
@@ -65,9 +69,10 @@ class plpyimp(Interface):
                     sql = 'Select ' + ','.join(value_columns_) + " from  " + name + " where " + index_column + " >= "+str(start)+" and " + index_column + " <= "+str(end)+" order by " + index_column + ' Desc'
                 result = self.engine.execute(sql)
            
-            return pd.DataFrame((b for b in result)).values 
+            return np.array([[row[ci] for ci in value_columns] for row in result], dtype = float).reshape(-1, len(value_columns))
 
-        elif  isinstance(start, (pd.Timestamp)) and (isinstance(end, (pd.Timestamp)) or end is None):
+        import pandas as pd
+        if  isinstance(start, (pd.Timestamp)) and (isinstance(end, (pd.Timestamp)) or end is None):
         
             seconds = interval%60
             minutes = int((interval%3600)/60)
@@ -80,6 +85,19 @@ class plpyimp(Interface):
             except KeyError as e:
                 print ('aggregation_method not valid choose from ("average", "min", "max"), Exception: "%s"' % str(e))
                 raise
+            if bucketed:
+                start_ts = pd.Timestamp(start_ts)
+                if end is None:
+                    # all buckets from start to now, starting at start as the generate_series query does
+                    start_ts = start
+                    end = pd.Timestamp(self.engine.execute("SELECT localtimestamp as now")[0]['now'])
+                first_bucket, last_bucket = bucket_range(start_ts, interval, start, end)
+                lower, upper = bucket_bounds(start_ts, interval, first_bucket, last_bucket)
+                sql = bucket_sql(name, index_column, value_columns_, agg_function, start_ts, interval)
+                sql = sql % ("'"+lower.strftime('%Y-%m-%d %H:%M:%S.%f')+"'", "'"+upper.strftime('%Y-%m-%d %H:%M:%S.%f')+"'")
+                result = self.engine.execute(sql)
+                rows = [[row['bucket']] + [row['ag_'+ci] for ci in value_columns] for row in result]
+                return fill_buckets(rows, first_bucket, last_bucket, len(value_columns), desc = Desc)
             ## might be needed
             start_ts_str = start_ts.strftime('%Y-%m-%d %H:%M:%S')
             queried_columns = ','.join([agg_function+"(m."+value+') "ag_'+value[1:-1]+'"' for value in value_columns_])
@@ -338,7 +356,40 @@ class plpyimp(Interface):
         return U,S,V
     
     
+    def get_factor_rows(self, table_names, factor, ks, predicate, order = 'row_id'):
+        """
+        query the factor matrix (U, S or V) of several pindex tables, e.g. of the mean and variance models, in a single
+        query. Every table is filtered with the same predicate (see db_utils.factor_rows_sql)
+        ----------
+        Parameters
+        ----------
+        table_names: list of strings
+            names of the queried tables
+        
+        factor: string
+            'u', 's' or 'v'
+        
+        ks: list of int
+            number of singular values retained in each table
+
+        predicate: string
+            predicate written as string e.g.  'modelno >= 0 and modelno <= 2'
+
+        order: string optional (default = 'row_id')
+            column ordering the rows of each table
+        ----------
+        Returns
+        ---------- 
+        list of arrays
+            queried values of each table, with the submodel numbers in the first column
+        """
+        query, columns = factor_rows_sql(table_names, factor, ks, predicate, order)
+        result = self.engine.execute(query)
+        result = [[row[ci] for ci in columns] for row in result]
+        return split_factor_rows(result, ks)
+
     def sqlalchemy_type_mapper(self, instance):
+        from sqlalchemy.types import Integer, Float, DateTime, Boolean, ARRAY
         if isinstance(instance, Integer):
             return 'bigint'
         elif isinstance(instance, Float):
@@ -561,6 +612,7 @@ class plpyimp(Interface):
             data to be inserted
         """
 
+        import pandas as pd
         row = ["'"+str(i)+"'" if (type(i) is str or type(i) == pd.Timestamp) else i for i in row ]
         row = ["NULL" if pd.isna(i)  else i for i in row ]
         row = [str(i) for i in row]
@@ -706,6 +758,7 @@ class plpyimp(Interface):
         if  isinstance(result[0], (int, np.integer)): 
             return np.median(np.diff(result))
         else:
+            import pandas as pd
             timestamps_float  = [pd.Timestamp(i).timestamp() for i in result]
             return np.median(np.diff(timestamps_float))
 
@@ -0,0 +1,226 @@
+import time
+from collections import OrderedDict
+import numpy as np
+from tspdb.src.pindex.pindex_utils import index_ts_mapper, index_ts_inv_mapper, resolve_index, query_meta, reroute_on_failure
+
+# default maximum number of predicted values kept in the cache of a session
+DEFAULT_MAX_VALUES = 10**6
+# cache statistics are added to tspdb.predict_cache_stats every FLUSH_EVERY lookups
+FLUSH_EVERY = 100
+
+class PredictCache(object):
+    """
+    Bounded LRU cache of predict() range results. Entries are stamped with the version of the pindex they were computed
+    with (tspdb.pindices_versions, bumped by every pindex write and update_pindex call) and, for ranges forecasted from
+    the newest rows of the time series table, the state of those rows (see table_stamp). An entry with another stamp
+    is a miss. The cache is bounded by the total number of predicted values it holds, least recently used entries are
+    evicted first.
+    ----------
+    Parameters
+    ----------
+    max_values: int optional (default=DEFAULT_MAX_VALUES)
+        maximum number of predicted values (summed over entries) kept in the cache
+
+    shared: boolean optional (default=False)
+        if true, results are also stored in the unlogged table tspdb.predict_cache, shared by all sessions
+    """
+    def __init__(self, max_values = DEFAULT_MAX_VALUES, shared = False):
+        self.max_values = max_values
+        self.shared = shared
+        self.entries = OrderedDict()
+        self.no_values = 0
+        # per (index_name, column): [hits, misses, saved seconds], not yet flushed to tspdb.predict_cache_stats
+        self.stats = {}
+        self.lookups = 0
+
+    def get(self, key, version):
+        """
+        return (result, seconds) if key is cached with version, else None
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] != version:
+            self.remove(key)
+            return None
+        self.entries.move_to_end(key)
+        return entry[1], entry[2]
+
+    def put(self, key, version, result, seconds):
+        """
+        cache result (computed in seconds) for key, evicting least recently used entries if needed
+        """
+        self.remove(key)
+        size = result_size(result)
+        if size > self.max_values:
+            return
+        self.entries[key] = (version, result, seconds, size)
+        self.no_values += size
+        while self.no_values > self.max_values:
+            _, entry = self.entries.popitem(last = False)
+            self.no_values -= entry[3]
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.no_values -= entry[3]
+
+    def record(self, index_name, column, hit, seconds = 0.):
+        """
+        record a lookup of (index_name, column), and the time saved if it is a hit
+        """
+        stats = self.stats.setdefault((index_name, column), [0, 0, 0.])
+        if hit:
+            stats[0] += 1
+            stats[2] += seconds
+        else:
+            stats[1] += 1
+        self.lookups += 1
+
+def result_size(result):
+    """
+    number of predicted values in result (an array, or a tuple of arrays if uq)
+    """
+    if isinstance(result, tuple):
+        return sum(len(r) for r in result)
+    return len(result)
+
+def get_cache(GD):
+    """
+    return the predict cache of the session stored in GD (the plpython global dictionary), creating it on first use
+    """
+    if 'tspdb_predict_cache' not in GD:
+        GD['tspdb_predict_cache'] = PredictCache()
+    return GD['tspdb_predict_cache']
+
+def configure(GD, max_values = DEFAULT_MAX_VALUES, shared = False):
+    """
+    set the size of the predict cache of the session and whether results are shared through tspdb.predict_cache.
+    the cached entries are kept if they fit in the new size
+    """
+    cache = get_cache(GD)
+    cache.max_values = max_values
+    cache.shared = shared
+    while cache.no_values > cache.max_values:
+        _, entry = cache.entries.popitem(last = False)
+        cache.no_values -= entry[3]
+    return cache
+
+def pindex_version(plpy, index_name, value_column):
+    """
+    return the version of the pindex queried by (index_name, value_column), following column-group routing
+    (see pindex_utils.resolve_index). The version is bumped every time the pindex is written or update_pindex runs, even
+    if too few points were inserted to update the model, since forecasts read the newest points of the time series table
+    """
+    name = index_name.split('.')[-1]
+    plan = plpy.prepare("select coalesce(max(version), 0) as version from tspdb.pindices_versions where index_name = coalesce("
+                        "(select group_index from tspdb.pindices_groups where index_name = $1 and value_column = $2), $1)", ['text', 'text'])
+    return plpy.execute(plan, [name, value_column])[0]['version']
+
+@reroute_on_failure
+def table_stamp(plpy, interface, index_name, table_name, value_column, t2):
+    """
+    return None if the range of index_name ending at t2 is imputed from the models only, whose changes bump the pindex
+    version. Otherwise the range is forecasted from the newest rows of table_name, which change without a version bump
+    if the pindex has no insert trigger (auto_update => false) or rows are updated or deleted: return the number of rows,
+    last time and checksum of the rows forecasts may read, from max(L, L_var) points before the last point seen by the
+    models (the whole table if no model is fit)
+    """
+    index_name = resolve_index(interface, index_name, value_column)
+    MUpdateIndex, MUpdateIndex_var, L, L_var, value_columns, index_col, start_ts, interval = query_meta(interface, index_name, ['last_TS_inc', 'last_TS_inc_var', 'L', 'L_var', 'indexed_column', 'time_column', 'start_time', 'agg_interval'])
+    no_ts = len(value_columns.split(','))
+    interval = float(interval)
+    if not isinstance(t2, (int, np.integer)):
+        import pandas as pd
+        t2 = pd.to_datetime(t2)
+        start_ts = pd.to_datetime(start_ts)
+    last = (MUpdateIndex - 1)//no_ts
+    if MUpdateIndex > 0 and index_ts_mapper(start_ts, interval, t2) <= last:
+        return None
+    if MUpdateIndex_var > 0:
+        last = min(last, (MUpdateIndex_var - 1)//no_ts)
+    first = max(last - max(L, L_var or 0), 0) if MUpdateIndex > 0 else 0
+    first = index_ts_inv_mapper(start_ts, interval, first)
+    if not isinstance(first, (int, np.integer)):
+        first = "'%s'" % first
+    row = plpy.execute('select count(*) as count, max(tspdb_row."%s")::text as last, sum(hashtext(tspdb_row::text)) as checksum from "%s" as tspdb_row '
+                       'where tspdb_row."%s" >= %s' % (index_col, table_name, index_col, first))[0]
+    return row['count'], row['last'], row['checksum']
+
+def flush_stats(plpy, cache):
+    """
+    add the statistics recorded since the last flush to tspdb.predict_cache_stats
+    """
+    plan = plpy.prepare("insert into tspdb.predict_cache_stats values ($1, $2, $3, $4, $5) on conflict (index_name, column_name) do update set "
+                        "hits = tspdb.predict_cache_stats.hits + excluded.hits, misses = tspdb.predict_cache_stats.misses + excluded.misses, "
+                        "saved_seconds = tspdb.predict_cache_stats.saved_seconds + excluded.saved_seconds", ['text', 'text', 'bigint', 'bigint', 'double precision'])
+    for (index_name, column), (hits, misses, seconds) in cache.stats.items():
+        plpy.execute(plan, [index_name.split('.')[-1], column, hits, misses, float(seconds)])
+    cache.stats = {}
+    cache.lookups = 0
+
+def _shared_get(plpy, key, version):
+    version, stamp = version
+    plan = plpy.prepare("select prediction, interval, seconds from tspdb.predict_cache where key = $1 and version = $2 and stamp is not distinct from $3", ['text', 'bigint', 'text'])
+    rows = plpy.execute(plan, [repr(key), version, None if stamp is None else repr(stamp)])
+    if len(rows) == 0:
+        return None
+    prediction = np.array(rows[0]['prediction'], dtype = float)
+    if rows[0]['interval'] is None:
+        return prediction, rows[0]['seconds']
+    return (prediction, np.array(rows[0]['interval'], dtype = float)), rows[0]['seconds']
+
+def _shared_put(plpy, key, version, result, seconds):
+    version, stamp = version
+    prediction, interval = result if isinstance(result, tuple) else (result, None)
+    plan = plpy.prepare("insert into tspdb.predict_cache values ($1, $2, $3, $4, $5, $6) on conflict (key) do update set version = excluded.version, "
+                        "prediction = excluded.prediction, interval = excluded.interval, seconds = excluded.seconds, stamp = excluded.stamp",
+                        ['text', 'bigint', 'double precision[]', 'double precision[]', 'double precision', 'text'])
+    interval = None if interval is None else [float(v) for v in interval]
+    plpy.execute(plan, [repr(key), version, [float(v) for v in prediction], interval, float(seconds), None if stamp is None else repr(stamp)])
+
+def cached_prediction_range(GD, plpy, get_prediction_range, interface, index_name, table_name, value_column, t1, t2, uq = True, uq_method = 'Gaussian', c = 95., projected = False):
+    """
+    get_prediction_range with a result cache keyed by (index, table, column, t1, t2, uq, uq_method, c, projected) and
+    stamped with the pindex version and, for forecasted ranges, the state of the newest rows of the table (see
+    table_stamp). Returns the prediction, and the interval if uq, as get_prediction_range
+    ----------
+    Parameters
+    ----------
+    GD: dict
+        plpython global dictionary shared by all functions in the session
+
+    plpy: module
+        plpython module used to execute queries
+
+    get_prediction_range: function
+        tspdb.src.pindex.predict.get_prediction_range
+
+    remaining parameters are the same as get_prediction_range
+    """
+    cache = get_cache(GD)
+    key = (index_name, table_name, value_column, t1, t2, bool(uq), uq_method if uq else None, float(c) if uq else None, bool(projected))
+    version = (pindex_version(plpy, index_name, value_column), table_stamp(plpy, interface, index_name, table_name, value_column, t2))
+    cached = cache.get(key, version)
+    if cached is None and cache.shared:
+        cached = _shared_get(plpy, key, version)
+        if cached is not None:
+            cache.put(key, version, cached[0], cached[1])
+    if cached is not None:
+        result, seconds = cached
+        cache.record(index_name, value_column, True, seconds)
+    else:
+        t = time.time()
+        if uq:
+            result = get_prediction_range(index_name, table_name, value_column, interface, t1, t2, uq, projected = projected, uq_method = uq_method, c = c)
+            result = tuple(result)
+        else:
+            result = get_prediction_range(index_name, table_name, value_column, interface, t1, t2, uq, projected = projected)
+        seconds = time.time() - t
+        cache.put(key, version, result, seconds)
+        if cache.shared:
+            _shared_put(plpy, key, version, result, seconds)
+        cache.record(index_name, value_column, False)
+    if cache.lookups >= FLUSH_EVERY:
+        flush_stats(plpy, cache)
+    return result
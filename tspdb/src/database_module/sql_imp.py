@@ -1,4 +1,5 @@
 from tspdb.src.database_module.db_class import Interface
+from tspdb.src.database_module.db_utils import bucket_range, bucket_bounds, bucket_sql, fill_buckets, factor_rows_sql, split_factor_rows
 import psycopg2
 from sqlalchemy import create_engine
 import numpy as np
@@ -17,7 +18,7 @@ class SqlImplementation(Interface):
         self.engine = create_engine(driver + '://' + user + ':' + password + '@' + host + '/' + database)
 
 
-    def get_time_series(self, name, start, end, start_ts = '1970/01/01 00:00:00', connection = None, value_column="ts", index_column='"rowID"', Desc=False, interval = 60, aggregation_method = 'average'):
+    def get_time_series(self, name, start, end, start_ts = '1970/01/01 00:00:00', connection = None, value_column="ts", index_column='"rowID"', Desc=False, interval = 60, aggregation_method = 'average', bucketed = True):
 
         """
         query time series table to return equally-spaced time series values from a certain range  [start to end]
@@ -48,6 +49,10 @@ class SqlImplementation(Interface):
         
         desc: boolean optional (default=false) 
             if true(false),  the returned values are sorted descendingly (ascendingly) according to index_column 
+
+        bucketed: boolean optional (default=true) 
+            if true, timestamps are aggregated by computing each row's bucket arithmetically in a single GROUP BY
+            and empty buckets are filled with NaN in numpy. Otherwise, the rows are range-joined with generate_series intervals.
         ----------
         Returns
         ----------
@@ -86,6 +91,17 @@ class SqlImplementation(Interface):
             except KeyError as e:
                 print ('aggregation_method not valid choose from ("average", "min", "max"), Exception: "%s"' % str(e))
                 raise
+            if bucketed:
+                start_ts = pd.Timestamp(start_ts)
+                if end is None:
+                    # all buckets from start to now, starting at start as the generate_series query does
+                    start_ts = start
+                    end = pd.Timestamp(connection.execute("SELECT localtimestamp").fetchone()[0])
+                first_bucket, last_bucket = bucket_range(start_ts, interval, start, end)
+                lower, upper = bucket_bounds(start_ts, interval, first_bucket, last_bucket)
+                sql = bucket_sql(name, index_column, value_columns, agg_function, start_ts, interval)
+                result = connection.execute(sql, (lower.strftime('%Y-%m-%d %H:%M:%S.%f'), upper.strftime('%Y-%m-%d %H:%M:%S.%f'),)).fetchall()
+                return fill_buckets(result, first_bucket, last_bucket, len(value_columns), desc = Desc)
             ## might be needed
             start_ts_str = start_ts.strftime('%Y-%m-%d %H:%M:%S')
             ## queried columns
@@ -321,6 +337,37 @@ class SqlImplementation(Interface):
         return U,S,V
         
 
+    def get_factor_rows(self, table_names, factor, ks, predicate, order = 'row_id'):
+        """
+        query the factor matrix (U, S or V) of several pindex tables, e.g. of the mean and variance models, in a single
+        query. Every table is filtered with the same predicate (see db_utils.factor_rows_sql)
+        ----------
+        Parameters
+        ----------
+        table_names: list of strings
+            names of the queried tables
+        
+        factor: string
+            'u', 's' or 'v'
+        
+        ks: list of int
+            number of singular values retained in each table
+
+        predicate: string
+            predicate written as string e.g.  'modelno >= 0 and modelno <= 2'
+
+        order: string optional (default = 'row_id')
+            column ordering the rows of each table
+        ----------
+        Returns
+        ---------- 
+        list of arrays
+            queried values of each table, with the submodel numbers in the first column
+        """
+        query, columns = factor_rows_sql(table_names, factor, ks, predicate, order)
+        result = self.engine.execute(query).fetchall()
+        return split_factor_rows(result, ks)
+
     def get_coeff(self, table_name, column):
 
         """
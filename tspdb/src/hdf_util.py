@@ -57,4 +57,26 @@ def transpose_data(A, filename, matrixname):
     f.create_dataset(matrixname, data=A[:].T)
     f.close()
 
+def write_datasets(filename, datasets, attributes = {}):
+    # write the arrays of datasets (name -> matrix) and the file attributes. the datasets are contiguous (no chunking
+    # or compression), so that they can be memory mapped by memmap_datasets
+    with h5py.File(filename, "w") as f:
+        for name, matrix in datasets.items():
+            f.create_dataset(name, data=matrix)
+        for key, value in attributes.items():
+            f.attrs[key] = value
+    return True
 
+def memmap_datasets(filename, mmap = True):
+    # the datasets of filename (name -> array) and the file attributes. contiguous datasets are returned as read-only
+    # np.memmap views of the file, other datasets (and all of them if not mmap) are read into memory
+    datasets = {}
+    with h5py.File(filename, "r") as f:
+        attributes = dict(f.attrs)
+        for name, dataset in f.items():
+            offset = dataset.id.get_offset() if mmap else None
+            if offset is None:
+                datasets[name] = dataset[()]
+            else:
+                datasets[name] = np.memmap(filename, dtype=dataset.dtype, mode='r', offset=offset, shape=dataset.shape)
+    return datasets, attributes
@@ -0,0 +1,213 @@
+import numpy as np
+from statistics import NormalDist
+from tspdb.src.pindex.pindex_utils import index_ts_mapper, index_ts_inv_mapper, resolve_index, reroute_on_failure
+from tspdb.src.pindex.predict import _get_imputation_range, _get_projected_coeff
+from tspdb.src.tsUtils import fill_missing
+
+def forecast_windows(windows, coeffs, coeffs_projected, intercepts, horizon):
+    """
+    Recursively forecast horizon steps after each row of windows, as _get_forecast_range does for a single range, for
+    all rows at once
+    ----------
+    Parameters
+    ----------
+    windows: array, shape [no_windows, no_coeff]
+        the no_coeff values preceding each forecast origin (oldest first)
+
+    coeffs: array, shape [no_coeff]
+        forecasting coefficients (oldest lag first)
+
+    coeffs_projected: array, shape [no_coeff]
+        coefficients used for the first no_coeff steps (see write_projected_coefficients)
+
+    intercepts: array, shape [no_windows]
+        intercept of each window's time series
+
+    horizon: int
+        number of forecasted steps
+    ----------
+    Returns
+    ----------
+    array, shape [no_windows, horizon]
+        forecasts at the origins (first column) to the origins + horizon - 1 (last column)
+    """
+    no_coeff = len(coeffs)
+    values = np.zeros([len(windows), no_coeff + horizon])
+    values[:, :no_coeff] = windows
+    for h in range(horizon):
+        c = coeffs_projected if h < no_coeff else coeffs
+        values[:, no_coeff + h] = np.dot(values[:, h:h + no_coeff], c) + intercepts
+    return values[:, no_coeff:]
+
+def fill_observations(obs, p = 1.0):
+    """
+    a copy of obs with the missing observations filled as the forecast path does (see _get_forecast_observations):
+    with zeros (rescaled by p) if p < 1, otherwise forward filled, and backward filled at the start
+    """
+    filled = fill_missing(np.array(obs, dtype = float), p >= 1)
+    if p < 1:
+        filled /= p
+    return filled
+
+def _get_coefficients(interface, index_name, no_ts, averaging, projected):
+    coeffs = np.array(interface.get_coeff(index_name + '_c_view', averaging), dtype = float)
+    intercepts = coeffs[-no_ts:]
+    coeffs = coeffs[:-no_ts]
+    coeffs_projected = coeffs
+    if projected:
+        coeffs_projected = _get_projected_coeff(interface, index_name, averaging, no_ts)[:-no_ts]
+    return coeffs, coeffs_projected, intercepts
+
+def _backtest_index(interface, index_name, value_columns, origins, horizon, uq, alpha, averaging, projected):
+    """
+    backtest the columns value_columns of index_name (not a column-group pindex).
+    Returns the forecasts, actual values and deviations (NaN if not uq), each of shape [no_columns, no_origins, horizon]
+    """
+    T, L, k_var, L_var, T_var, last_model, var_direct, interval, start_ts, index_col, indexed_columns, MUpdateIndex_var, p, table_name = interface.query_table(index_name + '_meta', ['T', 'L', 'k_var', 'L_var', 'T_var', 'no_submodels', 'var_direct_method', 'agg_interval', 'start_time', 'time_column', 'indexed_column', 'last_TS_inc_var', 'p', 'time_series_table_name'])[0]
+    last_model -= 1
+    indexed_columns = indexed_columns.split(',')
+    no_ts = len(indexed_columns)
+    try: value_indices = [indexed_columns.index(column) for column in value_columns]
+    except: raise Exception('The value columns %s are not all indexed by the chosen pindex' % (value_columns,))
+    interval = float(interval)
+    if not isinstance(start_ts, (int, np.integer)):
+        import pandas as pd
+        start_ts = pd.to_datetime(start_ts)
+        origins = [pd.to_datetime(origin) for origin in origins]
+    origins = np.array([index_ts_mapper(start_ts, interval, origin) for origin in origins], dtype = int)
+
+    coeffs, coeffs_projected, intercepts = _get_coefficients(interface, index_name, no_ts, averaging, projected)
+    no_coeff = len(coeffs)
+    # all observations needed for the windows and the targets, in one query
+    first, last = max(origins.min() - no_coeff, 0), origins.max() + horizon - 1
+    obs = interface.get_time_series(table_name, index_ts_inv_mapper(start_ts, interval, first), index_ts_inv_mapper(start_ts, interval, last), start_ts = start_ts,
+                                    value_column = ','.join(value_columns), index_column = index_col, Desc = False, interval = interval, aggregation_method = averaging)
+    obs = np.array(obs, dtype = float).reshape(-1, len(value_columns))
+    # windows of origins without no_coeff preceding observations are not evaluated
+    valid = (origins - no_coeff >= first) & (origins - first <= len(obs))
+    filled = fill_observations(obs, p)
+    padded = np.full([last - first + 1, len(value_columns)], np.nan)
+    padded[:len(obs)] = obs
+    # offsets[o, j] = position of the j-th observation of the window of origin o
+    offsets = (origins - first)[:, None] + np.arange(-no_coeff, 0)[None, :]
+    offsets = np.where(valid[:, None], offsets, 0)
+    targets = (origins - first)[:, None] + np.arange(horizon)[None, :]
+    actual = padded[np.clip(targets, 0, len(padded) - 1)]
+    actual[~valid] = np.nan
+
+    no_origins, no_columns = len(origins), len(value_columns)
+    windows = filled[np.clip(offsets, 0, len(filled) - 1)]
+    # one forecast per (column, origin): stack the windows of all columns
+    windows = windows.transpose(2, 0, 1).reshape(no_columns * no_origins, no_coeff)
+    column_intercepts = np.repeat(intercepts[value_indices], no_origins)
+    forecast = forecast_windows(windows, coeffs, coeffs_projected, column_intercepts, horizon).reshape(no_columns, no_origins, horizon)
+    forecast[:, ~valid] = np.nan
+    actual = actual.transpose(2, 0, 1)
+
+    deviation = np.full(forecast.shape, np.nan)
+    if uq and k_var:
+        var_coeffs, var_coeffs_projected, var_intercepts = _get_coefficients(interface, index_name + '_variance', no_ts, averaging, projected and not var_direct)
+        var_intercepts = np.repeat(var_intercepts[value_indices], no_origins)
+        if not var_direct:
+            # second moment forecasted from the squared observations
+            var = forecast_windows(windows**2, var_coeffs, var_coeffs_projected, var_intercepts, horizon).reshape(forecast.shape)
+            var = var - forecast**2
+        else:
+            # variance forecasted from the imputed variances preceding each origin, which are only known up to the last
+            # point seen by the variance model
+            t2 = min(origins.max() - 1, (MUpdateIndex_var - 1)//no_ts)
+            imputed = np.full([no_columns, last - first + 1], np.nan)
+            if t2 > first:
+                for i, value_index in enumerate(value_indices):
+                    imputed[i, :t2 - first + 1] = _get_imputation_range(index_name + '_variance', table_name, value_columns[i], index_col, interface, first, t2, L_var, k_var, T_var, last_model, value_index, no_ts, p = p)
+            var_windows = imputed[:, np.clip(offsets, 0, imputed.shape[1] - 1)].reshape(no_columns * no_origins, no_coeff)
+            var = forecast_windows(var_windows, var_coeffs, var_coeffs, var_intercepts, horizon).reshape(forecast.shape)
+        var *= (var > 0)
+        deviation = alpha * np.sqrt(var)
+    return forecast, actual, deviation
+
+@reroute_on_failure
+def backtest_pindex(interface, index_name, value_columns, origins, horizon, uq = True, uq_method = 'Gaussian', c = 95., averaging = 'average', projected = False):
+    """
+    Rolling-origin backtest of the forecasts of a pindex: for every origin, the values at origin to origin + horizon - 1
+    are forecasted from the observations preceding the origin, with the stored coefficients, as get_prediction_range
+    forecasts future points. All origins and columns of a pindex are forecasted together from one query of the observations.
+    ----------
+    Parameters
+    ----------
+    interface: db_class object
+        object used to communicate with the DB. see ../database/db_class for the abstract class
+
+    index_name: string
+        name of the PINDEX (or column-group pindex)
+
+    value_columns: list of strings
+        evaluated columns
+
+    origins: list of (int or timestamp)
+        index or timestamp of the first forecasted point of each forecast
+
+    horizon: int
+        number of forecasted points after each origin
+
+    uq: boolean optional (default=true)
+        if true, compute the coverage of the c% confidence interval
+
+    uq_method: string optional (defalut = 'Gaussian') options: {'Gaussian', 'Chebyshev'}
+        Uncertainty quantification method used to estimate the confidence interval
+
+    c: float optional (default 95.)
+        confidence level for uncertainty quantification, 0<c<100
+
+    averaging: string, optional, (default 'average')
+        Coefficients used when forecasting, 'average' means use the average of all sub models coeffcients.
+
+    projected: boolean optional (default=false)
+        if true, use the projected coefficients for the first steps (see get_prediction_range)
+    ----------
+    Returns
+    ----------
+    pd.DataFrame with columns [column, horizon, wape, rmse, coverage, no_origins]
+        error metrics of each column and horizon (1 to horizon) over the origins whose target value is observed. wape is
+        sum |y - y_hat| / sum |y|, coverage is the fraction of targets within the confidence interval (NaN if not uq)
+    """
+    import pandas as pd
+    if horizon < 1:
+        raise Exception('horizon must be a positive integer')
+    if len(origins) == 0:
+        raise Exception('at least one forecast origin is required')
+    alpha = None
+    if uq:
+        if c < 0 or c >=100:
+            raise Exception('confidence interval c must be in the range (0,100): 0 <=c< 100')
+        if uq_method == 'Chebyshev':
+            alpha = 1./(np.sqrt(1-c/100))
+        elif uq_method == 'Gaussian':
+            alpha = NormalDist().inv_cdf(1/2 + c/200)
+        else:
+            raise Exception('uq_method option is not recognized,  available options are: "Gaussian" or "Chebyshev"')
+
+    # route the columns of a column-group pindex to their pindex, and backtest each pindex once
+    indices = {}
+    for column in value_columns:
+        indices.setdefault(resolve_index(interface, index_name, column), []).append(column)
+    frames = []
+    for index, columns in indices.items():
+        forecast, actual, deviation = _backtest_index(interface, index, columns, origins, horizon, uq, alpha, averaging, projected)
+        observed = ~np.isnan(actual) & ~np.isnan(forecast)
+        error = np.where(observed, actual - forecast, 0.)
+        no_origins = observed.sum(1)
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            wape = np.abs(error).sum(1) / np.where(observed, np.abs(actual), 0.).sum(1)
+            rmse = np.sqrt((error**2).sum(1) / no_origins)
+            # targets without an estimated deviation (e.g. before the first variance sub model) are not counted
+            banded = observed & ~np.isnan(deviation)
+            coverage = (banded & (np.abs(error) <= np.nan_to_num(deviation))).sum(1) / banded.sum(1)
+        for i, column in enumerate(columns):
+            frames.append(pd.DataFrame({'column': column, 'horizon': np.arange(1, horizon + 1), 'wape': wape[i], 'rmse': rmse[i], 'coverage': coverage[i], 'no_origins': no_origins[i]}))
+    result = pd.concat(frames, ignore_index = True)
+    # keep the order of value_columns
+    result['column'] = pd.Categorical(result['column'], categories = list(dict.fromkeys(value_columns)))
+    result = result.sort_values(['column', 'horizon'], kind = 'stable').reset_index(drop = True)
+    result['column'] = result['column'].astype(str)
+    return result
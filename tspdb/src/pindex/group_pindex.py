@@ -0,0 +1,138 @@
+import os
+import numpy as np
+from tspdb.src.pindex.pindex_managment import TSPI, delete_pindex
+from tspdb.src.pindex.pindex_utils import index_ts_inv_mapper, get_bound_time, clear_routes
+
+def cluster_columns(data, no_groups):
+    """
+    partition the columns of data into at most no_groups groups of correlated columns, using average linkage hierarchical
+    clustering with the distance 1 - |correlation|
+    ----------
+    Parameters
+    ----------
+    data: array, shape [no_observations, no_columns]
+        observations of the time series, may contain NaNs
+
+    no_groups: int
+        number of groups
+    ----------
+    Returns
+    ----------
+    labels: array, shape [no_columns]
+        group of each column, numbered from 0 by first appearance
+    """
+    from scipy.cluster.hierarchy import linkage, fcluster
+    import pandas as pd
+    no_columns = data.shape[1]
+    no_groups = max(min(int(no_groups), no_columns), 1)
+    if no_groups == 1 or no_columns < 2:
+        return np.zeros(no_columns, dtype = int)
+    corr = np.nan_to_num(pd.DataFrame(data).corr().values)
+    distance = 1 - np.abs(corr)
+    # condensed distance matrix (upper triangle)
+    condensed = np.clip(distance[np.triu_indices(no_columns, 1)], 0, None)
+    labels = fcluster(linkage(condensed, method = 'average'), no_groups, criterion = 'maxclust')
+    # renumber the groups by first appearance
+    _, first, inverse = np.unique(labels, return_index = True, return_inverse = True)
+    order = np.argsort(np.argsort(first))
+    return order[inverse]
+
+def _fit_group(args):
+    """
+    fit the models of one group of columns, run in a worker process (no database access)
+    """
+    kwargs, data = args
+    TSPD = TSPI(interface = None, **kwargs)
+    if len(data) > 0:
+        TSPD.update_model(data)
+    return TSPD
+
+def create_group_pindex(interface, table_name, time_column, value_columns, index_name, groups = None, no_groups = None, workers = None, schema = 'tspdb', **kwargs):
+    """
+    Create a column-group pindex: the value columns are partitioned into groups, one pindex (index_name_g0, index_name_g1, ...)
+    is built per group, with the groups fitted in parallel worker processes. Queries on index_name are routed to the pindex of
+    the queried column (see resolve_index).
+    ----------
+    Parameters
+    ----------
+    interface: db_class object
+        object used to communicate with the DB. see ../database/db_class for the abstract class
+
+    table_name: string
+        name of the time series table in the database
+
+    time_column: string
+        name of column that contains time series index/timestamp
+
+    value_columns: list of strings
+        names of the indexed columns
+
+    index_name: string
+        name of the column-group pindex
+
+    groups: list of int optional (default=None)
+        group of each column in value_columns. If None, the columns are clustered by correlation into no_groups groups
+
+    no_groups: int optional (default=None)
+        number of groups when groups is None, defaults to the number of available cores
+
+    workers: int optional (default=None)
+        number of worker processes, defaults to the number of groups (capped by the number of cores). if 1, groups are fitted sequentially
+
+    schema: string
+        name of the tspdb schema
+
+    kwargs:
+        remaining TSPI parameters (rank, T, gamma, ...), shared by all groups
+    """
+    value_columns = list(value_columns)
+    auto_update = kwargs.pop('auto_update', True)
+    # query all columns once, groups are fitted from this data
+    TSPD = TSPI(interface = interface, time_series_table_name = table_name, time_column = time_column, value_column = value_columns,
+                index_name = index_name, schema = schema, agg_interval = kwargs.pop('agg_interval', None), start_time = kwargs.pop('start_time', None),
+                aggregation_method = kwargs.get('aggregation_method', 'average'))
+    end_point = get_bound_time(interface, table_name, time_column, 'max')
+    start_point = index_ts_inv_mapper(TSPD.start_time, TSPD.agg_interval, 0)
+    data = np.array(TSPD._get_range(start_point, end_point), dtype = float)
+
+    if groups is None:
+        if no_groups is None:
+            no_groups = os.cpu_count() or 1
+        groups = cluster_columns(data, no_groups)
+    groups = np.asarray(groups, dtype = int)
+    if len(groups) != len(value_columns):
+        raise Exception('groups must assign a group to each of the %s value columns' % len(value_columns))
+
+    # drop an existing pindex with the same name
+    delete_pindex(interface, index_name, schema)
+    jobs = []
+    group_names = []
+    for g in np.unique(groups):
+        group_name = '%s_g%s' % (index_name, len(group_names))
+        group_names.append(group_name)
+        columns = [c for c, l in zip(value_columns, groups) if l == g]
+        group_kwargs = dict(kwargs, time_series_table_name = table_name, time_column = time_column, value_column = columns, index_name = group_name,
+                            schema = schema, agg_interval = TSPD.agg_interval, start_time = TSPD.start_time, auto_update = auto_update)
+        jobs.append((group_kwargs, data[:, groups == g]))
+
+    # fit the groups in parallel, worker processes do not access the database
+    if workers is None:
+        workers = min(len(jobs), os.cpu_count() or 1)
+    if workers > 1:
+        import multiprocessing
+        with multiprocessing.get_context('fork').Pool(workers) as pool:
+            fitted = pool.map(_fit_group, jobs)
+    else:
+        fitted = [_fit_group(job) for job in jobs]
+
+    # write the group pindices and the routing table
+    for group_name, group_TSPD, (group_kwargs, _) in zip(group_names, fitted, jobs):
+        group_TSPD.db_interface = interface
+        if len(group_TSPD.ts_model.models) > 0:
+            group_TSPD.write_model(True)
+        if auto_update:
+            interface.create_insert_trigger(table_name, group_TSPD.index_name)
+        for column in group_kwargs['value_column']:
+            interface.insert(schema + '.pindices_groups', [index_name, column, group_name], columns = ['index_name', 'value_column', 'group_index'])
+    clear_routes(interface)
+    return group_names
@@ -3,15 +3,14 @@ import pandas as pd
 from tspdb.src.database_module.db_class import Interface
 from  tspdb.src.prediction_models.ts_meta_model import TSMM
 from  tspdb.src.prediction_models.ts_svd_model import SVDModel
+from  tspdb.src.prediction_models.ts_model_registry import ModelRegistry, updated_models, model_attribute
 from math import ceil
-from tspdb.src.pindex.predict import get_prediction_range, get_prediction
+from tspdb.src.pindex.predict import get_prediction_range, get_prediction, materialize_denoised_range
 import os
 from datetime import datetime
-from tspdb.src.pindex.pindex_utils import index_ts_mapper, index_ts_inv_mapper, index_exists, get_bound_time
-from sklearn.metrics import r2_score
+from tspdb.src.pindex.pindex_utils import index_ts_mapper, index_ts_inv_mapper, index_exists, get_bound_time, coefficient_window_models, update_coefficient_window_sums, AVERAGE_WINDOWS, query_meta, clear_routes
 import time
 import pickle
-from sqlalchemy.types import *
 from tspdb.src.tsUtils import unnormalize 
 
 def delete_pindex(db_interface, index_name, schema='tspdb'):
@@ -30,7 +29,7 @@ def delete_pindex(db_interface, index_name, schema='tspdb'):
         name of the tspdb schema
     """
     # suffixes of the pindex tables
-    suffix = ['u', 'v', 's', 'm', 'c', 'meta']
+    suffix = ['u', 'v', 's', 'm', 'c', 'c_view', 'c_projected', 'meta', 'denoised']
     index_name_ = schema + '.' + index_name
     table_name = None
     try:
@@ -40,6 +39,16 @@ def delete_pindex(db_interface, index_name, schema='tspdb'):
     except: 
         pass
     index_name_no_schema = index_name.split('.')[-1]
+    # drop the group pindices if index_name is a column-group pindex
+    try:
+        group_indices = db_interface.query_table('tspdb.pindices_groups', ['group_index'], "index_name = '" + str(index_name) + "'")
+        for group_index in sorted(set(row[0] for row in group_indices)):
+            delete_pindex(db_interface, group_index, schema)
+        db_interface.delete('tspdb.pindices_groups', "index_name = '" + str(index_name) + "';")
+    except:
+        # catalog created before column-group pindices
+        pass
+    clear_routes(db_interface)
     if table_name is not None:
         db_interface.drop_trigger(table_name,index_name_no_schema)
     # drop mean and variance tables 
@@ -53,19 +62,29 @@ def delete_pindex(db_interface, index_name, schema='tspdb'):
     db_interface.delete('tspdb.pindices_stats', "index_name = '" + str(index_name) + "';")
 
 
+def bump_pindex_version(db_interface, index_name):
+    """
+    increment the version of index_name in tspdb.pindices_versions, invalidating the predict results cached with older
+    versions (see predict_cache)
+    """
+    index_name = index_name.split('.')[-1]
+    db_interface.execute_query("insert into tspdb.pindices_versions values ('%s', 1) on conflict (index_name) do update set version = tspdb.pindices_versions.version + 1" % index_name)
+
 def load_pindex_u(db_interface,index_name):
     t = time.time()
     meta_table = index_name + "_meta"
-    meta_inf = db_interface.query_table(meta_table,
-                                        columns_queried=['T', 'T0', 'k', 'gamma', 'var_direct_method', 'k_var', 'T_var',
+    meta_inf = query_meta(db_interface, index_name,
+                                        columns=['T', 'T0', 'k', 'gamma', 'var_direct_method', 'k_var', 'T_var',
                                                          'soft_thresholding', 'start_time', 'aggregation_method',
                                                          'agg_interval', 'persist_l','col_to_row_ratio', 'L','last_TS_fullSVD','last_TS_inc',
-                                                              'last_TS_seen', 'p' ,'time_series_table_name', 'indexed_column','time_column'])
+                                                              'last_TS_seen', 'p', 'materialized', 'model_type', 'svd_method' ,'time_series_table_name', 'indexed_column','time_column'])
     
-    T, T0, k, gamma, direct_var, k_var, T_var, SSVT, start_time, aggregation_method, agg_interval, persist_l, col_to_row_ratio, L, ReconIndex, MUpdateIndex, TimeSeriesIndex , p= meta_inf[0][:-3]
+    T, T0, k, gamma, direct_var, k_var, T_var, SSVT, start_time, aggregation_method, agg_interval, persist_l, col_to_row_ratio, L, ReconIndex, MUpdateIndex, TimeSeriesIndex , p, materialized, model_type, svd_method = meta_inf[:-3]
+    # NULL model_type or svd_method (e.g. columns added by hand to an older pindex) mean the defaults, as in TSPI
+    model_type, svd_method = model_type or 'svd', svd_method or 'numpy'
     L_m = db_interface.query_table(index_name + "_m", ['L'], 'modelno =0')[0][0]
     
-    time_series_table_name, value_column, time_column = meta_inf[0][-3:]
+    time_series_table_name, value_column, time_column = meta_inf[-3:]
     last = get_bound_time(db_interface, time_series_table_name, time_column ,'max')
     value_columns = value_column.split(',')
     # ------------------------------------------------------
@@ -82,6 +101,8 @@ def load_pindex_u(db_interface,index_name):
     if last_index - MUpdateIndex//no_ts <= 5*L_m:
         print(L, last_index, MUpdateIndex)
         print('nothing major to update')
+        # the model is kept, but forecasts read the new points, so results cached with the current version are stale
+        bump_pindex_version(db_interface, index_name)
         return False
     if p < 1.0:
         fill_in_missing = False
@@ -89,7 +110,8 @@ def load_pindex_u(db_interface,index_name):
     TSPD = TSPI(interface=db_interface, index_name=index_name, schema=None, T=T, T0=T0, rank=k, gamma=gamma,
                 direct_var=direct_var, rank_var=k_var, T_var=T_var, SSVT=SSVT, start_time=start_time,
                 aggregation_method=aggregation_method, agg_interval=agg_interval, time_series_table_name=time_series_table_name, 
-                time_column = time_column, value_column = value_columns ,persist_L = persist_l,col_to_row_ratio = col_to_row_ratio, fill_in_missing = fill_in_missing, p =p)
+                time_column = time_column, value_column = value_columns ,persist_L = persist_l,col_to_row_ratio = col_to_row_ratio, fill_in_missing = fill_in_missing, p =p,
+                materialize_denoised = materialized, model_type = model_type, svd_method = svd_method)
     
     model_no = int(max((last_index*no_ts - 1) / (T / 2) - 1, 0))
     last_model_no = int(max((MUpdateIndex - 1) / (T / 2) - 1, 0))
@@ -109,7 +131,8 @@ def load_pindex_u(db_interface,index_name):
         end = (TimeSeriesIndex - 1)//TSPD.no_ts
     # initiate TSPI object 
     TSPD.ts_model = TSMM(TSPD.k, TSPD.T, TSPD.gamma, TSPD.T0, col_to_row_ratio=col_to_row_ratio,
-                         model_table_name=index_name, SSVT=TSPD.SSVT, L=L, persist_L = TSPD.persist_L, no_ts = TSPD.no_ts, fill_in_missing = fill_in_missing, p =p)
+                         model_table_name=index_name, SSVT=TSPD.SSVT, L=L, persist_L = TSPD.persist_L, no_ts = TSPD.no_ts, fill_in_missing = fill_in_missing, p =p,
+                         model_type = model_type, svd_method = svd_method)
     TSPD.ts_model.ReconIndex, TSPD.ts_model.MUpdateIndex, TSPD.ts_model.TimeSeriesIndex = ReconIndex, MUpdateIndex, TimeSeriesIndex
 
     # load variance models if any
@@ -123,7 +146,8 @@ def load_pindex_u(db_interface,index_name):
                                                                                                       'last_TS_seen_var'])[0]
 
         TSPD.var_model = TSMM(TSPD.k_var, TSPD.T_var, TSPD.gamma, TSPD.T0, col_to_row_ratio=col_to_row_ratio,
-                              model_table_name=index_name + "_variance", SSVT=TSPD.SSVT, L=L, persist_L =TSPD.persist_L, no_ts = TSPD.no_ts, fill_in_missing = fill_in_missing, p =p)
+                              model_table_name=index_name + "_variance", SSVT=TSPD.SSVT, L=L, persist_L =TSPD.persist_L, no_ts = TSPD.no_ts, fill_in_missing = fill_in_missing, p =p,
+                              model_type = model_type, svd_method = svd_method)
         TSPD.var_model.ReconIndex, TSPD.var_model.MUpdateIndex, TSPD.var_model.TimeSeriesIndex = ReconIndex, MUpdateIndex, TimeSeriesIndex
 
     print('loading meta_model time', time.time()-t)
@@ -162,6 +186,77 @@ def load_pindex_u(db_interface,index_name):
     return TSPD
 
 
+def _array_str(array_):
+    string = str(array_)
+    return '{'+string[1:-1]+'}'
+
+def build_model_tables(models, k, no_ts, N, M):
+    """
+    build the rows of the U, V, S, C and M tables of the given sub-models by assembling NumPy blocks
+    ----------
+    Parameters
+    ----------
+    models: dict
+        consecutive sub-models (modelno -> SVDModel) to be written
+    
+    k: int
+        number of singular values retained in the sub-models
+
+    no_ts: int
+        number of time series in the model
+
+    N, M: int
+        number of rows and columns of the sub-models matrices, used to number the rows of the tables
+    ----------
+    Returns
+    ----------
+    udf, vdf, sdf, cdf, mdf: pandas DataFrames
+        rows of the U, V, S, C and M tables 
+    """
+    model_no = sorted(models.keys())
+    sub_models = [models[i] for i in model_no]
+    first_model = model_no[0]
+
+    # U table: Uk and Ukw (padded with a row of zeros) of each sub-model
+    U_table = np.vstack([np.column_stack((np.full(len(m.Uk), i), m.Uk, np.concatenate((m.Ukw,np.zeros([1,k]))))) for i, m in zip(model_no, sub_models)])
+    columns = ['modelno'] + ['u' + str(i) for i in range(1, k + 1)]+ ['uw' + str(i) for i in range(1, k + 1)]
+    udf = pd.DataFrame(columns=columns, data=U_table.astype(float))
+    udf.index = np.arange(first_model * N, first_model * N + len(U_table))
+    udf['tsrow'] = (udf.index % N).astype(int)
+
+    # V table: Vk and Vkw of each sub-model
+    V_table = np.vstack([np.column_stack((np.full(len(m.Vk), i), m.Vk, m.Vkw)) for i, m in zip(model_no, sub_models)])
+    columns = ['modelno'] + ['v' + str(i) for i in range(1, k + 1)] + ['vw' + str(i) for i in range(1, k + 1)]
+    vdf = pd.DataFrame(columns=columns, data=V_table.astype(float))
+    vdf.index = np.arange(first_model * M, first_model * M + len(V_table))
+    vdf['tscolumn'] = (vdf.index - 0.5 * M * vdf['modelno']).astype(int)
+    vdf['time_series'] = (vdf.index%no_ts).astype(int)
+
+    # S table: sk and skw of each sub-model
+    s_table = np.column_stack((model_no, np.array([m.sk for m in sub_models]), np.array([m.skw for m in sub_models])))
+    columns = ['modelno'] + ['s' + str(i) for i in range(1, k + 1)] + ['sw' + str(i) for i in range(1, k + 1)]
+    sdf = pd.DataFrame(columns=columns, data=s_table.astype(float))
+
+    # C table: for each sub-model, the biases (coeffpos -1 to -no_ts) followed by the reversed weights, zero padded to N-1
+    w_f = N - 1
+    weights = np.zeros([len(sub_models), w_f])
+    for j, m in enumerate(sub_models):
+        weights[j, :len(m.weights)] = m.weights[::-1]
+    bias = (-np.array([m.weights.sum() for m in sub_models])[:, None] + 1) * np.array([m.norm_mean[:no_ts] for m in sub_models], dtype = float)
+    coeffpos = np.concatenate((-np.arange(1, no_ts + 1), np.arange(w_f)))
+    c_table = np.column_stack((np.repeat(model_no, w_f + no_ts), np.tile(coeffpos, len(sub_models)), np.hstack((bias, weights)).ravel())).astype(float)
+    cdf = pd.DataFrame(columns=['modelno', 'coeffpos', 'coeffvalue'], data=c_table)
+    cdf.index = np.arange(first_model * (w_f+no_ts), first_model * (w_f+no_ts) + len(c_table))
+
+    # M table: sub-models metadata
+    model_table_col = ['modelno', 'L', 'N', 'start', 'dataPoints', 'timesUpdated', 'timesRecons']
+    model_table_col += ['imputation_acc', 'forecasting_acc', 'forecasting_test_acc','norm_mean', 'norm_std']
+    data = [model_no, [m.N for m in sub_models], [m.M for m in sub_models], [m.start for m in sub_models], [m.M * m.N for m in sub_models],
+            [m.TimesUpdated for m in sub_models], [m.TimesReconstructed for m in sub_models]]
+    data += [[_array_str(list(getattr(m, attribute))) for m in sub_models] for attribute in ['imputation_model_score', 'forecast_model_score', 'forecast_model_score_test', 'norm_mean', 'norm_std']]
+    mdf = pd.DataFrame(data = {model_table_col[i]: pd.Series(data[i], dtype = object) for i in range(len(model_table_col))})
+    return udf, vdf, sdf, cdf, mdf
+
 class TSPI(object):
     # k:                        (int) the number of singular values to retain in the means prediction model
     # k_var:                    (int) the number of singular values to retain in the variance prediction model
@@ -178,11 +273,17 @@ class TSPI(object):
     # var_method_diff:          (bol) if True, calculate variance by subtracting the mean from the observations in the variance prediction model
     # mean_model:               (TSMM object) the means prediction model object
     # var_model:                (TSMM object) the variance prediction model object
+    # model_type:               (str) 'svd' (default) or 'als': the factorization used to fit the sub-models. 'als' fits a masked
+    #                               low-rank model on the observed entries only, suited to series with many missing values
+    # svd_method:               (str) 'numpy' (default) or 'gram': the SVD used by 'svd' sub-models (see SVDWrapper)
+    # memory_budget:            (int or str) if set, T, L, k and svd_method are chosen by plan_pindex so that the estimated
+    #                               peak memory of the build fits the budget (e.g. '2GB'), before any data is read
 
     def __init__(self, rank = None, rank_var = 1, T=int(1e5), T_var=None, gamma=0.2, T0=100, col_to_row_ratio=10,
                  interface=Interface, agg_interval=None, start_time=None, aggregation_method='average',
                  time_series_table_name= "", time_column = "", value_column = [''], SSVT=False, p=None, direct_var=True, L=None,  recreate=True,
-                 index_name=None, _dir='', schema='tspdb', persist_L = None, normalize = True, auto_update = True, fill_in_missing = True):
+                 index_name=None, _dir='', schema='tspdb', persist_L = None, normalize = True, auto_update = True, fill_in_missing = True,
+                 materialize_denoised = False, model_type = 'svd', svd_method = None, memory_budget = None):
         if gamma <0 or gamma >=1:
             gamma = 0.5
         self._dir = _dir
@@ -237,13 +338,28 @@ class TSPI(object):
         if isinstance(self.start_time, (int, np.integer)):
             self.agg_interval = 1.
         self.fill_in_missing = fill_in_missing
+        self.materialize_denoised = materialize_denoised
+        self.model_type = model_type
+        self.plan = None
+        if memory_budget is not None:
+            from tspdb.src.pindex.planner import plan_pindex
+            end_point = get_bound_time(interface, self.time_series_table_name, self.time_column, 'max')
+            no_rows = index_ts_mapper(self.start_time, self.agg_interval, end_point) + 1
+            self.plan = plan_pindex(no_rows, self.no_ts, memory_budget, T, L = L, k = self.k, k_var = self.k_var, col_to_row_ratio = col_to_row_ratio,
+                                    persist_L = self.persist_L, svd_method = svd_method)
+            T, T_var, L, self.k, col_to_row_ratio, svd_method = self.plan['T'], self.plan['T'], self.plan['L'], self.plan['k'], self.plan['col_to_row_ratio'], self.plan['svd_method']
+        self.svd_method = svd_method or 'numpy'
         self.ts_model = TSMM(self.k, T, self.gamma, self.T0, col_to_row_ratio=col_to_row_ratio,
                              model_table_name=self.index_name, SSVT=self.SSVT, p=None, L=L, persist_L = self.persist_L, 
-                             no_ts = self.no_ts, normalize = self.normalize, fill_in_missing = self.fill_in_missing)
+                             no_ts = self.no_ts, normalize = self.normalize, fill_in_missing = self.fill_in_missing, model_type = model_type,
+                             svd_method = self.svd_method)
         self.var_model = TSMM(self.k_var, T_var, self.gamma, self.T0, col_to_row_ratio=col_to_row_ratio,
                               model_table_name=self.index_name + "_variance", SSVT=self.SSVT, p=None,
-                              L=L, persist_L = self.persist_L, no_ts = self.no_ts, normalize = self.normalize, fill_in_missing = self.fill_in_missing)
+                              L=L, persist_L = self.persist_L, no_ts = self.no_ts, normalize = self.normalize, fill_in_missing = self.fill_in_missing,
+                              model_type = model_type, svd_method = self.svd_method)
         self.direct_var = direct_var
+        # pending variance model fit (see update_model)
+        self._var_fit = None
         self.T = self.ts_model.T
         self.T_var = self.var_model.T
         if self.k_var:
@@ -266,7 +382,7 @@ class TSPI(object):
         new_entries = self._get_range(start_point, end_point)
         new_entries = new_entries.astype('float')
         if len(new_entries) > 0:
-            self.update_model(new_entries)
+            self.update_model(new_entries, wait = False)
             self.write_model(True)
         
         # drop and create trigger
@@ -280,17 +396,22 @@ class TSPI(object):
         """
         end_point = get_bound_time(self.db_interface, self.time_series_table_name, self.time_column, 'max')
         start_point = index_ts_inv_mapper(self.start_time, self.agg_interval, self.ts_model.TimeSeriesIndex//self.no_ts)
-        new_entries =  np.array(self._get_range(start_point, end_point), dtype = np.float)
+        new_entries =  np.array(self._get_range(start_point, end_point), dtype = float)
         if len(new_entries) > 0:
-            self.update_model(new_entries)
+            self.update_model(new_entries, wait = False)
             self.write_model(False)
 
-    def update_model(self, NewEntries):
+    def update_model(self, NewEntries, wait = True):
         """
         This function takes a new set of entries and update the model accordingly.
         if the number of new entries means new model need to be bulit, this function segment the new entries into
-        several entries and then feed them to the update_ts and fit function
+        several entries and then feed them to the update_ts and fit function.
+        The variance model is fitted in a background thread: if direct_var is False it only needs the squared
+        observations and is fitted concurrently with the mean model, otherwise it starts as soon as the mean model is
+        fitted. NumPy releases the GIL in the SVD routines, so both fits run in parallel.
         :param NewEntries: Entries to be included in the new model
+        :param wait: if False, return without waiting for the variance model; write_model writes the mean model
+        tables while the variance model is being fitted and waits for it before writing the variance tables
         """
         # ------------------------------------------------------
         # is it already numpy.array? ( not really needed but not harmful)
@@ -306,32 +427,52 @@ class TSPI(object):
                 lagged_obs = self.ts_model.TimeSeries[-lag:,:]
             else: lag = None
 
+        # the variance model only needs the squared observations, fit it concurrently with the mean model
+        self.wait_var_model()
+        if self.k_var and not self.direct_var:
+            self._fit_var_model(np.square(NewEntries))
+
         # Update mean model
         self.ts_model.update_model(NewEntries)
         
         self.k = self.ts_model.kSingularValuesToKeep
         # Determine updated models
         
-        models = {k: self.ts_model.models[k] for k in self.ts_model.models if self.ts_model.models[k].updated}
+        models = updated_models(self.ts_model.models)
 
-        if self.k_var:
-            if self.direct_var:
-
-                means = self.ts_model._denoiseTS(models)[self.var_model.TimeSeriesIndex//self.no_ts:self.ts_model.MUpdateIndex//self.no_ts,:]
-                if lag is not None:
-                    var_obs = np.concatenate([lagged_obs, obs])
-                else:
-                    var_obs = obs
-                print(obs.shape, self.ts_model.MUpdateIndex, self.var_model.TimeSeriesIndex, self.ts_model._denoiseTS(models).shape,means.shape,var_obs.shape)
-                var_entries = np.square(var_obs[:len(means),:] - means)
-                # ------------------------------------------------------
-                # EDIT: Is this necessary (NAN to zero)?
-                # var_entries[np.isnan(var_obs[:len(means)])] = 0    
-                # ------------------------------------------------------
-                self.var_model.update_model(var_entries)
+        if self.k_var and self.direct_var:
+            means = self.ts_model._denoiseTS(models)[self.var_model.TimeSeriesIndex//self.no_ts:self.ts_model.MUpdateIndex//self.no_ts,:]
+            if lag is not None:
+                var_obs = np.concatenate([lagged_obs, obs])
             else:
-                var_entries = np.square(NewEntries)
-                self.var_model.update_model(var_entries)
+                var_obs = obs
+            var_entries = np.square(var_obs[:len(means),:] - means)
+            # ------------------------------------------------------
+            # EDIT: Is this necessary (NAN to zero)?
+            # var_entries[np.isnan(var_obs[:len(means)])] = 0    
+            # ------------------------------------------------------
+            self._fit_var_model(var_entries)
+
+        if wait:
+            self.wait_var_model()
+
+    def _fit_var_model(self, var_entries):
+        """
+        start fitting the variance model on var_entries in a background thread
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        executor = ThreadPoolExecutor(max_workers = 1)
+        self._var_fit = executor.submit(self.var_model.update_model, var_entries)
+        executor.shutdown(wait = False)
+
+    def wait_var_model(self):
+        """
+        wait for the variance model fit started by update_model (if any), re-raising its exceptions
+        """
+        var_fit = getattr(self, '_var_fit', None)
+        self._var_fit = None
+        if var_fit is not None:
+            var_fit.result()
 
     def write_model(self, create):
         """
@@ -351,10 +492,17 @@ class TSPI(object):
         if create:
             delete_pindex(self.db_interface, index_name)
     
-        # write mean and variance tables
+        # write the mean tables while the variance model is being fitted, then the variance tables
         self.write_tsmm_model(self.ts_model, create)
-        self.write_tsmm_model(self.var_model, create)
         self.calculate_out_of_sample_error(self.ts_model)
+        self.wait_var_model()
+
+        # first time index affected by this write, used to refresh the materialized denoised values
+        if self.materialize_denoised:
+            updated_starts = [m.start for tsmm in [self.ts_model, self.var_model] for m in updated_models(tsmm.models).values()]
+            denoised_start = 0 if create or len(updated_starts) == 0 else min(updated_starts)//self.no_ts
+
+        self.write_tsmm_model(self.var_model, create)
         # if time is timestamp, convert to pd.Timestamp
         if not isinstance(self.start_time, (int, np.integer)):
             self.start_time = pd.to_datetime(self.start_time)
@@ -376,7 +524,9 @@ class TSPI(object):
                   'last_TS_inc_var': [self.var_model.MUpdateIndex], 'aggregation_method': [self.aggregation_method],
                   'agg_interval': [self.agg_interval],
                   'start_time': [self.start_time], 'last_TS_fullSVD_var': [self.var_model.ReconIndex],
-                  'var_direct_method': [self.direct_var], 'persist_l': [self.persist_L], 'p': [self.ts_model.p]})
+                  'var_direct_method': [self.direct_var], 'persist_l': [self.persist_L], 'p': [self.ts_model.p],
+                  'materialized': [bool(self.materialize_denoised)], 'model_type': [self.model_type],
+                  'svd_method': [self.svd_method]})
         
         # ------------------------------------------------------
         # EDIT: Due to some incompatibiliy with PSQL timestamp types 
@@ -403,10 +553,13 @@ class TSPI(object):
             self.db_interface.delete('tspdb.pindices_stats', "index_name = '" + str(index_name) + "';")
             
             # UPDATE STAT TABLE
+        imputation_scores = model_attribute(self.ts_model.models, 'imputation_model_score')
+        forecast_scores = model_attribute(self.ts_model.models, 'forecast_model_score')
+        forecast_tests_scores = model_attribute(self.ts_model.models, 'forecast_model_score_test')
         for i,ts in enumerate(self.value_column):
-            forecast_tests_array = np.array([m.forecast_model_score_test[i] for m in self.ts_model.models.values()],'float')
+            forecast_tests_array = forecast_tests_scores[:,i]
             self.db_interface.insert('tspdb.pindices_stats',
-                                     [index_name, ts, self.ts_model.TimeSeriesIndex//self.no_ts, len(self.ts_model.models),np.mean([ m.imputation_model_score[i] for m in self.ts_model.models.values() ]), np.mean([ m.forecast_model_score[i] for m in self.ts_model.models.values()]),np.nanmean(forecast_tests_array)],
+                                     [index_name, ts, self.ts_model.TimeSeriesIndex//self.no_ts, len(self.ts_model.models),np.mean(imputation_scores[:,i]), np.mean(forecast_scores[:,i]),np.nanmean(forecast_tests_array)],
                                      columns=['index_name', 'column_name','number_of_observations', 'number_of_trained_models', 'imputation_score', 'forecast_score','test_forecast_score'])
             
             # UPDATE PINDICES TABLE
@@ -422,6 +575,13 @@ class TSPI(object):
                                       self.agg_interval, self.start_time, last_index],
                                      columns=['index_name', 'relation', 'time_column', 'uq', 'agg_interval',
                                               'initial_timestamp', 'last_timestamp'])
+
+        # refresh the materialized denoised values of the updated sub-models
+        if self.materialize_denoised:
+            materialize_denoised_range(self.index_name, self.time_series_table_name, self.db_interface, denoised_start, create = create)
+
+        # bump the pindex version, invalidating the predict results cached with older versions (see predict_cache)
+        bump_pindex_version(self.db_interface, index_name)
     
     def prepare_tsmm_to_store(self):
         for tsmm in [self.ts_model, self.var_model]:
@@ -443,14 +603,18 @@ class TSPI(object):
 
     def write_tsmm_model(self, tsmm, create):
         """
-        -
-        """
-        ########################### To Do ######################
-        # 1 Replace for loops with vectorized numpy operations?
-        ########################################################
+        write the updated sub-models of tsmm to the U, V, S, C and M tables of the pindex
+        ----------
+        Parameters
+        ----------
+        tsmm: TSMM object
+            the model to be written
 
+        create: bol 
+            if Ture, create the tables, else update them.
+        """
         # only get updated sub models
-        models = {k: tsmm.models[k] for k in tsmm.models if tsmm.models[k].updated}
+        models = updated_models(tsmm.models)
 
         # Mo
         model_name = tsmm.model_tables_name
@@ -470,120 +634,43 @@ class TSPI(object):
             N = tsmm.models[0].N
             M = tsmm.models[0].M
             
-        # populate U_table data
-        U_table = np.zeros([(len(models) - 1) * N + models[last_model].N, 1 + 2*tsmm.kSingularValuesToKeep])
-        for i, m in sorted(models.items()):
-            j = i - first_model
-            if i == last_model:
-                U_table[j * N:, 1:1 + tsmm.kSingularValuesToKeep] = m.Uk
-                U_table[j * N:, 1 + tsmm.kSingularValuesToKeep: 1 + 2*tsmm.kSingularValuesToKeep] = np.concatenate((m.Ukw,np.zeros([1,tsmm.kSingularValuesToKeep])))
-                U_table[j * N:, 0] = int(i)
-            else:
-                U_table[j * N:(j + 1) * N, 1:1 + tsmm.kSingularValuesToKeep] = m.Uk
-                U_table[j * N:(j + 1) * N, 1 + tsmm.kSingularValuesToKeep:1 + 2*tsmm.kSingularValuesToKeep] =  np.concatenate((m.Ukw,np.zeros([1,tsmm.kSingularValuesToKeep])))
-                U_table[j * N:(j + 1) * N, 0] = int(i)
-
-        columns = ['modelno'] + ['u' + str(i) for i in range(1, tsmm.kSingularValuesToKeep + 1)]+ ['uw' + str(i) for i in range(1, tsmm.kSingularValuesToKeep + 1)]
-        udf = pd.DataFrame(columns=columns, data=U_table)
-        udf.index = np.arange(first_model * N, first_model * N + len(U_table))
-        udf['tsrow'] = (udf.index % N).astype(int)
+        udf, vdf, sdf, cdf, mdf = build_model_tables(models, tsmm.kSingularValuesToKeep, self.no_ts, N, M)
 
+        # write U table
         if create:
             self.db_interface.create_table(tableNames[0], udf, 'row_id', index_label='row_id')
         else:
             self.db_interface.delete(tableNames[0], 'modelno >= %s and modelno <= %s' % (first_model, last_model,))
             self.db_interface.bulk_insert(tableNames[0], udf, index_label='row_id')
 
-        # populate V_table data
-        V_table = np.zeros([(len(models) - 1) * M + models[last_model].M, 1 + 2*tsmm.kSingularValuesToKeep])
-        for i, m in sorted(models.items()):
-            j = i - first_model
-            if i == last_model:
-                V_table[j * M:, 1:1 + tsmm.kSingularValuesToKeep] = m.Vk
-                V_table[j * M:, 1 + tsmm.kSingularValuesToKeep: 1+ 2*tsmm.kSingularValuesToKeep] = m.Vkw
-                V_table[j * M:, 0] = int(i)
-
-            else:
-                V_table[j * M:(j + 1) * M, 1:1 + tsmm.kSingularValuesToKeep] = m.Vk
-                V_table[j * M:(j + 1) * M, 1 + tsmm.kSingularValuesToKeep: 1+ 2*tsmm.kSingularValuesToKeep] = m.Vkw
-                V_table[j * M:(j + 1) * M, 0] = int(i)
-
-        columns = ['modelno'] + ['v' + str(i) for i in range(1, tsmm.kSingularValuesToKeep + 1)] + ['vw' + str(i) for i in range(1, tsmm.kSingularValuesToKeep + 1)]
-        vdf = pd.DataFrame(columns=columns, data=V_table)
-        vdf.index = np.arange(first_model * M, first_model * M + len(V_table))
-        vdf['tscolumn'] = (vdf.index - 0.5 * M * vdf['modelno']).astype(int)
-        vdf['time_series'] = (vdf.index%self.no_ts).astype(int)
-        
+        # write V table
         if create:
             self.db_interface.create_table(tableNames[1], vdf, 'row_id', index_label='row_id')
         else:
             self.db_interface.delete(tableNames[1], 'modelno >= %s and modelno <= %s' % (first_model, last_model,))
             self.db_interface.bulk_insert(tableNames[1], vdf, index_label='row_id')
 
-        # populate s_table data 
-        s_table = np.zeros([len(models), 1 + 2*tsmm.kSingularValuesToKeep])
-        for i, m in sorted(models.items()):
-            j = i - first_model
-            s_table[j, 1:tsmm.kSingularValuesToKeep + 1] = m.sk
-            s_table[j, tsmm.kSingularValuesToKeep + 1:tsmm.kSingularValuesToKeep*2 + 1] = m.skw
-            s_table[j, 0] = int(i)
-        columns = ['modelno'] + ['s' + str(i) for i in range(1, tsmm.kSingularValuesToKeep + 1)] + ['sw' + str(i) for i in range(1, tsmm.kSingularValuesToKeep + 1)]
-        sdf = pd.DataFrame(columns=columns, data=s_table)
+        # write s table
         if create:
             self.db_interface.create_table(tableNames[2], sdf, 'modelno', include_index=False, index_label='row_id')
         else:
             self.db_interface.delete(tableNames[2], 'modelno >= %s and modelno <= %s' % (first_model, last_model,))
             self.db_interface.bulk_insert(tableNames[2], sdf, include_index=False)
 
-        # populate c_table data 
-        id_c = 0
-        w_f = N - 1
-        w_l = len(models[last_model].weights)
-        c_table = np.zeros([(len(models)) * (w_f+self.no_ts), 3])
-        for i,m in sorted(models.items()):
-            for ts in range(self.no_ts):
-                bias = (-m.weights.sum() +1)*m.norm_mean[ts]
-                c_table[id_c, :] = [i, -ts-1, bias]
-                id_c += 1
-            coeNu = 0
-            for weig in m.weights[::-1]:
-                c_table[id_c, :] = [i, coeNu, weig]
-                id_c += 1
-                coeNu += 1
-            if i == last_model:
-                for q in range(w_f-w_l):
-                    c_table[id_c, :] = [i, coeNu, 0]
-                    id_c += 1
-                    coeNu += 1
-
-
-        cdf = pd.DataFrame(columns=['modelno', 'coeffpos', 'coeffvalue'], data=c_table)
-        cdf.index = np.arange(first_model * (w_f+self.no_ts), first_model * (w_f+self.no_ts) + len(c_table))
+        # update the coefficient averages before the old coefficients are overwritten
+        self.write_coefficients_average(tsmm, cdf.values, N - 1, create, AVERAGE_WINDOWS)
 
+        # write c table
         if create:
             self.db_interface.create_table(tableNames[3], cdf, 'row_id', index_label='row_id')
         else:
             self.db_interface.delete(tableNames[3], 'modelno >= %s and modelno <= %s' % (first_model, last_model,))
             self.db_interface.bulk_insert(tableNames[3], cdf, include_index=True, index_label="row_id")
 
-        # populate m_table data 
-        m_table = np.zeros([len(models), 7 + 5], 'object')
-        for i, m in sorted(models.items()):
-            m_table[i - first_model, :] = [i, m.N, m.M, m.start, m.M * m.N, m.TimesUpdated, m.TimesReconstructed, self._array_str(list(m.imputation_model_score)), self._array_str(list(m.forecast_model_score)), self._array_str(list(m.forecast_model_score_test)), self._array_str(list(m.norm_mean)), self._array_str(list(m.norm_std))]
-            #for ts in range(self.no_ts):
-            #        m_table[i - first_model,7+5*ts:7+5*(ts+1)] = [ m.imputation_model_score[ts], m.forecast_model_score[ts], np.nan, m.norm_mean[ts], m.norm_std[ts]]
-        model_table_col = ['modelno', 'L', 'N', 'start', 'dataPoints', 'timesUpdated', 'timesRecons']
-        model_table_col += ['imputation_acc', 'forecasting_acc', 'forecasting_test_acc','norm_mean', 'norm_std']
-        
-        # model_table_acc_label = ['imputation_acc_%s', 'forecasting_acc_%s', 'forecasting_test_acc_%s']
-        # model_table_norm_label = ['norm_mean_%s', 'norm_std_%s']
-        # for ts in range(self.no_ts):
-        #     model_table_col += [i%(self.value_column[ts]) for i in model_table_acc_label]
-        #     model_table_col += [i%(self.value_column[ts]) for i in model_table_norm_label]
+        # write m table
+        from sqlalchemy.types import Integer, Float, ARRAY
         types = [Integer(),Integer(),Integer(),Integer(),Integer(),Integer(),Integer(),ARRAY(Float),ARRAY(Float),ARRAY(Float),ARRAY(Float),ARRAY(Float)]
-        mdf = pd.DataFrame(columns=model_table_col,
-                           data=list(m_table))
-        type_dict = {model_table_col[i]: types[i] for i in range(len(model_table_col))}
+        type_dict = {mdf.columns[i]: types[i] for i in range(len(mdf.columns))}
         if create:
             self.db_interface.create_table(tableNames[4], mdf, 'modelno', include_index=False, index_label='modelno', type_dict = type_dict)
         else:
@@ -598,19 +685,123 @@ class TSPI(object):
             self.db_interface.create_index(tableNames[2], 'modelno')
             self.db_interface.create_index(tableNames[3], 'modelno')
             self.db_interface.create_index(tableNames[3], 'coeffpos')
-            self.db_interface.create_coefficients_average_table(tableNames[3], tableNames[3] + '_view', [1,2,10, 20, 100],
-                                                                last_model)
-            self.db_interface.create_index(tableNames[3] + '_view', 'coeffpos')
+        self.write_projected_coefficients(tsmm, AVERAGE_WINDOWS)
+
+    def write_coefficients_average(self, tsmm, c_table, w_f, create, average_windows):
+        """
+        maintain the coefficient averages table (model_name_c_view) over all sub-models and over the last w sub-models 
+        for each w in average_windows. The table keeps running sums per window, which are updated using only the written 
+        sub-models and the sub-models leaving a window, so the cost does not grow with the number of sub-models.
+        ----------
+        Parameters
+        ----------
+        tsmm: TSMM object
+            the model whose coefficients are averaged
+        
+        c_table: array
+            rows (modelno, coeffpos, coeffvalue) of the updated sub-models
+        
+        w_f: int
+            number of coefficients (excluding biases) per sub-model
+
+        create: bol 
+            if Ture, create the table, else update it.
+
+        average_windows:  list 
+            windows for averages to be calculated (e.g.: [10,20] calc. last ten and 20 models)
+        """
+        table_name = tsmm.model_tables_name + '_c'
+        no_coeff = w_f + self.no_ts
+        labels = ['all'] + ['last%s' % w for w in average_windows]
+        average_columns = ['average'] + labels[1:]
+        sum_columns = ['sum_' + l for l in labels]
+        count_columns = ['count_' + l for l in labels]
+
+        def to_vectors(rows):
+            # coefficients are stored ordered by coeffpos Desc, as returned by get_coeff
+            coeffs = {}
+            for modelno, coeffpos, value in rows:
+                coeffs.setdefault(int(modelno), np.zeros(no_coeff))[w_f - 1 - int(coeffpos)] = value
+            return coeffs
+
+        new_coeffs = to_vectors(c_table)
+        new_last = len(tsmm.models) - 1
+        state = None
+        if not create:
+            try:
+                state = np.array(self.db_interface.query_table(table_name + '_view', sum_columns + count_columns, 'true order by coeffpos Desc'), dtype = float)
+            except:
+                # pindices written before the running sums keep their averages in a materialized view (see
+                # create_coefficients_average_table), replace it by the table rebuilt from all stored coefficients
+                try: self.db_interface.execute_query('DROP MATERIALIZED VIEW IF EXISTS %s' % (table_name + '_view'))
+                except: pass
+                stored = to_vectors(self.db_interface.query_table(table_name, ['modelno', 'coeffpos', 'coeffvalue']))
+                stored.update(new_coeffs)
+                new_coeffs = stored
+        if state is None:
+            old_last = -1
+            old_coeffs = {}
+            sums, counts = np.zeros([len(labels), no_coeff]), np.zeros(len(labels))
         else:
-            last_model = len(tsmm.models) - 1
-            self.db_interface.create_coefficients_average_table(tableNames[3], tableNames[3] + '_view', [1,2,10, 20, 100],
-                                                                last_model, refresh=True)
+            sums, counts = state[:, :len(labels)].T, state[0, len(labels):]
+            old_last = int(counts[0]) - 1
+            models = coefficient_window_models(new_coeffs.keys(), old_last, new_last, average_windows)
+            models = [m for m in models if m <= old_last]
+            old_coeffs = {}
+            if len(models) > 0:
+                old_coeffs = to_vectors(self.db_interface.query_table(table_name, ['modelno', 'coeffpos', 'coeffvalue'], 'modelno in (%s)' % ','.join(str(m) for m in models)))
+        sums, counts = update_coefficient_window_sums(sums, counts, old_coeffs, new_coeffs, old_last, new_last, average_windows)
+        
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            averages = sums / counts[:, None]
+        df = pd.DataFrame(data = {'coeffpos': np.arange(w_f - 1, -self.no_ts - 1, -1)})
+        for i in range(len(labels)):
+            df[average_columns[i]] = averages[i]
+        for i in range(len(labels)):
+            df[sum_columns[i]] = sums[i]
+        for i in range(len(labels)):
+            df[count_columns[i]] = counts[i]
+        self.db_interface.create_table(table_name + '_view', df, 'coeffpos', include_index=False)
+
+    def write_projected_coefficients(self, tsmm, average_windows):
+        """
+        write the forecasting coefficients folded with the projection operator U Uᵀ of the sub-model used for projected 
+        forecasts, so that a projected forecast is a plain dot product: coeffsᵀ (U Uᵀ obs) = (U Uᵀ coeffs)ᵀ obs
+        ----------
+        Parameters
+        ----------
+        tsmm: TSMM object
+            the model whose coefficients are projected
+        
+        average_windows:  list 
+            windows of the coefficient averages stored in the coefficient view
+        """
+        model_name = tsmm.model_tables_name
+        k = tsmm.kSingularValuesToKeep
+        columns = ['average'] + ['last%s' % i for i in average_windows]
+        # sub-model used for projection, see _get_forecast_range
+        q_model = max(len(tsmm.models) - 2, 0)
+        Ukw = tsmm.models[q_model].Ukw
+        if Ukw is None:
+            Ukw = self.db_interface.get_U_row(model_name + '_u', [0, 2 * tsmm.models[q_model].N], [q_model, q_model], k,
+                                              return_modelno=False, return_weights_decom=True)[:-1, k:]
+        Ukw = np.array(Ukw, dtype = float)
+        coeffs = np.array(self.db_interface.query_table(model_name + '_c_view', ['coeffpos'] + columns, 'true order by coeffpos Desc'), dtype = float)
+        no_coeff = len(Ukw)
+        # last no_ts entries are the biases, which are not projected
+        weights = coeffs[:-self.no_ts, 1:]
+        weights = np.nan_to_num(weights[-no_coeff:])
+        coeffs[-self.no_ts - no_coeff:-self.no_ts, 1:] = np.dot(Ukw, np.dot(Ukw.T, weights))
+        cdf = pd.DataFrame(columns=['coeffpos'] + columns, data=coeffs)
+        cdf['coeffpos'] = cdf['coeffpos'].astype(int)
+        self.db_interface.create_table(model_name + '_c_projected', cdf, 'coeffpos', include_index=False)
         
     
     def calculate_out_of_sample_error(self, tsmm):
-        models = {k: tsmm.models[k] for k in tsmm.models if tsmm.models[k].updated}
+        models = updated_models(tsmm.models)
         if len(models.keys()) == 0:
             return 
+        from sklearn.metrics import r2_score
         last_model = max(models.keys())
         index_name = tsmm.model_tables_name
         m_table = np.zeros([len(models),7+5],object)
@@ -655,8 +846,7 @@ class TSPI(object):
         self.db_interface.bulk_insert(index_name+'_m', mdf, include_index=False)
 
     def _array_str(self,array_):
-        string = str(array_)
-        return '{'+string[1:-1]+'}'
+        return _array_str(array_)
 
     def _get_range(self, t1, t2=None):
         """
@@ -682,13 +872,8 @@ class TSPI(object):
         
         info = self.db_interface.query_table(models_info_table, columns_queried=columns)
         # info = self.db_interface.query_table(models_info_table, columns_queried=['*'])
-        for model in info:
-            tsmm.models[int(model[0])] = SVDModel('t1', tsmm.kSingularValuesToKeep, int(model[1]), int(model[2]),
-                                                  start=int(model[3]),
-                                                  TimesReconstructed=int(model[5]),
-                                                  TimesUpdated=int(model[4]), SSVT=tsmm.SSVT, probObservation=tsmm.p,
-                                                  updated=False, no_ts = self.no_ts, imputation_model_score = list(model[6]),  forecast_model_score = list(model[7]), forecast_model_score_test = list(model[8]),\
-                                                  norm_mean = list(model[9]) , norm_std = list(model[10]))
+        # keep only the sub-models metadata, SVDModel objects are created when a sub-model is accessed
+        tsmm.models = ModelRegistry(info, tsmm.kSingularValuesToKeep, SSVT=tsmm.SSVT, probObservation=tsmm.p, no_ts = self.no_ts, model_class = tsmm.model_class)
         # load last model
         last_model = len(tsmm.models) - 1
         S= self.db_interface.get_S_row(tsmm.model_tables_name + '_s', [last_model, last_model],tsmm.kSingularValuesToKeep, return_weights_decom = True)[0]
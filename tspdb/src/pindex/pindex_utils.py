@@ -1,6 +1,12 @@
+import functools
+import inspect
 import numpy as np
-import pandas as pd
-from dateutil.parser import parse
+# pandas and dateutil are only needed for timestamp indices and are imported where used
+
+# windows w of the coefficient averages over the last w sub-models (columns last<w> of the coefficient view)
+AVERAGE_WINDOWS = [1, 2, 10, 20, 100]
+# columns added to the _meta table after its first release, with the values pindices created before them behave as
+OPTIONAL_META_COLUMNS = {'materialized': False, 'model_type': 'svd', 'svd_method': 'numpy'}
 
 def index_ts_mapper(start, interval, timestamp):
     """
@@ -8,8 +14,8 @@ def index_ts_mapper(start, interval, timestamp):
     """
     if isinstance(start, (int, np.integer)):
         return int((timestamp-start)/(interval))
-    
-    elif  isinstance(start, (pd.Timestamp)):
+    import pandas as pd
+    if  isinstance(start, (pd.Timestamp)):
         return int((timestamp.value-start.value)/(interval*10**9))
     
     else:
@@ -21,8 +27,8 @@ def index_ts_inv_mapper(start, interval, index):
     """
     if isinstance(start, (int, np.integer)):
         return int((index *interval) + start)
-
-    elif  isinstance(start, (pd.Timestamp)):
+    import pandas as pd
+    if  isinstance(start, (pd.Timestamp)):
         return  pd.to_datetime(float(index*(interval*10**9)+start.tz_localize(None).value))
 
     else:
@@ -33,10 +39,126 @@ def index_exists(interface, index_name ):
     """
     return interface.table_exists(index_name+'_meta')
 
+def query_meta(interface, index_name, columns):
+    """
+    return the values of columns in the _meta table of index_name. The _meta tables of pindices created before the
+    OPTIONAL_META_COLUMNS were added lack them, their default values are returned instead
+    """
+    try:
+        return list(interface.query_table(index_name + '_meta', columns)[0])
+    except Exception:
+        if not any(column in OPTIONAL_META_COLUMNS for column in columns):
+            raise
+    row = iter(interface.query_table(index_name + '_meta', [column for column in columns if column not in OPTIONAL_META_COLUMNS])[0])
+    return [OPTIONAL_META_COLUMNS[column] if column in OPTIONAL_META_COLUMNS else next(row) for column in columns]
+
+def resolve_index(interface, index_name, value_column):
+    """
+    return the pindex that indexes value_column: index_name itself, or the group pindex of value_column if index_name is a 
+    column-group pindex (see group_pindex.create_group_pindex). Routes are cached on the interface, which the SQL
+    functions keep for the session, so that predict queries tspdb.pindices_groups once per (index, column); creating or
+    deleting pindices clears the cache (see clear_routes), and routes made stale by another session are re-checked when
+    the routed query fails (see reroute_on_failure)
+    """
+    routes = getattr(interface, 'pindex_routes', None)
+    if routes is None:
+        routes = interface.pindex_routes = {}
+    if (index_name, value_column) not in routes:
+        schema, name = index_name.split('.') if '.' in index_name else ('tspdb', index_name)
+        try:
+            result = interface.query_table('tspdb.pindices_groups', ['group_index'], "index_name = '%s' and value_column = '%s'" % (name, value_column))
+        except:
+            # catalog created before column-group pindices
+            result = []
+        routes[(index_name, value_column)] = schema + '.' + result[0][0] if len(result) > 0 else index_name
+    return routes[(index_name, value_column)]
+
+def clear_routes(interface):
+    """
+    forget the routes cached by resolve_index on interface
+    """
+    interface.pindex_routes = {}
+
+def reroute_on_failure(function):
+    """
+    decorate a function with index_name and interface arguments that routes its queries with resolve_index. Creating or
+    deleting pindices only clears the routes cached in the session that does it, so a route cached before another
+    session changed the pindex may point to a deleted pindex or one that no longer indexes the column: if the call fails
+    with routes of index_name cached before it, they are forgotten and the call is repeated once
+    """
+    signature = inspect.signature(function)
+    @functools.wraps(function)
+    def call(*args, **kwargs):
+        arguments = signature.bind(*args, **kwargs).arguments
+        interface, index_name = arguments['interface'], arguments['index_name']
+        cached = [key for key in getattr(interface, 'pindex_routes', {}) if key[0] == index_name]
+        try:
+            return function(*args, **kwargs)
+        except Exception:
+            if len(cached) == 0:
+                raise
+        for key in cached:
+            interface.pindex_routes.pop(key, None)
+        return function(*args, **kwargs)
+    return call
+
 def get_bound_time(interface, time_series_table, time_column, exterme = 'min'):
     min_ = interface.get_extreme_value(time_series_table, time_column, exterme)
     if isinstance(min_, (int, np.integer)): return min_
     
     else: 
+        import pandas as pd
+        from dateutil.parser import parse
         min_ = parse(min_)
         return pd.to_datetime(min_).tz_localize(None)
+
+def coefficient_window_models(updated_models, old_last, new_last, average_windows):
+    """
+    return the sub-models whose contribution to the coefficient averages changes when the sub-models in updated_models
+    are (re)written and the last sub-model moves from old_last to new_last: the updated models and the models leaving a window
+    """
+    models = set(int(m) for m in updated_models)
+    for w in average_windows:
+        models.update(range(max(old_last - w + 1, 0), max(new_last - w + 1, 0)))
+    return sorted(m for m in models if m <= max(old_last, new_last))
+
+def update_coefficient_window_sums(sums, counts, old_coeffs, new_coeffs, old_last, new_last, average_windows):
+    """
+    incrementally update the running sums of the sub-model coefficients over all models and over the last w models
+    for each w in average_windows.
+    ----------
+    Parameters
+    ----------
+    sums: array, shape [len(average_windows) + 1, no_coeff]
+        running sums, the first row is over all models and row i over the last average_windows[i-1] models
+    
+    counts: array, shape [len(average_windows) + 1]
+        number of models in each sum
+    
+    old_coeffs: dict 
+        modelno -> coefficients currently accounted for in the sums, for every model returned by coefficient_window_models
+    
+    new_coeffs: dict 
+        modelno -> new coefficients of the updated models
+    
+    old_last, new_last: int
+        index of the last sub-model before and after the update (old_last = -1 if there are no models yet)
+    ----------
+    Returns
+    ----------
+    sums, counts
+        updated running sums and counts
+    """
+    sums = np.array(sums, dtype = float)
+    counts = np.array(counts, dtype = float)
+    windows = [np.inf] + list(average_windows)
+    models = set(old_coeffs) | set(new_coeffs)
+    for r, w in enumerate(windows):
+        for m in models:
+            if m in old_coeffs and old_last - w < m <= old_last:
+                sums[r] -= old_coeffs[m]
+                counts[r] -= 1
+            if new_last - w < m <= new_last:
+                sums[r] += new_coeffs[m] if m in new_coeffs else old_coeffs[m]
+                counts[r] += 1
+    return sums, counts
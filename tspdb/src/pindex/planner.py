@@ -0,0 +1,147 @@
+import re
+import numpy as np
+from tspdb.src.prediction_models.ts_meta_model import page_dimensions
+
+# bytes per stored value
+VALUE_BYTES = 8
+# smallest number of entries per sub-model considered by plan_pindex
+MIN_T = 1000
+# ranks tried by plan_pindex when the rank is estimated from the data and its worst case does not fit
+FALLBACK_RANKS = [20, 10, 5]
+UNITS = {'': 1, 'b': 1, 'kb': 2**10, 'mb': 2**20, 'gb': 2**30, 'tb': 2**40}
+
+def parse_memory(memory):
+    """
+    number of bytes in memory, given as a number of bytes or a string such as '512MB' or '2 GB' (units are powers of 1024)
+    """
+    if isinstance(memory, str):
+        match = re.match(r'^\s*([0-9.]+)\s*([a-zA-Z]*)\s*$', memory)
+        if match is None or match.group(2).lower() not in UNITS:
+            raise Exception('memory_budget %s is not recognized, use a number of bytes or a string such as 512MB or 2GB' % memory)
+        return int(float(match.group(1)) * UNITS[match.group(2).lower()])
+    return int(memory)
+
+def format_memory(no_bytes):
+    for unit in ['TB', 'GB', 'MB', 'KB']:
+        if no_bytes >= UNITS[unit.lower()]:
+            return '%.1f%s' % (no_bytes / UNITS[unit.lower()], unit)
+    return '%sB' % int(no_bytes)
+
+def estimate_memory(no_rows, no_ts, T, L, k = None, k_var = 1, svd_method = 'numpy'):
+    """
+    Estimate the peak memory used by TSPI to build a pindex over no_rows rows of no_ts columns with sub-models of T entries
+    and L rows. The estimate follows the arrays alive while a sub-model is fitted (TSMM.fitModels and SVDModel.fit)
+    and written (build_model_tables), counted in 8-byte values:
+        series:         the queried observations and the TSMM buffer of the last T entries
+        page_matrix:    the normalized, flattened and filled copies of the page matrix, and the matrix itself
+        svd_workspace:  the factors and LAPACK workspace of the SVD, of the page matrix and of its first N-1 rows
+        reconstruction: the dense denoised matrix, and the reconstruction and pseudo-inverse used for the forecasting weights
+        sub_models:     the denoised matrices, observations and factors kept by the sub-models until they are written
+        write_buffers:  the rows of the U, V, S and C tables (and their DataFrames) of all sub-models
+    The mean and variance models are fitted concurrently, thus the fit terms are counted twice if k_var > 0.
+    ----------
+    Parameters
+    ----------
+    no_rows: int
+        number of rows (time points) of the indexed series
+
+    no_ts: int
+        number of indexed columns
+
+    T, L: int
+        number of entries and rows of the sub-models page matrices (see page_dimensions)
+
+    k, k_var: int
+        rank of the mean and variance models. None means estimated from the data, and is counted as its worst case
+        min(L, T/L)
+
+    svd_method: string optional (default = 'numpy')
+        'numpy' or 'gram' (see SVDWrapper)
+    ----------
+    Returns
+    ----------
+    dict
+        estimated bytes of each of the components above, and the peak ('total')
+    """
+    N, M = L, T // L
+    small, large = min(N, M), max(N, M)
+    k = small if k is None else min(k, small)
+    k_var = small if k_var is None else min(k_var, small)
+    no_entries = no_rows * no_ts
+    # sub-models overlap by half: a new sub-model every T/2 entries
+    no_models = max(int(np.ceil(2. * no_entries / T)) - 1, 1)
+    if svd_method == 'gram':
+        # Gram matrix, its eigenvectors and syevd workspace, and the top k singular vectors of the larger dimension
+        svd = 4*small**2 + 6*small + k*large
+    else:
+        # copy of the matrix, U, V and gesdd workspace
+        svd = 2*T + 5*small**2 + 7*small
+    fit = {'page_matrix': 6*T, 'svd_workspace': svd, 'reconstruction': 4*T}
+    concurrent = 2 if k_var else 1
+    sub_model = lambda rank: 2*T + 2*rank*(N + M)
+    table_rows = lambda rank: N*(2*rank + 2) + M*(2*rank + 3) + 3*(N - 1 + no_ts)
+    estimate = {'series': 2*no_entries + T}
+    estimate.update({name: concurrent*value for name, value in fit.items()})
+    estimate['sub_models'] = no_models*(sub_model(k) + (sub_model(k_var) if k_var else 0))
+    estimate['write_buffers'] = 2*no_models*table_rows(max(k, k_var or 0))
+    estimate = {name: int(value*VALUE_BYTES) for name, value in estimate.items()}
+    estimate['total'] = sum(estimate.values())
+    return estimate
+
+def plan_pindex(no_rows, no_ts, memory_budget, T, L = None, k = None, k_var = 1, col_to_row_ratio = 10, persist_L = False, svd_method = None):
+    """
+    Choose the build parameters of a pindex whose estimated peak memory (see estimate_memory) fits memory_budget. For
+    each T, from the requested one halved down to MIN_T, the requested rank (or, if it is estimated from the data, the
+    fixed ranks of FALLBACK_RANKS) is tried with the 'numpy' then the 'gram' SVD, and the first plan that fits is
+    returned. Raise an exception explaining the estimate if no plan fits. Only the size of the series is needed, no data
+    is read.
+    ----------
+    Parameters
+    ----------
+    no_rows: int
+        number of rows (time points) of the indexed series
+
+    no_ts: int
+        number of indexed columns
+
+    memory_budget: int or string
+        maximum memory of the build, in bytes or as a string such as '512MB' (see parse_memory)
+
+    T, L, k, k_var, col_to_row_ratio, persist_L:
+        requested pindex parameters (see TSPI)
+
+    svd_method: string optional (default = None)
+        SVD method to use, if None the planner chooses 'numpy' or 'gram'
+    ----------
+    Returns
+    ----------
+    dict
+        T, L, k, col_to_row_ratio and svd_method of the plan, and its memory estimate ('estimate')
+    """
+    budget = parse_memory(memory_budget)
+    methods = ['numpy', 'gram'] if svd_method is None else [svd_method]
+    ranks = [k] if k is not None else [None] + FALLBACK_RANKS
+    Ts = [int(T)]
+    while Ts[-1] // 2 >= MIN_T:
+        Ts.append(Ts[-1] // 2)
+    smallest = None
+    for T_ in Ts:
+        if L is not None and T_ < 2 * L * no_ts:
+            # the requested number of rows needs at least 2*no_ts columns
+            break
+        T_, L_, ratio, _ = page_dimensions(T_, L, col_to_row_ratio, no_ts, persist_L)
+        for rank in ranks:
+            for method in methods:
+                estimate = estimate_memory(no_rows, no_ts, T_, L_, rank, k_var, method)
+                plan = {'T': T_, 'L': L_, 'k': rank, 'col_to_row_ratio': ratio, 'svd_method': method, 'estimate': estimate}
+                if estimate['total'] <= budget:
+                    return plan
+                if smallest is None or estimate['total'] < smallest['estimate']['total']:
+                    smallest = plan
+    if smallest is None:
+        raise Exception('L = %s needs T >= 2*L*no_ts = %s, but T = %s: raise T or lower L' % (L, 2 * L * no_ts, T))
+    estimate = smallest['estimate']
+    components = ', '.join('%s %s' % (name, format_memory(value)) for name, value in estimate.items() if name != 'total')
+    raise Exception('The pindex cannot be built within memory_budget = %s: the smallest plan (T = %s, L = %s, k = %s, svd_method = %s) needs an estimated %s (%s). '
+                    'The series and sub_models terms grow with the number of rows and do not depend on T, index fewer rows or columns, or raise memory_budget'
+                    % (format_memory(budget), smallest['T'], smallest['L'], smallest['k'], smallest['svd_method'], format_memory(estimate['total']), components))
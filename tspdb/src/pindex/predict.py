@@ -1,12 +1,14 @@
 import numpy as np
-import pandas as pd
+from statistics import NormalDist
 from tspdb.src.database_module.db_class import Interface
-from tspdb.src.pindex.pindex_utils import index_ts_mapper, index_ts_inv_mapper, index_exists, get_bound_time
-from scipy.stats import norm
+from tspdb.src.pindex.pindex_utils import index_ts_mapper, index_ts_inv_mapper, index_exists, get_bound_time, resolve_index, query_meta, reroute_on_failure
+from tspdb.src.tsUtils import fill_missing
+# pandas is only needed for timestamp indices and is imported where used to keep the import of this module cheap
 
 def unnormalize(arr, mean, std):
     return arr *std + mean
 
+@reroute_on_failure
 def get_prediction_range( index_name, table_name, value_column, interface, t1,t2 , uq = True, uq_method ='Gaussian', c = 95., projected = False):
 
     """
@@ -50,10 +52,12 @@ def get_prediction_range( index_name, table_name, value_column, interface, t1,t2
     deviation array, shape [1, (t1 - t2 +1)  ]
         The deviation from the mean to get the desired confidence level 
     """
+    # route column-group pindices to the pindex of value_column
+    index_name = resolve_index(interface, index_name, value_column)
     # query pindex parameters
 
 
-    T,T_var, L, k,k_var, L_var, last_model, MUpdateIndex,var_direct, interval, start_ts, last_TS_seen, last_TS_seen_var, index_col, value_columns, MUpdateIndex_var, p = interface.query_table( index_name+'_meta',['T','T_var', 'L', 'k','k_var','L_var', 'no_submodels', 'last_TS_inc', 'var_direct_method', 'agg_interval','start_time', "last_TS_seen", "last_TS_seen_var", "time_column","indexed_column",'last_TS_inc_var','p'])[0]
+    T,T_var, L, k,k_var, L_var, last_model, MUpdateIndex,var_direct, interval, start_ts, last_TS_seen, last_TS_seen_var, index_col, value_columns, MUpdateIndex_var, p, materialized = query_meta(interface, index_name, ['T','T_var', 'L', 'k','k_var','L_var', 'no_submodels', 'last_TS_inc', 'var_direct_method', 'agg_interval','start_time', "last_TS_seen", "last_TS_seen_var", "time_column","indexed_column",'last_TS_inc_var','p', 'materialized'])
     last_model -= 1
     value_columns = value_columns.split(',')
     no_ts = len(value_columns)
@@ -62,6 +66,7 @@ def get_prediction_range( index_name, table_name, value_column, interface, t1,t2
     except: raise Exception('The value column %s selected is not indexed by the chosen pindex'%(value_column))
     
     if not isinstance(t1, (int, np.integer)):
+        import pandas as pd
         t1 = pd.to_datetime(t1)
         t2 = pd.to_datetime(t2)
         start_ts = pd.to_datetime(start_ts)
@@ -88,7 +93,7 @@ def get_prediction_range( index_name, table_name, value_column, interface, t1,t2
         if uq_method == 'Chebyshev':
             alpha = 1./(np.sqrt(1-c/100))
         elif uq_method == 'Gaussian':
-            alpha = norm.ppf(1/2 + c/200)
+            alpha = NormalDist().inv_cdf(1/2 + c/200)
         else:
             raise Exception('uq_method option is not recognized,  available options are: "Gaussian" or "Chebyshev"')
             
@@ -97,41 +102,63 @@ def get_prediction_range( index_name, table_name, value_column, interface, t1,t2
         print('forecasting')
         if not uq: return _get_forecast_range(index_name,table_name, value_column, index_col, interface, t1,t2, MUpdateIndex,L,k,T,last_model,interval, start_ts, last_TS_seen,no_ts,value_index, projected = projected, p = p)
         
+        # if the second moment is forecasted from the observations, forecast it with the mean in one pass
+        elif not var_direct:
+            prediction, var = _get_forecast_range_uq(index_name,table_name, value_column, index_col, interface, t1,t2, interval, start_ts, no_ts,value_index, projected = projected, p = p)
         else:
             prediction = _get_forecast_range(index_name,table_name, value_column, index_col, interface, t1,t2, MUpdateIndex,L,k,T,last_model,interval, start_ts, last_TS_seen,no_ts,value_index, projected = projected, p = p)
             var = _get_forecast_range(index_name+'_variance',table_name, value_column, index_col, interface, t1,t2, MUpdateIndex_var, L,k_var,T_var,last_model,interval, start_ts, last_TS_seen_var, no_ts,value_index,variance = True, direct_var =var_direct,  projected = projected,p = p)
-            # if the second model is used for the second moment, subtract the squared mean to estimate the variance
-            if not var_direct:
-                var = var - (prediction)**2
-            var *= (var>0) 
-            
-            return prediction, alpha*np.sqrt(var)
+        # if the second model is used for the second moment, subtract the squared mean to estimate the variance
+        if not var_direct:
+            var = var - (prediction)**2
+        var *= (var>0) 
+        
+        return prediction, alpha*np.sqrt(var)
     
     # if all points are in the past, use get_imputation_range
     elif t2 <=  (MUpdateIndex - 1)//no_ts:    
+        # serve from the materialized denoised table if the pindex keeps one
+        if materialized:
+            result = _get_materialized_range(index_name, interface, t1, t2, value_index)
+            if result is not None:
+                if not uq: return result[:,0]
+                return result[:,0], alpha*np.sqrt(result[:,1])
         if not uq: return _get_imputation_range(index_name, table_name, value_column, index_col, interface, t1,t2,L,k,T,last_model, value_index, no_ts,p = p)
-        else:
-            prediction = _get_imputation_range(index_name, table_name, value_column, index_col, interface, t1,t2,L,k,T,last_model, value_index, no_ts,p = p)
-            if (MUpdateIndex_var-1)//no_ts >= t2:
-                var = _get_imputation_range(index_name+'_variance',table_name, value_column, index_col, interface, t1,t2, L_var,k_var,T_var,last_model, value_index, no_ts,p = p)
-            else:
-                imputations_var = _get_imputation_range(index_name+'_variance', table_name, value_column, index_col, interface, t1,(MUpdateIndex_var-1)//no_ts,L_var,k_var,T_var,last_model, value_index, no_ts,p = p)
-                forecast_var = _get_forecast_range(index_name+'_variance',table_name, value_column, index_col, interface,MUpdateIndex_var//no_ts ,t2, MUpdateIndex_var,L_var,k_var,T_var,last_model,interval, start_ts,last_TS_seen, no_ts,value_index,variance = True, direct_var =var_direct,projected = projected,p = p)
-                var = np.array(list(imputations_var)+list(forecast_var))
-            # if the second model is used for the second moment, subtract the squared mean to estimate the variance
+        # if the variance sub-models have the same layout and cover the range, impute mean and variance in one pass
+        result = None
+        if L_var == L and T_var == T and (MUpdateIndex_var-1)//no_ts >= t2:
+            result = _get_imputation_range_uq(index_name, table_name, value_column, index_col, interface, t1,t2,L,k,k_var,T,last_model, value_index, no_ts,p = p)
+        if result is not None:
+            prediction, var = result
             if not var_direct:
                 var = var - (prediction)**2
-            var *= (var>0) 
-            return prediction, alpha*np.sqrt(var)
+            var *= (var>0)
+        else:
+            prediction = _get_imputation_range(index_name, table_name, value_column, index_col, interface, t1,t2,L,k,T,last_model, value_index, no_ts,p = p)
+            var = _get_imputation_range_var(index_name, table_name, value_column, index_col, interface, t1, t2, prediction, MUpdateIndex_var, L_var, k_var, T_var, last_model, interval, start_ts, last_TS_seen, no_ts, value_index, var_direct, projected = projected, p = p)
+        return prediction, alpha*np.sqrt(var)
     
     # if points are in both the future and in the past, use both        
     else:
-        imputations = _get_imputation_range(index_name, table_name, value_column, index_col, interface, t1,(MUpdateIndex-1)//no_ts,L,k,T,last_model,value_index, no_ts,p = p)
-        forecast = _get_forecast_range(index_name,table_name, value_column, index_col, interface,(MUpdateIndex)//no_ts ,t2, MUpdateIndex,L,k,T,last_model,interval, start_ts,last_TS_seen, no_ts,value_index,projected = projected,p = p)
-        if not uq: return list(imputations)+list(forecast)
+        if not uq:
+            imputations = _get_imputation_range(index_name, table_name, value_column, index_col, interface, t1,(MUpdateIndex-1)//no_ts,L,k,T,last_model,value_index, no_ts,p = p)
+            forecast = _get_forecast_range(index_name,table_name, value_column, index_col, interface,(MUpdateIndex)//no_ts ,t2, MUpdateIndex,L,k,T,last_model,interval, start_ts,last_TS_seen, no_ts,value_index,projected = projected,p = p)
+            return list(imputations)+list(forecast)
         else:
-            imputations_var = _get_imputation_range(index_name+'_variance', table_name, value_column, index_col, interface, t1,(MUpdateIndex_var-1)//no_ts,L_var,k_var,T_var,last_model, value_index, no_ts,p = p)
-            forecast_var = _get_forecast_range(index_name+'_variance',table_name, value_column, index_col, interface,MUpdateIndex_var//no_ts ,t2, MUpdateIndex_var,L_var,k_var,T_var,last_model,interval, start_ts,last_TS_seen, no_ts,value_index,variance = True, direct_var =var_direct,projected = projected,p = p)
+            # if both models cover the same points, query the mean and variance models together (see the cases above)
+            result = None
+            if MUpdateIndex_var == MUpdateIndex and L_var == L and T_var == T:
+                result = _get_imputation_range_uq(index_name, table_name, value_column, index_col, interface, t1,(MUpdateIndex-1)//no_ts,L,k,k_var,T,last_model, value_index, no_ts,p = p)
+            if result is not None:
+                imputations, imputations_var = result
+            else:
+                imputations = _get_imputation_range(index_name, table_name, value_column, index_col, interface, t1,(MUpdateIndex-1)//no_ts,L,k,T,last_model,value_index, no_ts,p = p)
+                imputations_var = _get_imputation_range(index_name+'_variance', table_name, value_column, index_col, interface, t1,(MUpdateIndex_var-1)//no_ts,L_var,k_var,T_var,last_model, value_index, no_ts,p = p)
+            if MUpdateIndex_var == MUpdateIndex and not var_direct:
+                forecast, forecast_var = _get_forecast_range_uq(index_name,table_name, value_column, index_col, interface,(MUpdateIndex)//no_ts ,t2, interval, start_ts, no_ts,value_index, projected = projected, p = p)
+            else:
+                forecast = _get_forecast_range(index_name,table_name, value_column, index_col, interface,(MUpdateIndex)//no_ts ,t2, MUpdateIndex,L,k,T,last_model,interval, start_ts,last_TS_seen, no_ts,value_index,projected = projected,p = p)
+                forecast_var = _get_forecast_range(index_name+'_variance',table_name, value_column, index_col, interface,MUpdateIndex_var//no_ts ,t2, MUpdateIndex_var,L_var,k_var,T_var,last_model,interval, start_ts,last_TS_seen, no_ts,value_index,variance = True, direct_var =var_direct,projected = projected,p = p)
             if not var_direct:
                 forecast_var = forecast_var - (forecast)**2
                 imputations_var = imputations_var - (imputations)**2
@@ -143,6 +170,7 @@ def get_prediction_range( index_name, table_name, value_column, interface, t1,t2
             
 
 
+@reroute_on_failure
 def get_prediction(index_name, table_name, value_column, interface, t, uq = True, uq_method ='Gaussian', c = 95, projected = False):
     """
     Return the predicted value along with the confidence interval for the value of column_name  at time t  using index_name 
@@ -183,6 +211,8 @@ def get_prediction(index_name, table_name, value_column, interface, t, uq = True
         The deviation from the mean to get the desired confidence level 
     
     """
+    # route column-group pindices to the pindex of value_column
+    index_name = resolve_index(interface, index_name, value_column)
     # query pindex parameters
     
     T,T_var, L, k,k_var, L_var, last_model, MUpdateIndex,var_direct, interval, start_ts, last_TS_seen, last_TS_seen_var, index_col, value_columns, MUpdateIndex_var, p = interface.query_table( index_name+'_meta',['T','T_var', 'L', 'k','k_var','L_var', 'no_submodels', 'last_TS_inc', 'var_direct_method', 'agg_interval','start_time', "last_TS_seen", "last_TS_seen_var", "time_column","indexed_column",'last_TS_inc_var','p'])[0]
@@ -192,6 +222,7 @@ def get_prediction(index_name, table_name, value_column, interface, t, uq = True
     no_ts = len(value_columns)
     
     if not isinstance(t, (int, np.integer)):
+        import pandas as pd
         t = pd.to_datetime(t)
         start_ts = pd.to_datetime(start_ts)
     interval = float(interval)
@@ -210,18 +241,27 @@ def get_prediction(index_name, table_name, value_column, interface, t, uq = True
 
     t = index_ts_mapper(start_ts, interval, t)
     if uq:
+
+        if c < 0 or c >=100:
+            raise Exception('confidence interval c must be in the range (0,100): 0 <=c< 100')
         
         if uq_method == 'Chebyshev':
             alpha = 1./(np.sqrt(1-c/100))
         
         elif uq_method == 'Gaussian':
-            alpha = norm.ppf(1/2 + c/200)
+            alpha = NormalDist().inv_cdf(1/2 + c/200)
         
         else:
             raise Exception('uq_method option is not recognized,  available options are: "Gaussian" or "Chebyshev"')
 
     if t > (MUpdateIndex - 1)//no_ts:
         if not uq: return _get_forecast_range(index_name,table_name, value_column, index_col, interface,t, t, MUpdateIndex,L,k,T,last_model, interval, start_ts, last_TS_seen,no_ts,value_index, projected = projected,p = p)[-1]
+        # if the second moment is forecasted from the observations, forecast it with the mean in one pass
+        elif not var_direct:
+            prediction, var = _get_forecast_range_uq(index_name,table_name, value_column, index_col, interface,t, t, interval, start_ts, no_ts,value_index, projected = projected, p = p)
+            var = var[-1] - prediction[-1]**2
+            var *= (var>0)
+            return prediction[-1], alpha*np.sqrt(var)
         else:
             prediction = _get_forecast_range(index_name,table_name, value_column, index_col, interface,t, t, MUpdateIndex,L,k,T,last_model, interval, start_ts,last_TS_seen, no_ts,value_index, projected = projected,p = p)[-1]
             var = _get_forecast_range(index_name+'_variance',table_name, value_column, index_col, interface,t, t, MUpdateIndex_var,L_var,k_var,T_var,last_model,interval, start_ts,last_TS_seen_var,no_ts,value_index,  projected = projected, variance = True, direct_var =var_direct,p = p)[-1]
@@ -233,6 +273,16 @@ def get_prediction(index_name, table_name, value_column, interface, t, uq = True
 
     else:
         if not uq: return _get_imputation(index_name, table_name, value_column, index_col, interface, t,L,k,T,last_model,no_ts,value_index,p = p)
+        # if the variance sub-models have the same layout and cover t, impute mean and variance in one pass
+        result = None
+        if L_var == L and T_var == T and t <= (MUpdateIndex_var - 1)//no_ts:
+            result = _get_imputation_uq(index_name, table_name, value_column, index_col, interface, t,L,k,k_var,T,last_model, no_ts,value_index,p = p)
+        if result is not None:
+            prediction, var = result
+            if not var_direct:
+                var = var - (prediction)**2
+            var *= (var>0)
+            return prediction, alpha*np.sqrt(var)
         else:
             prediction = _get_imputation(index_name, table_name, value_column, index_col, interface, t,L,k,T,last_model, no_ts,value_index,p = p)
             if t > (MUpdateIndex_var - 1)//no_ts: var =  _get_forecast_range(index_name+'_variance',table_name, value_column, index_col, interface,t, t, MUpdateIndex_var,L_var,k_var,T_var,last_model,interval, start_ts,last_TS_seen_var,no_ts,value_index,  projected = projected, variance = True, direct_var =var_direct, p = p)[-1]
@@ -245,6 +295,101 @@ def get_prediction(index_name, table_name, value_column, interface, t, uq = True
             
 
 
+def _get_imputation_range_var(index_name, table_name, value_column, index_col, interface, t1, t2, prediction, MUpdateIndex_var, L_var, k_var, T_var, last_model, interval, start_ts, last_TS_seen, no_ts, value_index, var_direct, projected = False, p = 1.0):
+    """
+    Return the estimated variance in the past at the time range t1 to t2 for the value of column_name using the variance
+    sub-models of index_name. Points the variance model has not been fit on yet are forecasted.
+    ----------
+    Parameters
+    ----------
+    prediction: array, shape [(t1 - t2 +1)  ]
+        Imputed mean of the time series in the range [t1,t2], used when the variance model estimates the second moment
+
+    var_direct: boolean
+        if false, the variance model estimates the second moment and the squared mean is subtracted
+
+    (see _get_imputation_range and _get_forecast_range for the remaining parameters)
+    ----------
+    Returns
+    ----------
+    var  array, shape [(t1 - t2 +1)  ]
+        non-negative variance of the time series in the range [t1,t2]
+    """
+    if (MUpdateIndex_var-1)//no_ts >= t2:
+        var = _get_imputation_range(index_name+'_variance',table_name, value_column, index_col, interface, t1,t2, L_var,k_var,T_var,last_model, value_index, no_ts,p = p)
+    else:
+        imputations_var = _get_imputation_range(index_name+'_variance', table_name, value_column, index_col, interface, t1,(MUpdateIndex_var-1)//no_ts,L_var,k_var,T_var,last_model, value_index, no_ts,p = p)
+        forecast_var = _get_forecast_range(index_name+'_variance',table_name, value_column, index_col, interface,MUpdateIndex_var//no_ts ,t2, MUpdateIndex_var,L_var,k_var,T_var,last_model,interval, start_ts,last_TS_seen, no_ts,value_index,variance = True, direct_var =var_direct,projected = projected,p = p)
+        var = np.array(list(imputations_var)+list(forecast_var))
+    # if the second model is used for the second moment, subtract the squared mean to estimate the variance
+    if not var_direct:
+        var = var - (prediction)**2
+    var *= (var>0) 
+    return var
+
+def _get_materialized_range(index_name, interface, t1, t2, value_index):
+    """
+    Return the materialized denoised values and variances in the range t1 to t2, or None if the range is not fully materialized
+    ----------
+    Returns
+    ----------
+    array, shape [(t1 - t2 +1), 2 ]
+        denoised mean (first column) and variance (second column) of the time series in the range [t1,t2]
+    """
+    result = interface.query_table(index_name+'_denoised', ['mean', 'var'], 'time_series = %s and tsrow >= %s and tsrow <= %s order by tsrow'%(value_index, t1, t2))
+    if len(result) != t2 - t1 + 1:
+        return None
+    return np.array(result, dtype = float)
+
+def materialize_denoised_range(index_name, table_name, interface, t1, create = False):
+    """
+    (Re)write the materialized denoised values and variances of index_name from time index t1 up to the last
+    point covered by the index, for every indexed column. The values are computed exactly as get_prediction_range would.
+    ----------
+    Parameters
+    ----------
+    index_name: string 
+        name of the PINDEX 
+
+    table_name: string 
+        name of the time series table in the database
+
+    interface: db_class object
+        object used to communicate with the DB. see ../database/db_class for the abstract class
+
+    t1: int
+        first time index (in model units) to be rewritten
+
+    create: boolean optional (default=false) 
+        if true, create the materialized table, else replace its rows from t1 onwards
+    """
+    import pandas as pd
+    T,T_var, L, k,k_var, L_var, last_model, MUpdateIndex,var_direct, interval, start_ts, last_TS_seen, index_col, value_columns, MUpdateIndex_var, p = interface.query_table( index_name+'_meta',['T','T_var', 'L', 'k','k_var','L_var', 'no_submodels', 'last_TS_inc', 'var_direct_method', 'agg_interval','start_time', "last_TS_seen", "time_column","indexed_column",'last_TS_inc_var','p'])[0]
+    last_model -= 1
+    value_columns = value_columns.split(',')
+    no_ts = len(value_columns)
+    interval = float(interval)
+    if not isinstance(start_ts, (int, np.integer)):
+        start_ts = pd.to_datetime(start_ts)
+    t1 = max(int(t1), 0)
+    t2 = (MUpdateIndex - 1)//no_ts
+    if t2 < t1:
+        return
+    tables = []
+    for value_index, value_column in enumerate(value_columns):
+        prediction = _get_imputation_range(index_name, table_name, value_column, index_col, interface, t1,t2,L,k,T,last_model, value_index, no_ts,p = p)
+        if k_var:
+            var = _get_imputation_range_var(index_name, table_name, value_column, index_col, interface, t1, t2, prediction, MUpdateIndex_var, L_var, k_var, T_var, last_model, interval, start_ts, last_TS_seen, no_ts, value_index, var_direct, p = p)
+        else:
+            var = np.full(len(prediction), np.nan)
+        tables.append(pd.DataFrame(data = {'tsrow': np.arange(t1, t2+1), 'time_series': value_index, 'mean': prediction, 'var': var}))
+    df = pd.concat(tables)
+    if create:
+        interface.create_table(index_name+'_denoised', df, 'time_series, tsrow', include_index = False)
+    else:
+        interface.delete(index_name+'_denoised', 'tsrow >= %s' % t1)
+        interface.bulk_insert(index_name+'_denoised', df, include_index = False)
+
 def _get_imputation_range(index_name, table_name, value_column, index_col, interface, t1,t2,L,k,T,last_model, value_index, no_ts, p = 1.0):
 
     """
@@ -293,20 +438,67 @@ def _get_imputation_range(index_name, table_name, value_column, index_col, inter
     
     """
     # map the two boundary points to their sub models
-    T_ts = T//no_ts
-    m1 = int( max((t1) / int(T_ts / 2) - 1, 0))
-    m2 = int( max((t2) / int(T_ts / 2) - 1, 0))
+    m1, m2 = _imputation_models(t1, t2, T, no_ts)
     # query the sub-models parameters
     result = interface.query_table( index_name+'_m',['L', 'start', 'N'], 'modelno =' + str(m1) +' or modelno =' + str(m2)+' order by modelno')
-    N1, start1, M1 = result[0]
-    # if sub-models are different, get the other sub-model's parameters
-    if m1 != m2: N2, start2, M2 = result[1]
-    else: N2, start2, M2 = result[0]
     
     # query normalization constants
     col_norm_mean = 'norm_mean'
     col_norm_std = 'norm_std' 
     norm = interface.query_table( index_name+'_m',[col_norm_mean, col_norm_std], 'modelno >=' + str(m1) +' and modelno <=' + str(m2+1)+' order by modelno')
+    geometry = _imputation_geometry(result, t1, t2, m1, m2, L, last_model, value_index, no_ts)
+    start1, N1, M1, start2, N2, M2, tscol1, tsrow1, tscol2, tsrow2 = geometry
+    
+    # if tscol are the same
+    if tscol1 == tscol2:
+        ## change to SUV
+        S = interface.get_S_row(index_name + '_s', [m1, m2 + 1], k,
+                                         return_modelno=True)
+        U = interface.get_U_row(index_name + '_u', [tsrow1, tsrow2], [m1, m2 + 1], k,
+                                         return_modelno=True)
+        V = interface.get_V_row(index_name + '_v', [tscol1, tscol2], k, value_index,
+                                         [m1, m2 + 1],
+                                         return_modelno=True)
+    else:
+        # query relevant tuples
+        ## change to SUV
+        S = interface.get_S_row(index_name + '_s', [m1, m2 + 1], k,
+                                         return_modelno=True)
+        U = interface.get_U_row(index_name + '_u', [0, 2 * L], [m1, m2 + 1], k,
+                                         return_modelno=True)
+        V = interface.get_V_row(index_name + '_v', [tscol1, tscol2], k,value_index,
+                                         [m1, m2 + 1],
+                                         return_modelno=True)
+    return _imputation_from_factors(S, U, V, norm, t1, t2, m1, m2, geometry, T, last_model, value_index, no_ts, p)
+
+def _imputation_models(t1, t2, T, no_ts):
+    """
+    Return the sub models of the two boundary points t1 and t2 of an imputed range
+    """
+    T_ts = T//no_ts
+    m1 = int( max((t1) / int(T_ts / 2) - 1, 0))
+    m2 = int( max((t2) / int(T_ts / 2) - 1, 0))
+    return m1, m2
+
+def _imputation_geometry(result, t1, t2, m1, m2, L, last_model, value_index, no_ts):
+    """
+    Return the position of t1 and t2 in the matrices of their sub models
+    ----------
+    Parameters
+    ----------
+    result: list
+        rows ['L', 'start', 'N'] of the sub models m1 and m2 (one row if m1 == m2), ordered by modelno
+
+    (see _get_imputation_range for the remaining parameters)
+    ----------
+    Returns
+    ----------
+    start1, N1, M1, start2, N2, M2, tscol1, tsrow1, tscol2, tsrow2
+    """
+    N1, start1, M1 = result[0]
+    # if sub-models are different, get the other sub-model's parameters
+    if m1 != m2: N2, start2, M2 = result[1]
+    else: N2, start2, M2 = result[0]
 
     # Remove when the model writing is fixed (It should write integers directly)
     start1, start2,N1, N2, M1, M2 =  map(int, [start1, start2,N1, N2, M1, M2])
@@ -327,16 +519,16 @@ def _get_imputation_range(index_name, table_name, value_column, index_col, inter
     else:
         tscol1 = (int(t1/(N1)))*no_ts + value_index
         tsrow1 = int(t1 % N1)
+    return start1, N1, M1, start2, N2, M2, tscol1, tsrow1, tscol2, tsrow2
+
+def _imputation_from_factors(S, U, V, norm, t1, t2, m1, m2, geometry, T, last_model, value_index, no_ts, p = 1.0):
+    """
+    Return the imputed values in the range t1 to t2 from the queried S, U, V rows (with the submodel numbers in the first
+    column) and the normalization constants of the sub models m1 to m2+1
+    """
+    start1, N1, M1, start2, N2, M2, tscol1, tsrow1, tscol2, tsrow2 = geometry
     # if tscol are the same
     if tscol1 == tscol2:
-        ## change to SUV
-        S = interface.get_S_row(index_name + '_s', [m1, m2 + 1], k,
-                                         return_modelno=True)
-        U = interface.get_U_row(index_name + '_u', [tsrow1, tsrow2], [m1, m2 + 1], k,
-                                         return_modelno=True)
-        V = interface.get_V_row(index_name + '_v', [tscol1, tscol2], k, value_index,
-                                         [m1, m2 + 1],
-                                         return_modelno=True)
         mat = np.dot(U[U[:, 0] == m1, 1:] * S[0, 1:], V[V[:, 0] == m1, 1:].T)
         if (m2 < last_model-1 and m1 != 0):
             Result = 0.5 * unnormalize(mat.T.flatten()/p,norm[0][0][value_index],norm[0][1][value_index]) + 0.5 * unnormalize(np.dot(U[U[:, 0] == m1 + 1, 1:] * S[1, 1:],V[V[:, 0] == m1 + 1, 1:].T).T.flatten()/p, norm[1][0][value_index],norm[1][1][value_index])
@@ -351,16 +543,7 @@ def _get_imputation_range(index_name, table_name, value_column, index_col, inter
         
         Result = np.zeros([t2 + - end  - i_index + 1])
         Count = np.zeros(Result.shape)
-        # query relevant tuples
-        ## change to SUV
         T_e = T//no_ts
-        S = interface.get_S_row(index_name + '_s', [m1, m2 + 1], k,
-                                         return_modelno=True)
-        U = interface.get_U_row(index_name + '_u', [0, 2 * L], [m1, m2 + 1], k,
-                                         return_modelno=True)
-        V = interface.get_V_row(index_name + '_v', [tscol1, tscol2], k,value_index,
-                                         [m1, m2 + 1],
-                                         return_modelno=True)
         for m in range(m1, m2 + 1 + (m2 < last_model - 1)):
             mat = np.dot(U[U[:, 0] == m, 1:] * S[m - m1, 1:], V[V[:, 0] == m, 1:].T)
             start = start1//no_ts + int(T_e/2)*(m-m1)
@@ -397,6 +580,49 @@ def _get_imputation_range(index_name, table_name, value_column, index_col, inter
         if end == 0: end = None
         return Result[tsrow1:end]
 
+def _get_imputation_range_uq(index_name, table_name, value_column, index_col, interface, t1,t2,L,k,k_var,T,last_model, value_index, no_ts, p = 1.0):
+    """
+    Return the imputed values of the mean model and of the variance model of index_name in the range t1 to t2. The factors
+    of both models are fetched together, with one query per table family (see Interface.get_factor_rows), and used in
+    one pass. Both models must have the same L and T, and the variance model must cover t2.
+    ----------
+    Parameters
+    ----------
+    k_var: int
+        number of retained singular values in the variance sub models
+
+    (see _get_imputation_range for the remaining parameters)
+    ----------
+    Returns
+    ----------
+    prediction, var  arrays, shape [(t1 - t2 +1)  ]
+        Imputed values of the mean and variance models (variance or second moment, see var_direct) in the range [t1,t2],
+        or None if the sub models of the two models do not share the same layout
+    """
+    m1, m2 = _imputation_models(t1, t2, T, no_ts)
+    index_names = [index_name, index_name + '_variance']
+    # parameters and normalization constants of the sub models of both models
+    m_tables = ' UNION ALL '.join(['SELECT %s as table_no, modelno, "L", start, "N", norm_mean, norm_std FROM %s_m' % (i, name) for i, name in enumerate(index_names)])
+    rows = interface.query_table('(' + m_tables + ') as m', ['table_no', 'modelno', 'L', 'start', 'N', 'norm_mean', 'norm_std'], 'modelno >=' + str(m1) +' and modelno <=' + str(m2+1)+' order by table_no, modelno')
+    geometries, norms = [], []
+    for table_no in range(2):
+        table_rows = [row for row in rows if row[0] == table_no]
+        result = [row[2:5] for row in table_rows if row[1] in (m1, m2)]
+        if len(result) == 0:
+            return None
+        geometries.append(_imputation_geometry(result, t1, t2, m1, m2, L, last_model, value_index, no_ts))
+        norms.append([row[5:7] for row in table_rows])
+    if geometries[0] != geometries[1]:
+        return None
+    start1, N1, M1, start2, N2, M2, tscol1, tsrow1, tscol2, tsrow2 = geometries[0]
+    models_predicate = '(modelno >= %s and modelno <= %s)' % (m1, m2 + 1)
+    tsrow_range = [tsrow1, tsrow2] if tscol1 == tscol2 else [0, 2 * L]
+    ks = [k, k_var]
+    S = interface.get_factor_rows([name + '_s' for name in index_names], 's', ks, models_predicate, order = 'modelno')
+    U = interface.get_factor_rows([name + '_u' for name in index_names], 'u', ks, 'tsrow >= %s and tsrow <= %s and %s' % (tsrow_range[0], tsrow_range[1], models_predicate))
+    V = interface.get_factor_rows([name + '_v' for name in index_names], 'v', ks, 'time_series = %s and tscolumn >= %s and tscolumn <= %s and %s' % (value_index, tscol1, tscol2, models_predicate))
+    return tuple(_imputation_from_factors(S[i], U[i], V[i], norms[i], t1, t2, m1, m2, geometries[i], T, last_model, value_index, no_ts, p) for i in range(2))
+
 
 def _get_forecast_range(index_name,table_name, value_column, index_col, interface, t1, t2,MUpdateIndex,L,k,T,last_model, interval, start_ts, last_TS_seen,no_ts, value_index,direct_var = False,variance = False,averaging = 'average', projected = False,p = 1.0):
     """
@@ -455,56 +681,16 @@ def _get_forecast_range(index_name,table_name, value_column, index_col, interfac
     no_coeff = len(coeffs)
  
     if not direct_var or not variance:
+            # the projection U Uᵀ of the second to last sub-model is folded into the stored coefficients (see write_projected_coefficients)
             if projected:
-                if last_model != 0:
-                    q_model = last_model- 1
-                else:
-                    q_model = last_model
-                U = interface.get_U_row(index_name + '_u', [0, 2 * L], [q_model, q_model], k,
-                                             return_modelno=False,return_weights_decom=True)[:-1,k:]
-                no_coeff = U.shape[0]
-                projection_matrix = np.dot(U,U.T)
-            
-            agg_interval = float(interval)
-            if not isinstance(start_ts, (int, np.integer)):
-                start_ts = pd.Timestamp(start_ts)
-            # if the range queries is beyond what we have so far, get the last point seen
-            last_TS_seen = get_bound_time(interface, table_name, index_col, 'max')
-            if not isinstance(last_TS_seen, (int, np.integer)):
-                last_TS_seen = index_ts_mapper(start_ts, agg_interval, last_TS_seen)
-            last_TS_seen+=1
-            
-            t1_ = min(t1, last_TS_seen)
-            t2_ = min(t2, last_TS_seen)
-            end = index_ts_inv_mapper(start_ts, agg_interval, t1_ - 1 )
-            start = index_ts_inv_mapper(start_ts, agg_interval, t1_ - no_coeff  )
-            obs = interface.get_time_series(table_name, start, end, start_ts = start_ts,  value_column=value_column, index_column= index_col, Desc=False, interval = agg_interval, aggregation_method =  averaging)
-            output = np.zeros([t2 - t1_ + 1 ])
-            obs = np.array(obs)[-no_coeff:,0]
-            # Fill using fill_method
-            if p <1:
-                obs = np.array(pd.DataFrame(obs).fillna(value = 0).values[:,0])
-                obs /= p
+                coeffs_projected = _get_projected_coeff(interface, index_name, averaging, no_ts)[:-no_ts]
             else:
-                obs = np.array(pd.DataFrame(obs).fillna(method = 'ffill').values[:,0])
-                obs = np.array(pd.DataFrame(obs).fillna(method = 'bfill').values[:,0])
+                coeffs_projected = coeffs
+            
+            obs, t1_ = _get_forecast_observations(table_name, value_column, index_col, interface, t1, no_coeff, interval, start_ts, averaging, p)
             if variance:
                 obs = obs **2
-            observations = np.zeros([t2 - t1_ + 1 + no_coeff])
-            observations[:no_coeff] = obs
-            
-            for i in range(0, t2 + 1 - t1_): 
-                    if i  < len(obs):
-                        if projected:
-                            output[i] = np.dot(coeffs.T, np.dot(projection_matrix, observations[i:i + no_coeff]))+coeffs_ts[value_index]
-                        else:
-                            output[i] = np.dot(coeffs.T,  observations[i:i + no_coeff])+coeffs_ts[value_index]
-                    else:
-                        output[i] = np.dot(coeffs.T,  observations[i:i + no_coeff])+coeffs_ts[value_index]
-                    if i+no_coeff >= len(obs):
-                        observations[i+no_coeff] = output[i]
-
-            return output[-(t2 - t1 + 1):]
+            return _forecast_from_observations(obs, coeffs, coeffs_projected, coeffs_ts[value_index], t1, t1_, t2)
             
     # the forecast should always start at the last point
     t1_ = MUpdateIndex//no_ts 
@@ -516,6 +702,99 @@ def _get_forecast_range(index_name,table_name, value_column, index_col, interfac
     
 
 
+def _get_projected_coeff(interface, index_name, averaging, no_ts):
+    """
+    Return the coefficients averaging of index_name folded with the projection U Uᵀ of the sub-model used for projected
+    forecasts, ordered as get_coeff, with the biases (last no_ts entries) unprojected. They are read from the
+    index_name_c_projected table (see write_projected_coefficients); pindices written before that table existed have them
+    computed from the U table.
+    """
+    try:
+        return np.array(interface.get_coeff(index_name + '_c_projected', averaging), dtype = float)
+    except Exception:
+        pass
+    if index_name.endswith('_variance'):
+        k, L, no_models = interface.query_table(index_name[:-len('_variance')] + '_meta', ['k_var', 'L_var', 'no_submodels_var'])[0]
+    else:
+        k, L, no_models = interface.query_table(index_name + '_meta', ['k', 'L', 'no_submodels'])[0]
+    q_model = max(no_models - 2, 0)
+    U = np.array(interface.get_U_row(index_name + '_u', [0, 2 * L], [q_model, q_model], k, return_modelno = False, return_weights_decom = True), dtype = float)[:-1, k:]
+    coeffs = np.array(interface.get_coeff(index_name + '_c_view', averaging), dtype = float)
+    weights = np.nan_to_num(coeffs[:-no_ts][-len(U):])
+    coeffs[-no_ts - len(U):-no_ts] = np.dot(U, np.dot(U.T, weights))
+    return coeffs
+
+def _get_forecast_observations(table_name, value_column, index_col, interface, t1, no_coeff, interval, start_ts, averaging = 'average', p = 1.0):
+    """
+    Return the no_coeff observations preceding the forecasted range starting at t1 (or the last point seen if t1 is
+    beyond it), with the missing values filled, and the first forecasted time index
+    """
+    agg_interval = float(interval)
+    if not isinstance(start_ts, (int, np.integer)):
+        import pandas as pd
+        start_ts = pd.Timestamp(start_ts)
+    # if the range queries is beyond what we have so far, get the last point seen
+    last_TS_seen = get_bound_time(interface, table_name, index_col, 'max')
+    if not isinstance(last_TS_seen, (int, np.integer)):
+        last_TS_seen = index_ts_mapper(start_ts, agg_interval, last_TS_seen)
+    last_TS_seen+=1
+    
+    t1_ = min(t1, last_TS_seen)
+    end = index_ts_inv_mapper(start_ts, agg_interval, t1_ - 1 )
+    start = index_ts_inv_mapper(start_ts, agg_interval, t1_ - no_coeff  )
+    obs = interface.get_time_series(table_name, start, end, start_ts = start_ts,  value_column=value_column, index_column= index_col, Desc=False, interval = agg_interval, aggregation_method =  averaging)
+    obs = np.array(obs, dtype = float)[-no_coeff:,0]
+    # Fill using fill_method
+    fill_missing(obs, p >= 1)
+    if p <1:
+        obs /= p
+    return obs, t1_
+
+def _forecast_from_observations(obs, coeffs, coeffs_projected, intercept, t1, t1_, t2):
+    """
+    Return the forecasted values in the range t1 to t2 by recursively applying the coefficients to the observations
+    preceding t1_ (see _get_forecast_observations)
+    """
+    no_coeff = len(coeffs)
+    output = np.zeros([t2 - t1_ + 1 ])
+    observations = np.zeros([t2 - t1_ + 1 + no_coeff])
+    observations[:no_coeff] = obs
+    
+    for i in range(0, t2 + 1 - t1_): 
+            if i  < len(obs):
+                output[i] = np.dot(coeffs_projected.T,  observations[i:i + no_coeff])+intercept
+            else:
+                output[i] = np.dot(coeffs.T,  observations[i:i + no_coeff])+intercept
+            if i+no_coeff >= len(obs):
+                observations[i+no_coeff] = output[i]
+
+    return output[-(t2 - t1 + 1):]
+
+def _get_forecast_range_uq(index_name,table_name, value_column, index_col, interface, t1, t2, interval, start_ts, no_ts, value_index, averaging = 'average', projected = False, p = 1.0):
+    """
+    Return the forecasted values of the mean model and of the second moment model of index_name (var_direct = false) in
+    the range t1 to t2. Both forecasts are computed from one query of the preceding observations.
+    ----------
+    Returns
+    ----------
+    prediction, second_moment  arrays, shape [(t1 - t2 +1)  ]
+    """
+    coefficients = []
+    for name in [index_name, index_name + '_variance']:
+        coeffs = np.array(interface.get_coeff(name + '_c_view', averaging))
+        coeffs_ts = coeffs[-no_ts:]
+        coeffs = coeffs[:-no_ts]
+        if projected:
+            coeffs_projected = _get_projected_coeff(interface, name, averaging, no_ts)[:-no_ts]
+        else:
+            coeffs_projected = coeffs
+        coefficients.append((coeffs, coeffs_projected, coeffs_ts[value_index]))
+    no_coeff = max(len(c[0]) for c in coefficients)
+    obs, t1_ = _get_forecast_observations(table_name, value_column, index_col, interface, t1, no_coeff, interval, start_ts, averaging, p)
+    prediction = _forecast_from_observations(obs[len(obs) - len(coefficients[0][0]):], *coefficients[0], t1, t1_, t2)
+    second_moment = _forecast_from_observations(obs[len(obs) - len(coefficients[1][0]):]**2, *coefficients[1], t1, t1_, t2)
+    return prediction, second_moment
+
 def _get_imputation(index_name, table_name, value_column, index_col, interface, t,L,k,T,last_model, no_ts,value_index, p = 1.0):
     """
     Return the imputed value in the past at time t for the value of column_name using index_name 
@@ -600,6 +879,54 @@ def _get_imputation(index_name, table_name, value_column, index_col, interface,
         # else return one value directly
         return unnormalize(sum([a * b * c for a, b, c in zip(U[0, :], S[0, :], V[0, :])])/p,  norm[0][0][value_index], norm[0][1][value_index])
 
+def _get_imputation_uq(index_name, table_name, value_column, index_col, interface, t,L,k,k_var,T,last_model, no_ts,value_index, p = 1.0):
+    """
+    Return the imputed values of the mean model and of the variance model of index_name at time t, fetching the factors
+    of both models together (see _get_imputation_range_uq). Both models must have the same L and T, and the variance
+    model must cover t.
+    ----------
+    Returns
+    ----------
+    prediction, var  floats
+        Imputed values of the mean and variance models (variance or second moment, see var_direct) at time t, or None if
+        the last sub models of the two models do not share the same layout
+    """
+    # map t to the right sub model
+    T_ts = T//no_ts
+    modelNo = int( max((t) / int(T_ts / 2) - 1, 0))
+    index_names = [index_name, index_name + '_variance']
+    m_tables = ' UNION ALL '.join(['SELECT %s as table_no, modelno, "L", start, norm_mean, norm_std FROM %s_m' % (i, name) for i, name in enumerate(index_names)])
+    rows = interface.query_table('(' + m_tables + ') as m', ['table_no', 'modelno', 'L', 'start', 'norm_mean', 'norm_std'], 'modelno =' + str(modelNo) +' or modelno =' + str(modelNo+1)+' order by table_no, modelno')
+    norms = [[row[4:6] for row in rows if row[0] == table_no] for table_no in range(2)]
+    N = L
+    # if it is in the last sub-model, tscol and tsrow will be calculated differently
+    if modelNo == last_model:
+        layouts = [tuple(row[2:4]) for row in rows if row[1] == modelNo]
+        if len(layouts) != 2 or layouts[0] != layouts[1]:
+            return None
+        N, last_model_start = layouts[0]
+        tscolumn = int((t - last_model_start//no_ts) / N)*no_ts + value_index + int((last_model_start)/L)
+        tsrow = (t - last_model_start//no_ts) % N
+    else:
+        tscolumn = (int(t/(N)))*no_ts + value_index
+        tsrow = t % N
+    # if it is in the model before last, do not query the last model
+    models = [modelNo, modelNo] if modelNo == last_model - 1 else [modelNo, modelNo + 1]
+    ks = [k, k_var]
+    S = interface.get_factor_rows([name + '_s' for name in index_names], 's', ks, 'modelno = %s or modelno = %s' % tuple(models), order = 'modelno')
+    V = interface.get_factor_rows([name + '_v' for name in index_names], 'v', ks, 'time_series = %s and tscolumn = %s' % (value_index, tscolumn))
+    U = interface.get_factor_rows([name + '_u' for name in index_names], 'u', ks, 'tsrow = %s and (modelno = %s or modelno = %s)' % (tsrow, models[0], models[1]))
+    result = []
+    for i in range(2):
+        U_, S_, V_, norm = U[i][:, 1:], S[i][:, 1:], V[i][:, 1:], norms[i]
+        # if two sub models are queried get the average
+        if modelNo < last_model - 1 and V_.shape[0] == 2 and U_.shape[0] == 2:
+            result.append(0.5* (unnormalize(np.sum(U_[0,:] * S_[0] * V_[0,:])/p, norm[0][0][value_index],norm[0][1][value_index])+ unnormalize(np.sum(U_[1,:] * S_[1] * V_[1,:])/p, norm[1][0][value_index],norm[1][1][value_index])))
+        else:
+            result.append(unnormalize(np.sum(U_[0, :] * S_[0, :] * V_[0, :])/p, norm[0][0][value_index], norm[0][1][value_index]))
+    return tuple(result)
+
+@reroute_on_failure
 def forecast_next(index_name,table_name, value_column, index_col, interface, averaging = 'last1', ahead = 1):
     """
     Return the florcasted value in the past at the time range t1 to t2 for the value of column_name using index_name 
@@ -629,6 +956,8 @@ def forecast_next(index_name,table_name, value_column, index_col, interface, ave
     prediction  array, shape [(t1 - t2 +1)  ]
         forecasted value of the time series  in the range [t1,t2]  using index_name
     """
+    # route column-group pindices to the pindex of value_column
+    index_name = resolve_index(interface, index_name, value_column)
     # get coefficients
     coeffs = np.array(interface.get_coeff(index_name + '_c_view', averaging))
     no_coeff = len(coeffs)
@@ -637,6 +966,7 @@ def forecast_next(index_name,table_name, value_column, index_col, interface, ave
     agg_interval = float(agg_interval)
     
     if not isinstance(start_ts, (int, np.integer)):
+        import pandas as pd
         start_ts = pd.Timestamp(start_ts)
      
     end = index_ts_inv_mapper(start_ts, agg_interval, end_index)
@@ -0,0 +1,403 @@
+import numpy as np
+from statistics import NormalDist
+from tspdb.src.pindex.snapshot import PindexSnapshot, load_snapshot
+from tspdb.src.pindex.backtest import forecast_windows
+from tspdb.src.tsUtils import fill_missing
+# pandas is only needed for timestamp indices and is imported where used
+
+def _alpha(uq_method, c):
+    # multiple of the standard deviation of the c% confidence interval, as in get_prediction_range
+    if c < 0 or c >= 100:
+        raise Exception('confidence interval c must be in the range (0,100): 0 <=c< 100')
+    if uq_method == 'Chebyshev':
+        return 1./(np.sqrt(1-c/100))
+    elif uq_method == 'Gaussian':
+        return NormalDist().inv_cdf(1/2 + c/200)
+    raise Exception('uq_method option is not recognized,  available options are: "Gaussian" or "Chebyshev"')
+
+class _SnapshotModel(object):
+    """
+    The sub-models of the mean or variance model of a snapshot. Only the per sub-model boundaries of the U and V tables,
+    the singular values and the normalization constants are read when created; the U and V rows of a query are read
+    from the (memory mapped) tables when they are used.
+    """
+    def __init__(self, snapshot, prefix, k, no_ts):
+        self.no_ts = no_ts
+        columns = snapshot.columns
+        u, v = snapshot.tables[prefix + 'u'], snapshot.tables[prefix + 'v']
+        self.u = u[:, columns[prefix + 'u'].index('u1'):columns[prefix + 'u'].index('u1') + k]
+        self.v = v[:, columns[prefix + 'v'].index('v1'):columns[prefix + 'v'].index('v1') + k]
+        self.u_row = snapshot.column(prefix + 'u', 'tsrow')
+        self.v_column = snapshot.column(prefix + 'v', 'tscolumn')
+        self.v_series = snapshot.column(prefix + 'v', 'time_series')
+
+        modelno = np.array(snapshot.column(prefix + 'm', 'modelno'), dtype = int)
+        self.no_models = modelno.max() + 1
+        models = np.arange(self.no_models)
+        # first and last + 1 positions of the rows of each sub-model in the U and V tables (ordered by row_id)
+        u_modelno, v_modelno = snapshot.column(prefix + 'u', 'modelno'), snapshot.column(prefix + 'v', 'modelno')
+        self.u_start, self.u_end = np.searchsorted(u_modelno, models, 'left'), np.searchsorted(u_modelno, models, 'right')
+        self.v_start, self.v_end = np.searchsorted(v_modelno, models, 'left'), np.searchsorted(v_modelno, models, 'right')
+        self.u_first = np.array([self.u_row[i] if i < len(self.u_row) else 0 for i in self.u_start], dtype = int)
+        self.v_first = np.array([self.v_column[i] if i < len(self.v_column) else 0 for i in self.v_start], dtype = int)
+
+        s_modelno = np.array(snapshot.column(prefix + 's', 'modelno'), dtype = int)
+        self.s = np.zeros([self.no_models, k])
+        self.s[s_modelno] = np.array(snapshot.tables[prefix + 's'][:, columns[prefix + 's'].index('s1'):columns[prefix + 's'].index('s1') + k])
+        self.norm_mean, self.norm_std = np.full([self.no_models, no_ts], np.nan), np.full([self.no_models, no_ts], np.nan)
+        self.norm_mean[modelno] = np.array(snapshot.column(prefix + 'm', 'norm_mean'))
+        self.norm_std[modelno] = np.array(snapshot.column(prefix + 'm', 'norm_std'))
+        # rows (the L column of the M table) and start of each sub-model
+        self.rows, self.start = np.zeros(self.no_models, dtype = int), np.zeros(self.no_models, dtype = int)
+        self.rows[modelno] = np.array(snapshot.column(prefix + 'm', 'L'), dtype = int)
+        self.start[modelno] = np.array(snapshot.column(prefix + 'm', 'start'), dtype = int)
+
+    def _values(self, models, rows, columns, value_index, p):
+        """
+        the values of the sub-models at (rows, columns) of their matrices, and whether the sub-model has the U row with
+        tsrow = rows and the V row with tscolumn = columns and time_series = value_index
+        """
+        valid = (models >= 0) & (models < self.no_models)
+        models = np.where(valid, models, 0)
+        u_index = self.u_start[models] + rows - self.u_first[models]
+        v_index = self.v_start[models] + columns - self.v_first[models]
+        valid &= (u_index >= self.u_start[models]) & (u_index < self.u_end[models]) & (v_index >= self.v_start[models]) & (v_index < self.v_end[models])
+        u_index, v_index = np.where(valid, u_index, 0), np.where(valid, v_index, 0)
+        valid &= (self.u_row[u_index] == rows) & (self.v_column[v_index] == columns) & (self.v_series[v_index] == value_index)
+        values = np.einsum('ij,ij,ij->i', self.u[u_index], self.s[models], self.v[v_index])
+        return values/p * self.norm_std[models, value_index] + self.norm_mean[models, value_index], valid
+
+    def impute(self, t, value_index, L, T, last_model, p = 1.0):
+        """
+        imputed values at the time indices t of the columns value_index, as _get_imputation computes them: the average
+        of the sub-model of t and of the next one (if both cover t and the next one is not the last), unnormalized
+        """
+        t, value_index = np.asarray(t, dtype = int), np.asarray(value_index, dtype = int)
+        no_ts = self.no_ts
+        m1 = np.maximum(t // int(T // no_ts / 2) - 1, 0)
+        # the last sub-model may be placed and shaped differently
+        last = min(last_model, self.no_models - 1)
+        start, N = self.start[last], self.rows[last]
+        offset = t - start // no_ts
+        is_last = m1 == last_model
+        rows = np.where(is_last, offset % N, t % L)
+        columns = np.where(is_last, (offset // N) * no_ts + value_index + int(start / L), (t // L) * no_ts + value_index)
+        first, valid1 = self._values(m1, rows, columns, value_index, p)
+        second, valid2 = self._values(m1 + 1, rows, columns, value_index, p)
+        valid2 &= m1 < last_model - 1
+        total = np.where(valid1, first, 0.) + np.where(valid2, second, 0.)
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            return total / (valid1.astype(int) + valid2)
+
+class PindexReader(object):
+    """
+    Answer get_prediction, get_prediction_range and forecast_next from a pindex snapshot (see export_pindex), without a
+    database. Imputations are computed from the memory mapped U, S and V rows with the overlapping sub-models blended
+    and the sub-model normalization undone, and forecasts apply the stored coefficients to the observations given to
+    the reader, with the same uncertainty quantification as the database functions. Requests are vectorized
+    (get_predictions answers a batch of (column, time) pairs at once), and the reader is not modified by queries, so
+    it can be shared by the threads of a thread pool.
+    """
+    def __init__(self, snapshot, observations = None, observations_start = 0, mmap = True):
+        """
+        ----------
+        Parameters
+        ----------
+        snapshot: PindexSnapshot or string
+            snapshot, or its path (see load_snapshot)
+
+        observations: dict optional (default=None)
+            value column -> 1-D array of its observations (aggregated as in the pindex, NaN if missing), needed to
+            forecast beyond the points covered by the pindex. The end of the array plays the role of the last point
+            of the time series table
+
+        observations_start: int optional (default=0)
+            time index (in model units) of the first value of the observations
+
+        mmap: boolean optional (default=true)
+            if snapshot is a path, memory map its tables
+        """
+        if not isinstance(snapshot, PindexSnapshot):
+            snapshot = load_snapshot(snapshot, mmap = mmap)
+        self.snapshot = snapshot
+        meta = snapshot.meta
+        self.index_name = snapshot.index_name
+        self.value_columns = meta['indexed_column'].split(',')
+        self.no_ts = len(self.value_columns)
+        self.T, self.L, self.k, self.p = int(meta['T']), int(meta['L']), int(meta['k']), float(meta['p'])
+        self.last_model = int(meta['no_submodels']) - 1
+        self.MUpdateIndex = int(meta['last_TS_inc'])
+        self.var_direct = bool(meta['var_direct_method'])
+        self.start_time, self.agg_interval = meta['start_time'], float(meta['agg_interval'])
+        self.mean = _SnapshotModel(snapshot, '', self.k, self.no_ts)
+        self.var = None
+        if 'variance_u' in snapshot.tables:
+            self.T_var, self.L_var, self.k_var = int(meta['T_var']), int(meta['L_var']), int(meta['k_var'])
+            self.MUpdateIndex_var = int(meta['last_TS_inc_var'])
+            self.var = _SnapshotModel(snapshot, 'variance_', self.k_var, self.no_ts)
+        self.observations = {column: np.asarray(values, dtype = float) for column, values in (observations or {}).items()}
+        self.observations_start = int(observations_start)
+
+    def _value_index(self, value_column):
+        try: return self.value_columns.index(value_column)
+        except: raise Exception('The value column %s selected is not indexed by the chosen pindex' % (value_column))
+
+    def _to_index(self, t):
+        # time indices (in model units) of the indices or timestamps t, as index_ts_mapper
+        if isinstance(self.start_time, (int, np.integer)):
+            return np.trunc((np.asarray(t) - self.start_time) / self.agg_interval).astype(int)
+        import pandas as pd
+        t = np.asarray(pd.to_datetime(np.atleast_1d(t)).values.astype('datetime64[ns]').astype(np.int64))
+        return np.trunc((t - pd.Timestamp(self.start_time).value) / (self.agg_interval*10**9)).astype(int)
+
+    def _coefficients(self, prefix, averaging = 'average', projected = False):
+        # forecasting coefficients (oldest lag first), the coefficients used for the first steps and the intercepts
+        coeffs = np.array(self.snapshot.column(prefix + 'c_view', averaging.lower()), dtype = float)
+        intercepts, coeffs = coeffs[-self.no_ts:], coeffs[:-self.no_ts]
+        coeffs_projected = coeffs
+        if projected:
+            coeffs_projected = np.array(self.snapshot.column(prefix + 'c_projected', averaging.lower()), dtype = float)[:-self.no_ts]
+        return coeffs, coeffs_projected, intercepts
+
+    def _observations_end(self, value_column):
+        if value_column not in self.observations:
+            raise Exception('observations of %s are needed to forecast it, pass them to PindexReader' % value_column)
+        return self.observations_start + len(self.observations[value_column])
+
+    def _windows(self, value_column, origins, no_coeff):
+        """
+        the no_coeff observations preceding each origin, filled as _get_forecast_observations does, shape [no_origins, no_coeff]
+        """
+        series = self.observations[value_column]
+        positions = np.asarray(origins, dtype = int) - self.observations_start
+        if positions.min() < no_coeff or positions.max() > len(series):
+            raise Exception('observations of %s must cover the %s points preceding each forecast' % (value_column, no_coeff))
+        windows = np.ascontiguousarray(series[positions[:, None] + np.arange(-no_coeff, 0)[None, :]].T)
+        fill_missing(windows, self.p >= 1)
+        if self.p < 1:
+            windows /= self.p
+        return windows.T
+
+    def _forecast(self, kind, value_column, t, projected = False, no_coeff = None, averaging = 'average', ranged = False):
+        """
+        forecasts of value_column at the time indices t (sorted if ranged). kind is 'mean' (the mean model), 'second'
+        (the second moment model, from the squared observations) or 'variance' (the variance model, from its own
+        imputations, var_direct). Points are forecasted from the observations preceding them, or recursively from the
+        last observations if beyond them, as get_prediction does; if ranged, t is the range t[0] to t[-1] and all points
+        are forecasted recursively from the first one, as get_prediction_range does.
+        """
+        t = np.asarray(t, dtype = int)
+        value_index = self._value_index(value_column)
+        if kind == 'variance':
+            # recursively forecasted from the imputed variance preceding the last point seen by the variance model
+            coeffs, _, intercepts = self._coefficients('variance_', averaging)
+            origin = self.MUpdateIndex_var // self.no_ts
+            window = self.var.impute(np.arange(origin - len(coeffs), origin), value_index, self.L_var, self.T_var, self.last_model)
+            forecast = forecast_windows(window[None, :], coeffs, coeffs, intercepts[value_index], t.max() - origin + 1)[0]
+            return forecast[t - origin]
+        coeffs, coeffs_projected, intercepts = self._coefficients('variance_' if kind == 'second' else '', averaging, projected)
+        no_coeff = no_coeff or len(coeffs)
+        end = self._observations_end(value_column)
+        origins = np.minimum(t[:1] if ranged else t, end)
+        forecast = np.empty(len(t))
+        far = origins == end
+        if ranged or far.all():
+            # one recursive forecast from the first origin
+            origin = origins[0]
+            windows = self._windows(value_column, [origin], no_coeff)[:, no_coeff - len(coeffs):]
+            if kind == 'second':
+                windows = windows**2
+            return forecast_windows(windows, coeffs, coeffs_projected, intercepts[value_index], t.max() - origin + 1)[0, t - origin]
+        # observed points are forecasted one step ahead from their own windows
+        origins_, inverse = np.unique(origins[~far], return_inverse = True)
+        windows = self._windows(value_column, origins_, no_coeff)[:, no_coeff - len(coeffs):]
+        if kind == 'second':
+            windows = windows**2
+        forecast[~far] = forecast_windows(windows, coeffs, coeffs_projected, intercepts[value_index], 1)[inverse, 0]
+        if far.any():
+            forecast[far] = self._forecast(kind, value_column, t[far], projected, no_coeff, averaging, ranged = True)
+        return forecast
+
+    def _fused_no_coeff(self):
+        # observations used when the mean and the second moment are forecasted together (see _get_forecast_range_uq)
+        return max(len(self.snapshot.column('c_view', 'average')), len(self.snapshot.column('variance_c_view', 'average'))) - self.no_ts
+
+    def _check_uq(self):
+        if self.var is None:
+            raise Exception('the pindex has no variance model, use uq = False')
+
+    def get_predictions(self, value_columns, t, uq = True, uq_method = 'Gaussian', c = 95., projected = False):
+        """
+        Return the predicted values (and the deviations of the c% confidence interval) of a batch of (value column,
+        time) pairs, each as get_prediction would
+        ----------
+        Parameters
+        ----------
+        value_columns: string or list of strings
+            column of each request, or one column for all
+
+        t: list of (int or timestamp)
+            index or timestamp of each request
+
+        uq, uq_method, c, projected:
+            see get_prediction
+        ----------
+        Returns
+        ----------
+        prediction array, shape [no_requests]
+
+        deviation array, shape [no_requests]
+            returned if uq
+        """
+        t = np.atleast_1d(self._to_index(t))
+        if isinstance(value_columns, str):
+            value_columns = [value_columns] * len(t)
+        value_columns = np.asarray(value_columns, dtype = object)
+        value_index = np.array([self._value_index(column) for column in value_columns], dtype = int)
+        if uq:
+            self._check_uq()
+            alpha = _alpha(uq_method, c)
+        fused = uq and not self.var_direct
+        bound = (self.MUpdateIndex - 1) // self.no_ts
+
+        prediction = np.empty(len(t))
+        past = t <= bound
+        prediction[past] = self.mean.impute(t[past], value_index[past], self.L, self.T, self.last_model, self.p)
+        for column in set(value_columns[~past]):
+            mask = ~past & (value_columns == column)
+            prediction[mask] = self._forecast('mean', column, t[mask], projected, self._fused_no_coeff() if fused else None)
+        if not uq:
+            return prediction
+
+        var = np.empty(len(t))
+        forecasted = ~past | (t > (self.MUpdateIndex_var - 1) // self.no_ts)
+        var[~forecasted] = self.var.impute(t[~forecasted], value_index[~forecasted], self.L_var, self.T_var, self.last_model, self.p)
+        for column in set(value_columns[forecasted]):
+            for future in [True, False]:
+                mask = forecasted & (value_columns == column) & (~past == future)
+                if mask.any():
+                    kind = 'variance' if self.var_direct else 'second'
+                    var[mask] = self._forecast(kind, column, t[mask], projected, self._fused_no_coeff() if fused and future else None)
+        if not self.var_direct:
+            var = var - prediction**2
+        var *= (var > 0)
+        return prediction, alpha*np.sqrt(var)
+
+    def get_prediction(self, value_column, t, uq = True, uq_method = 'Gaussian', c = 95., projected = False):
+        """
+        Return the predicted value along with the confidence interval for the value of value_column at time t, as the
+        database function get_prediction does
+        ----------
+        Parameters
+        ----------
+        value_column: string
+            name of column than contain time series value
+
+        t: (int or timestamp)
+            index or timestamp indicating the queried time.
+
+        uq: boolean optional (default=true)
+            if true,  return upper and lower bound of the  c% confidenc interval
+
+        uq_method: string optional (defalut = 'Gaussian') options: {'Gaussian', 'Chebyshev'}
+            Uncertainty quantification method used to estimate the confidence interval
+
+        c: float optional (default 95.)
+            confidence level for uncertainty quantification, 0<c<100
+
+        projected: boolean optional (default=false)
+            if true, use the projected coefficients for the first forecasted steps
+        ----------
+        Returns
+        ----------
+        prediction float
+            Values of time series at time t
+
+        deviation float
+            The deviation from the mean to get the desired confidence level
+        """
+        result = self.get_predictions(value_column, [t], uq, uq_method, c, projected)
+        if not uq:
+            return float(result[0])
+        return float(result[0][0]), float(result[1][0])
+
+    def get_prediction_range(self, value_column, t1, t2, uq = True, uq_method = 'Gaussian', c = 95., projected = False):
+        """
+        Return the predicted values (and the deviations of the c% confidence interval) of value_column at time t1 to t2,
+        as the database function get_prediction_range does: points covered by the pindex are imputed and the following
+        points are forecasted recursively
+        ----------
+        Parameters
+        ----------
+        value_column: string
+            name of column than contain time series value
+
+        t1, t2: (int or timestamp)
+            index or timestamp indicating the start and the end of the queried range
+
+        uq, uq_method, c, projected:
+            see get_prediction
+        ----------
+        Returns
+        ----------
+        prediction array, shape [(t1 - t2 +1)  ]
+            Values of the predicted point of the time series in the time interval t1 to t2
+
+        deviation array, shape [(t1 - t2 +1)  ]
+            The deviation from the mean to get the desired confidence level, returned if uq
+        """
+        t1, t2 = self._to_index([t1, t2])
+        value_index = self._value_index(value_column)
+        if uq:
+            self._check_uq()
+            alpha = _alpha(uq_method, c)
+        t = np.arange(t1, t2 + 1)
+        bound = (self.MUpdateIndex - 1) // self.no_ts
+        past = t <= bound
+        # the fused forecast of the mean and second moment uses the observations needed by both
+        fused = uq and not self.var_direct and (t1 > bound or (t2 > bound and self.MUpdateIndex_var == self.MUpdateIndex))
+        no_coeff = self._fused_no_coeff() if fused else None
+
+        prediction = np.empty(len(t))
+        prediction[past] = self.mean.impute(t[past], value_index, self.L, self.T, self.last_model, self.p)
+        if not past.all():
+            prediction[~past] = self._forecast('mean', value_column, np.arange(max(t1, self.MUpdateIndex // self.no_ts), t2 + 1), projected, no_coeff, ranged = True)
+        if not uq:
+            return prediction
+
+        kind = 'variance' if self.var_direct else 'second'
+        if t1 > bound:
+            var = self._forecast(kind, value_column, t, projected, no_coeff, ranged = True)
+        else:
+            var = np.empty(len(t))
+            imputed = t <= (self.MUpdateIndex_var - 1) // self.no_ts
+            var[imputed] = self.var.impute(t[imputed], value_index, self.L_var, self.T_var, self.last_model, self.p)
+            if not imputed.all():
+                var[~imputed] = self._forecast(kind, value_column, np.arange(max(t1, self.MUpdateIndex_var // self.no_ts), t2 + 1), projected, no_coeff, ranged = True)
+        if not self.var_direct:
+            var = var - prediction**2
+        var *= (var > 0)
+        return prediction, alpha*np.sqrt(var)
+
+    def forecast_next(self, value_column, averaging = 'last1', ahead = 1):
+        """
+        Return the forecasts of the ahead points following the last observation of value_column, applying the
+        coefficients averaging (with the intercept) recursively to the observations, as get_prediction_range forecasts
+        ----------
+        Parameters
+        ----------
+        value_column: string
+            name of column than contain time series value
+
+        averaging: string, optional, (default 'last1')
+            Coefficients used when forecasting, 'average' means use the average of all sub models coeffcients.
+
+        ahead: int optional (default=1)
+            number of forecasted points
+        ----------
+        Returns
+        ----------
+        prediction  array, shape [ahead]
+        """
+        end = self._observations_end(value_column)
+        return self._forecast('mean', value_column, np.arange(end, end + ahead), averaging = averaging, ranged = True)
@@ -0,0 +1,343 @@
+import os
+import json
+import numbers
+import numpy as np
+from tspdb.src.pindex.pindex_utils import index_ts_inv_mapper, index_exists, query_meta, AVERAGE_WINDOWS
+# pandas is only needed to import a snapshot into a database and for timestamp indices, and is imported where used
+
+# version of the snapshot layout, stored in the manifest
+SNAPSHOT_VERSION = 1
+# manifest of a snapshot directory, whose tables are stored next to it as <table>.npy
+MANIFEST = 'snapshot.json'
+HDF5_EXTENSIONS = ('.h5', '.hdf5')
+# columns of the meta table (see TSPI.write_model)
+META_COLUMNS = ['T', 'T0', 'gamma', 'k', 'L', 'last_TS_seen', 'last_TS_inc', 'last_TS_fullSVD', 'time_series_table_name', 'indexed_column',
+                'time_column', 'soft_thresholding', 'no_submodels', 'no_submodels_var', 'col_to_row_ratio', 'col_to_row_ratio_var', 'T_var',
+                'k_var', 'L_var', 'last_TS_seen_var', 'last_TS_inc_var', 'aggregation_method', 'agg_interval', 'start_time', 'last_TS_fullSVD_var',
+                'var_direct_method', 'persist_l', 'p', 'materialized', 'model_type', 'svd_method']
+# columns of the sub-models table (see build_model_tables), the array columns hold one value per indexed column
+MODEL_COLUMNS = ['modelno', 'L', 'N', 'start', 'dataPoints', 'timesUpdated', 'timesRecons']
+MODEL_ARRAY_COLUMNS = ['imputation_acc', 'forecasting_acc', 'forecasting_test_acc', 'norm_mean', 'norm_std']
+# columns of the materialized denoised table (see materialize_denoised_range)
+DENOISED_COLUMNS = ['tsrow', 'time_series', 'mean', 'var']
+# columns restored as integers when a snapshot is imported
+INTEGER_COLUMNS = set(['row_id', 'tsrow', 'tscolumn', 'time_series', 'coeffpos'] + MODEL_COLUMNS)
+
+def _model_tables(k):
+    """
+    table suffix -> (columns, ordering) of the tables of a mean or variance model with k retained singular values, as
+    written by TSPI.write_tsmm_model
+    """
+    factor = lambda name: [name + str(i) for i in range(1, k + 1)]
+    labels = ['all'] + ['last%s' % w for w in AVERAGE_WINDOWS]
+    averages = ['average'] + labels[1:]
+    return {'u': (['row_id', 'modelno'] + factor('u') + factor('uw') + ['tsrow'], 'row_id'),
+            'v': (['row_id', 'modelno'] + factor('v') + factor('vw') + ['tscolumn', 'time_series'], 'row_id'),
+            's': (['modelno'] + factor('s') + factor('sw'), 'modelno'),
+            'c': (['row_id', 'modelno', 'coeffpos', 'coeffvalue'], 'row_id'),
+            'm': (MODEL_COLUMNS + MODEL_ARRAY_COLUMNS, 'modelno'),
+            'c_view': (['coeffpos'] + averages + ['sum_' + l for l in labels] + ['count_' + l for l in labels], 'coeffpos desc'),
+            'c_projected': (['coeffpos'] + averages, 'coeffpos desc')}
+
+def _coefficient_averages(interface, table_name, columns, no_models):
+    """
+    rows of the coefficient averages table. Pindices written before the running sums (see write_coefficients_average)
+    only have the averages, their sums and counts are derived from the number of sub-models
+    """
+    try:
+        return interface.query_table(table_name, columns, 'true order by coeffpos desc')
+    except:
+        averages = [column for column in columns if not column.startswith(('sum_', 'count_'))]
+        rows = np.array(interface.query_table(table_name, averages, 'true order by coeffpos desc'), dtype = float).reshape(-1, len(averages))
+    counts = np.array([no_models] + [min(w, no_models) for w in AVERAGE_WINDOWS], dtype = float)
+    sums = rows[:, 1:] * counts
+    return np.hstack([rows, sums, np.tile(counts, (len(rows), 1))])
+
+def _projected_coefficients(interface, index_name, columns, no_ts):
+    """
+    rows of the projected coefficients table, computed from the U table for pindices written before it existed (see
+    predict._get_projected_coeff)
+    """
+    try:
+        rows = interface.query_table(index_name + '_c_projected', columns, 'true order by coeffpos desc')
+        if len(rows) > 0:
+            return rows
+    except:
+        pass
+    from tspdb.src.pindex.predict import _get_projected_coeff
+    coeffpos = np.array([row[0] for row in interface.query_table(index_name + '_c_view', ['coeffpos'], 'true order by coeffpos desc')], dtype = float)
+    return np.column_stack([coeffpos] + [_get_projected_coeff(interface, index_name, column, no_ts) for column in columns[1:]])
+
+def _json_value(value):
+    # meta values as JSON values, timestamps are written in ISO format
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+    if isinstance(value, numbers.Integral):
+        return int(value)
+    if isinstance(value, numbers.Number):
+        return float(value)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+def snapshot_format(path, format = None):
+    """
+    format of the snapshot at path: format if given, 'hdf5' if path ends with .h5 or .hdf5, otherwise 'npy' (a directory)
+    """
+    if format is None:
+        format = 'hdf5' if path.lower().endswith(HDF5_EXTENSIONS) else 'npy'
+    if format not in ('npy', 'hdf5'):
+        raise Exception('snapshot format %s is not recognized, available options are: "npy" or "hdf5"' % format)
+    return format
+
+def export_pindex(interface, index_name, path, format = None):
+    """
+    Write a self-describing snapshot of the pindex index_name: every table of the mean and variance models (U, V, S, C,
+    M, the coefficient averages and the projected coefficients) and the materialized denoised values are stored as
+    float64 blocks, one column per table column, and the meta table, the index name and the columns of the blocks in a
+    JSON manifest. The snapshot is either a directory with the manifest (snapshot.json) and one .npy file per table, or
+    a single HDF5 file with one dataset per table and the manifest as an attribute. Both are loaded by load_snapshot
+    with the blocks memory mapped.
+    ----------
+    Parameters
+    ----------
+    interface: db_class object
+        object used to communicate with the DB. see ../database/db_class for the abstract class
+
+    index_name: string
+        name of the pindex (with its schema, e.g. 'tspdb.pindex')
+
+    path: string
+        directory (created if needed) or HDF5 file of the snapshot. Called from SQL, it is a path on the database server,
+        and the SQL function is only executable by superusers unless granted (see tspdb--0.0.1.sql)
+
+    format: string optional (default = None) options: {'npy', 'hdf5'}
+        snapshot format, if None 'hdf5' if path ends with .h5 or .hdf5, otherwise 'npy'
+    ----------
+    Returns
+    ----------
+    dict
+        the manifest of the snapshot
+    """
+    format = snapshot_format(path, format)
+    if not index_exists(interface, index_name):
+        raise Exception('pindex %s does not exist' % index_name)
+    meta = dict(zip(META_COLUMNS, query_meta(interface, index_name, META_COLUMNS)))
+    if not meta['no_submodels']:
+        raise Exception('pindex %s has no fitted sub-models to export' % index_name)
+    no_ts = len(meta['indexed_column'].split(','))
+
+    models = [('', int(meta['k']))]
+    if meta['k_var'] and meta['no_submodels_var']:
+        models.append(('variance_', int(meta['k_var'])))
+    blocks, columns = {}, {}
+    for prefix, k in models:
+        for suffix, (table_columns, order) in _model_tables(k).items():
+            if suffix == 'c_view':
+                rows = _coefficient_averages(interface, index_name + '_' + prefix + suffix, table_columns, int(meta['no_submodels' + ('_var' if prefix else '')]))
+            elif suffix == 'c_projected':
+                rows = _projected_coefficients(interface, index_name + ('_variance' if prefix else ''), table_columns, no_ts)
+            else:
+                rows = interface.query_table(index_name + '_' + prefix + suffix, table_columns, 'true order by ' + order)
+            if suffix == 'm':
+                # one block column per value of the array columns
+                scalars = np.array([row[:len(MODEL_COLUMNS)] for row in rows], dtype = float).reshape(-1, len(MODEL_COLUMNS))
+                arrays = [np.array([row[i] for row in rows], dtype = float).reshape(-1, no_ts) for i in range(len(MODEL_COLUMNS), len(table_columns))]
+                block = np.hstack([scalars] + arrays)
+                table_columns = MODEL_COLUMNS + ['%s[%s]' % (name, i) for name in MODEL_ARRAY_COLUMNS for i in range(no_ts)]
+            else:
+                block = np.array(rows, dtype = float).reshape(-1, len(table_columns))
+            blocks[prefix + suffix], columns[prefix + suffix] = block, table_columns
+    if meta['materialized']:
+        rows = interface.query_table(index_name + '_denoised', DENOISED_COLUMNS, 'true order by time_series, tsrow')
+        blocks['denoised'], columns['denoised'] = np.array(rows, dtype = float).reshape(-1, len(DENOISED_COLUMNS)), DENOISED_COLUMNS
+
+    manifest = {'version': SNAPSHOT_VERSION, 'index_name': index_name,
+                'meta': {key: _json_value(value) for key, value in meta.items()},
+                'timestamp_columns': [key for key, value in meta.items() if hasattr(value, 'isoformat')],
+                'tables': {name: {'columns': columns[name], 'shape': list(blocks[name].shape)} for name in blocks}}
+    if format == 'hdf5':
+        from tspdb.src import hdf_util
+        hdf_util.write_datasets(path, blocks, {'manifest': json.dumps(manifest)})
+    else:
+        os.makedirs(path, exist_ok = True)
+        for name, block in blocks.items():
+            np.save(os.path.join(path, name + '.npy'), block)
+        # the manifest is written last, a directory without it is not a complete snapshot
+        with open(os.path.join(path, MANIFEST), 'w') as f:
+            json.dump(manifest, f)
+    return manifest
+
+class PindexSnapshot(object):
+    # index_name:               (str) name of the exported pindex
+    # meta:                     (dict) the meta table of the pindex (see TSPI.write_model)
+    # tables:                   (dict) table name (the suffix of the pindex table, e.g. 'u' or 'variance_s') -> read-only
+    #                               float64 array with one column per table column, ordered as the table's key
+    # columns:                  (dict) table name -> names of the columns of the array. the values of the array columns
+    #                               of the M table are stored as <name>[<index of the indexed column>]
+
+    def __init__(self, manifest, tables):
+        if manifest.get('version') != SNAPSHOT_VERSION:
+            raise Exception('snapshot version %s is not supported, expected %s' % (manifest.get('version'), SNAPSHOT_VERSION))
+        self.index_name = manifest['index_name']
+        self.meta = dict(manifest['meta'])
+        if len(manifest['timestamp_columns']) > 0:
+            import pandas as pd
+            for key in manifest['timestamp_columns']:
+                self.meta[key] = pd.Timestamp(self.meta[key])
+        self.tables = tables
+        self.columns = {name: table['columns'] for name, table in manifest['tables'].items()}
+
+    def column(self, table, column):
+        """
+        the values of column in table: a view of one column of the table's array, or of all its values for an array
+        column of the M table (shape [no_models, no_ts])
+        """
+        columns = self.columns[table]
+        if column in columns:
+            return self.tables[table][:, columns.index(column)]
+        positions = [i for i, name in enumerate(columns) if name.startswith(column + '[')]
+        if len(positions) == 0:
+            raise Exception('table %s of the snapshot has no column %s' % (table, column))
+        return self.tables[table][:, positions[0]:positions[-1] + 1]
+
+    def frame(self, table):
+        """
+        table as a pandas DataFrame with its original columns: integer columns as integers, and the array columns of
+        the M table with one array per row
+        """
+        import pandas as pd
+        data = {}
+        for column in _original_columns(self.columns[table]):
+            values = self.column(table, column)
+            if values.ndim == 2:
+                data[column] = pd.Series(list(np.array(values)), dtype = object)
+            elif column in INTEGER_COLUMNS:
+                data[column] = np.array(values).astype(int)
+            else:
+                data[column] = np.array(values)
+        return pd.DataFrame(data)
+
+def _original_columns(columns):
+    # names of the table columns of the block columns, in order
+    names = []
+    for column in columns:
+        name = column.split('[')[0]
+        if name not in names:
+            names.append(name)
+    return names
+
+def load_snapshot(path, mmap = True, format = None):
+    """
+    Load a snapshot written by export_pindex. The tables are memory mapped (read-only np.memmap), so only the pages of
+    the rows that are used are read from disk, and the snapshot can be shared by threads and processes.
+    ----------
+    Parameters
+    ----------
+    path: string
+        directory or HDF5 file of the snapshot
+
+    mmap: boolean optional (default=true)
+        if false, read the tables into memory
+
+    format: string optional (default = None) options: {'npy', 'hdf5'}
+        snapshot format, see snapshot_format
+    ----------
+    Returns
+    ----------
+    PindexSnapshot
+    """
+    if snapshot_format(path, format) == 'hdf5':
+        from tspdb.src import hdf_util
+        tables, attributes = hdf_util.memmap_datasets(path, mmap)
+        manifest = json.loads(attributes['manifest'])
+    else:
+        if not os.path.exists(os.path.join(path, MANIFEST)):
+            raise Exception('%s is not a pindex snapshot: %s is missing' % (path, MANIFEST))
+        with open(os.path.join(path, MANIFEST)) as f:
+            manifest = json.load(f)
+        tables = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode = 'r' if mmap else None) for name in manifest['tables']}
+    return PindexSnapshot(manifest, tables)
+
+def import_pindex(interface, path, index_name = None, schema = 'tspdb', format = None):
+    """
+    Create a pindex from a snapshot written by export_pindex, e.g. to clone a pindex to another database: the tables
+    are written as TSPI writes them and the pindex is registered in the tspdb catalog tables. The indexed table
+    (time_series_table_name in the snapshot meta) must exist in the target database for the pindex to be queried or
+    updated. No insert trigger is created.
+    ----------
+    Parameters
+    ----------
+    interface: db_class object
+        object used to communicate with the DB. see ../database/db_class for the abstract class
+
+    path: string
+        directory or HDF5 file of the snapshot. Called from SQL, it is a path on the database server, and the SQL
+        function is only executable by superusers unless granted (see tspdb--0.0.1.sql)
+
+    index_name: string optional (default = None)
+        name of the created pindex (without schema), defaults to the name of the exported pindex
+
+    schema: string optional (default = 'tspdb')
+        name of the tspdb schema
+
+    format: string optional (default = None) options: {'npy', 'hdf5'}
+        snapshot format, see snapshot_format
+    ----------
+    Returns
+    ----------
+    string
+        name of the created pindex, with its schema
+    """
+    import pandas as pd
+    snapshot = load_snapshot(path, format = format)
+    name = (index_name or snapshot.index_name).split('.')[-1]
+    full_name = schema + '.' + name
+    if index_exists(interface, full_name):
+        raise Exception('pindex %s already exists, delete it before importing the snapshot' % name)
+    meta = snapshot.meta
+    value_columns = meta['indexed_column'].split(',')
+    no_ts = len(value_columns)
+
+    for table in snapshot.tables:
+        df = snapshot.frame(table)
+        table_name = full_name + '_' + table
+        suffix = table.replace('variance_', '')
+        if suffix in ('u', 'v', 'c'):
+            interface.create_table(table_name, df.set_index('row_id'), 'row_id', index_label = 'row_id')
+        elif suffix == 'm':
+            from sqlalchemy.types import Integer, Float, ARRAY
+            type_dict = {column: Integer() for column in MODEL_COLUMNS}
+            for column in MODEL_ARRAY_COLUMNS:
+                df[column] = ['{' + str(values.tolist())[1:-1] + '}' for values in df[column]]
+                type_dict[column] = ARRAY(Float)
+            interface.create_table(table_name, df, 'modelno', include_index = False, index_label = 'modelno', type_dict = type_dict)
+        elif suffix == 'denoised':
+            interface.create_table(table_name, df, 'time_series, tsrow', include_index = False)
+        else:
+            interface.create_table(table_name, df, 'coeffpos' if suffix.startswith('c_') else 'modelno', include_index = False)
+        if suffix in ('u', 'v', 's', 'c'):
+            for column in {'u': ['tsrow, modelno', 'modelno'], 'v': ['tscolumn, modelno', 'modelno'], 's': ['modelno'], 'c': ['modelno', 'coeffpos']}[suffix]:
+                interface.create_index(table_name, column)
+
+    metadf = pd.DataFrame(data = {key: [value] for key, value in meta.items()})
+    if not isinstance(meta['start_time'], (int, np.integer)):
+        metadf['start_time'] = metadf['start_time'].astype('datetime64[ns]')
+    interface.create_table(full_name + '_meta', metadf, include_index = False)
+
+    # register the pindex as TSPI.write_model does
+    scores = {column: snapshot.column('m', column) for column in MODEL_ARRAY_COLUMNS}
+    for i, value_column in enumerate(value_columns):
+        interface.insert(schema + '.pindices_columns', [name, value_column], columns = ['index_name', 'value_column'])
+        interface.insert(schema + '.pindices_stats', [name, value_column, meta['last_TS_seen']//no_ts, meta['no_submodels'], np.mean(scores['imputation_acc'][:, i]),
+                                                     np.mean(scores['forecasting_acc'][:, i]), np.nanmean(scores['forecasting_test_acc'][:, i])],
+                         columns = ['index_name', 'column_name', 'number_of_observations', 'number_of_trained_models', 'imputation_score', 'forecast_score', 'test_forecast_score'])
+    start_time, agg_interval = meta['start_time'], float(meta['agg_interval'])
+    last_index = index_ts_inv_mapper(start_time, agg_interval, meta['last_TS_seen']//no_ts - 1)
+    bounds = ['initial_index', 'last_index'] if isinstance(start_time, (int, np.integer)) else ['initial_timestamp', 'last_timestamp']
+    interface.insert(schema + '.pindices', [name, meta['time_series_table_name'], meta['time_column'], bool(meta['k_var']), agg_interval, start_time, last_index],
+                     columns = ['index_name', 'relation', 'time_column', 'uq', 'agg_interval'] + bounds)
+    interface.execute_query("insert into %s.pindices_versions values ('%s', 1) on conflict (index_name) do update set version = %s.pindices_versions.version + 1" % (schema, name, schema))
+    return full_name
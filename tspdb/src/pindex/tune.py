@@ -0,0 +1,250 @@
+import os
+import time
+import itertools
+import numpy as np
+from tspdb.src.prediction_models.ts_meta_model import TSMM
+from tspdb.src.pindex.backtest import forecast_windows, fill_observations
+
+# series tuned by the worker processes, set once per process by _set_series (inherited through fork)
+_series = None
+
+def _set_series(data):
+    global _series
+    _series = data
+
+def candidate_grid(T = [int(1e5)], L = [None], k = [None], col_to_row_ratio = [10]):
+    """
+    all combinations of the given values of T, L, k and col_to_row_ratio, as a list of dictionaries. col_to_row_ratio is
+    not used by TSMM if L is given, thus candidates with L are not repeated for every col_to_row_ratio
+    """
+    candidates = []
+    for T_, L_, k_, ratio in itertools.product(T, L, k, col_to_row_ratio):
+        candidate = {'T': int(T_), 'L': None if L_ is None else int(L_), 'k': None if k_ is None else int(k_), 'col_to_row_ratio': ratio}
+        if L_ is not None:
+            candidate['col_to_row_ratio'] = None
+        if candidate not in candidates:
+            candidates.append(candidate)
+    return candidates
+
+def model_coefficients(tsmm):
+    """
+    average forecasting coefficients (oldest lag first) and intercepts of the sub-models of tsmm, as stored in the
+    'average' column of the pindex coefficient view (see build_model_tables)
+    """
+    models = [tsmm.models[i] for i in sorted(tsmm.models)]
+    w_f = max(len(m.weights) for m in models)
+    # reversed weights (most recent lag first), zero padded for sub-models with fewer rows
+    weights = np.zeros([len(models), w_f])
+    for j, m in enumerate(models):
+        weights[j, :len(m.weights)] = m.weights[::-1]
+    intercepts = (1 - weights.sum(1))[:, None] * np.array([m.norm_mean[:tsmm.no_ts] for m in models], dtype = float)
+    return weights.mean(0)[::-1], intercepts.mean(0)
+
+def model_size(tsmm):
+    """
+    number of values stored by the pindex tables of tsmm: U, V, S (with their forecasting counterparts) and coefficients
+    """
+    k = tsmm.kSingularValuesToKeep or 0
+    return int(sum(2*k*(m.N + m.M + 1) + m.N - 1 + tsmm.no_ts for m in tsmm.models.values()))
+
+def _evaluate(args):
+    """
+    fit the candidate on the budget observations preceding the holdout and score its one-step forecasts on the
+    holdout, run in a worker process on the series set by _set_series
+    """
+    candidate, budget, no_train, T0 = args
+    # TSMM shifts its observation buffer in place, it must not be a view of the shared series
+    train = _series[no_train - budget:no_train].copy()
+    result = dict(candidate, budget = budget, score = np.nan, imputation_score = np.nan, fit_seconds = np.nan, no_parameters = 0)
+    t = time.time()
+    try:
+        tsmm = TSMM(candidate['k'], candidate['T'], 0.5, T0, col_to_row_ratio = candidate['col_to_row_ratio'] or 1, L = candidate['L'],
+                    persist_L = candidate['L'] is not None, no_ts = _series.shape[1])
+        tsmm.update_model(train)
+    except Exception:
+        # configurations that cannot be fitted on the budget (e.g. fewer columns than time series) are discarded
+        return result
+    result['fit_seconds'] = time.time() - t
+    if len(tsmm.models) == 0:
+        return result
+    result['no_parameters'] = model_size(tsmm)
+    result['imputation_score'] = float(np.mean([m.imputation_model_score for m in tsmm.models.values()]))
+
+    from sklearn.metrics import r2_score
+    coeffs, intercepts = model_coefficients(tsmm)
+    no_coeff = len(coeffs)
+    if no_coeff > no_train:
+        return result
+    filled = fill_observations(_series[no_train - no_coeff:-1], tsmm.p)
+    holdout = _series[no_train:]
+    scores = []
+    for ts in range(_series.shape[1]):
+        windows = np.lib.stride_tricks.sliding_window_view(filled[:, ts], no_coeff)
+        forecast = forecast_windows(windows, coeffs, coeffs, np.full(len(windows), intercepts[ts]), 1)[:, 0]
+        observed = ~np.isnan(holdout[:, ts])
+        scores.append(r2_score(holdout[observed, ts], forecast[observed]))
+    result['score'] = float(np.mean(scores))
+    return result
+
+def pareto_frontier(trials):
+    """
+    trials (a DataFrame with columns fit_seconds and score) that are not dominated by a cheaper and more accurate
+    trial, ordered by fit_seconds
+    """
+    trials = trials[~trials['score'].isna()].sort_values(['fit_seconds', 'score'], ascending = [True, False], kind = 'stable')
+    best = -np.inf
+    keep = []
+    for score in trials['score']:
+        keep.append(score > best)
+        best = max(best, score)
+    return trials[keep].reset_index(drop = True)
+
+def tune_models(data, candidates, holdout = 0.2, eta = 3, min_budget = None, T0 = 1000, workers = None):
+    """
+    Select the TSMM parameters for a series by successive halving: all candidates are fitted on the most recent
+    min_budget observations of the training prefix and scored on the holdout, the best 1/eta are kept and fitted on eta
+    times more observations, until one candidate is left or the whole training prefix is used. The candidates of each
+    round are fitted in parallel worker processes, which share the series through fork.
+    ----------
+    Parameters
+    ----------
+    data: array, shape [no_observations, no_ts]
+        observations of the time series, may contain NaNs
+
+    candidates: list of dict
+        candidate parameters with keys T, L, k and col_to_row_ratio (see candidate_grid)
+
+    holdout: float or int optional (default=0.2)
+        the last observations used to score the candidates, as a fraction of the series if < 1
+
+    eta: int optional (default=3)
+        the fraction (1/eta) of candidates kept, and the growth of the training size, at each round
+
+    min_budget: int optional (default=None)
+        number of observations the candidates are fitted on in the first round, defaults to the training prefix
+        divided by eta once per round, and at least T0
+
+    T0: int optional (default=1000)
+        the number of observations below which TSMM does not fit a model
+
+    workers: int optional (default=None)
+        number of worker processes, defaults to the number of cores. if 1, the candidates are fitted sequentially
+    ----------
+    Returns
+    ----------
+    best: dict
+        parameters (T, L, k, col_to_row_ratio) of the candidate with the best holdout score in the last round
+
+    trials: pd.DataFrame
+        one row per fitted (candidate, round), with the parameters, the round, the budget (no. training observations),
+        the holdout forecast r2 score, the mean imputation r2 score, the fit time and the number of stored values
+    """
+    import pandas as pd
+    data = np.array(data, dtype = float)
+    if data.ndim == 1:
+        data = data[:, None]
+    if len(candidates) == 0:
+        raise Exception('at least one candidate is required')
+    if eta < 2:
+        raise Exception('eta must be an integer larger than 1')
+    no_holdout = int(holdout * len(data)) if holdout < 1 else int(holdout)
+    no_train = len(data) - no_holdout
+    if no_holdout < 1 or no_train < 1:
+        raise Exception('holdout must leave at least one observation for training and one for scoring')
+
+    rounds = int(np.ceil(np.log(len(candidates)) / np.log(eta) - 1e-9)) + 1
+    if min_budget is None:
+        min_budget = max(no_train // eta**(rounds - 1), min(T0, no_train))
+    if workers is None:
+        workers = os.cpu_count() or 1
+    pool = None
+    if workers > 1:
+        import multiprocessing
+        pool = multiprocessing.get_context('fork').Pool(workers, initializer = _set_series, initargs = (data,))
+    else:
+        _set_series(data)
+
+    trials = []
+    alive = list(candidates)
+    budget = min(int(min_budget), no_train)
+    try:
+        for r in range(rounds):
+            jobs = [(candidate, budget, no_train, T0) for candidate in alive]
+            results = pool.map(_evaluate, jobs) if pool is not None else [_evaluate(job) for job in jobs]
+            for result in results:
+                result['round'] = r
+            trials += results
+            if len(alive) == 1 or budget == no_train:
+                break
+            # failed fits score -inf, the order of the candidates breaks ties
+            scores = np.array([result['score'] for result in results])
+            order = np.argsort(-np.nan_to_num(scores, nan = -np.inf), kind = 'stable')
+            alive = [alive[i] for i in order[:int(np.ceil(len(alive) / eta))]]
+            budget = min(budget * eta, no_train)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    columns = ['T', 'L', 'k', 'col_to_row_ratio', 'round', 'budget', 'score', 'imputation_score', 'fit_seconds', 'no_parameters']
+    trials = pd.DataFrame(trials)[columns]
+    # keep None (estimated from the data) in the parameter columns
+    for column in ['L', 'k', 'col_to_row_ratio']:
+        trials[column] = pd.Series([result[column] for result in trials.to_dict('records')], dtype = object)
+    last = trials[trials['round'] == trials['round'].max()]
+    if last['score'].isna().all():
+        raise Exception('none of the candidates could be fitted, try smaller T or T0')
+    best = last.loc[last['score'].idxmax(), ['T', 'L', 'k', 'col_to_row_ratio']].to_dict()
+    return {key: None if pd.isna(value) else value for key, value in best.items()}, trials
+
+def tune_pindex(interface, table_name, time_column, value_columns, T = [int(1e5)], L = [None], k = [None], col_to_row_ratio = [10],
+                holdout = 0.2, eta = 3, min_budget = None, T0 = 1000, workers = None, agg_interval = None, aggregation_method = 'average'):
+    """
+    Choose the parameters of create_pindex for the columns value_columns of table_name: the series is queried once and
+    the candidate grid (every combination of T, L, k and col_to_row_ratio) is searched with tune_models.
+    ----------
+    Parameters
+    ----------
+    interface: db_class object
+        object used to communicate with the DB. see ../database/db_class for the abstract class
+
+    table_name: string
+        name of the time series table in the database
+
+    time_column: string
+        name of column that contains time series index/timestamp
+
+    value_columns: list of strings
+        names of the columns to be indexed
+
+    T, L, k, col_to_row_ratio: lists
+        candidate values of the pindex parameters (see TSPI), None in L or k means estimated from the data
+
+    holdout, eta, min_budget, T0, workers:
+        see tune_models
+
+    agg_interval: float optional (default=None)
+        aggregation interval of the series, estimated from the table if None
+    ----------
+    Returns
+    ----------
+    best: dict
+        parameters (T, L, k, col_to_row_ratio) of the best candidate
+
+    frontier: pd.DataFrame
+        the last trial of each candidate that is not dominated by a faster and more accurate trial (see tune_models for
+        the columns), ordered by fit time
+    """
+    from tspdb.src.pindex.pindex_managment import TSPI
+    from tspdb.src.pindex.pindex_utils import index_ts_inv_mapper, get_bound_time
+    value_columns = list(value_columns)
+    # query all columns once, the candidates are fitted from this data
+    TSPD = TSPI(interface = interface, time_series_table_name = table_name, time_column = time_column, value_column = value_columns,
+                agg_interval = agg_interval, aggregation_method = aggregation_method)
+    end_point = get_bound_time(interface, table_name, time_column, 'max')
+    start_point = index_ts_inv_mapper(TSPD.start_time, TSPD.agg_interval, 0)
+    data = np.array(TSPD._get_range(start_point, end_point), dtype = float)
+    best, trials = tune_models(data, candidate_grid(T, L, k, col_to_row_ratio), holdout = holdout, eta = eta, min_budget = min_budget, T0 = T0, workers = workers)
+    # compare each candidate at the largest training size it reached
+    last = trials.sort_values('round', kind = 'stable').groupby(['T', 'L', 'k', 'col_to_row_ratio'], dropna = False).tail(1)
+    return best, pareto_frontier(last)
@@ -4,99 +4,102 @@
 #
 ######################################################
 import numpy as np
-from tslib.src.algorithms.alsWrapper import ALSWrapper as ALS
-from tslib.src.algorithms.svdWrapper import SVDWrapper as SVD
-from tslib.src.models.tsSVDModel import SVDModel
+from tspdb.src.algorithms.alsWrapper import ALSWrapper as ALS
+from tspdb.src.algorithms.svdWrapper import SVDWrapper as SVD
+from tspdb.src.prediction_models.ts_svd_model import SVDModel
+from tspdb.src import tsUtils
 
 class ALSModel(SVDModel):
 
+    # A sub-model fitted with a masked low-rank solver (ALS) instead of the SVD of the filled-in matrix: missing
+    # entries are neither filled in nor zeroed, the factorization is fitted on the observed entries only. Hence the
+    # estimate needs no 1/p rescaling and the model always has p = 1.
+    # The factors are stored as their SVD (Uk, sk, Vk), the same layout as SVDModel, so predictions are unchanged.
+    #
     # seriesToPredictKey:       (string) the time series of interest (key)
-    # kFactors:    				(int) number of factors (similar to the kSingularValues of the parent class)
+    # kSingularValuesToKeep:    (int) number of factors (similar to the kSingularValues of the parent class)
     # N:                        (int) the number of rows of the matrix for each series
     # M:                        (int) the number of columns for the matrix for each series
-    # probObservation:          (float) the independent probability of observation of each entry in the matrix
-    # otherSeriesKeysArray:     (array) an array of keys for other series which will be used to predict 
-    # includePastDataOnly:      (Boolean) defaults to True. If this is set to False, 
-    #                               the time series in 'otherSeriesKeysArray' will include the latest data point.
-    #                               Note: the time series of interest (seriesToPredictKey) will never include 
-    #                               the latest data-points for prediction
-    def __init__(self, seriesToPredictKey, kFactors, N, M, probObservation=1.0, otherSeriesKeysArray=[], includePastDataOnly=True):
-
-        super(ALSModel, self).__init__(seriesToPredictKey, kFactors, N, M, probObservation=probObservation, svdMethod='numpy', otherSeriesKeysArray=otherSeriesKeysArray, includePastDataOnly=includePastDataOnly)
-
-    # run a least-squares regression of the last row of self.matrix and all other rows of self.matrix
-    # sets and returns the weights
-    # DO NOT call directly
-    def _computeWeights(self):
-        
-        if (self.lastRowObservations is None):
-            raise Exception('Do not call _computeWeights() directly. It should only be accessed via class methods.')
-
-        # need to decide how to produce weights based on whether the N'th data points are to be included for the other time series or not
-        # for the seriesToPredictKey we only look at the past. For others, we could be looking at the current data point in time as well.
-        
-        matrixDim1 = (self.N * len(self.otherSeriesKeysArray)) + self.N-1
-        matrixDim2 = np.shape(self.matrix)[1]
-        eachTSRows = self.N
-
-        if (self.includePastDataOnly == False):
-        	newMatrix = self.matrix[0:matrixDim1, :]
-
-        else:
-            matrixDim1 = ((self.N - 1) * len(self.otherSeriesKeysArray)) + self.N-1
-            eachTSRows = self.N - 1
-
-            newMatrix = np.zeros([matrixDim1, matrixDim2])
-
-            rowIndex = 0
-            matrixInd = 0
-            print(eachTSRows)
-            while (rowIndex < matrixDim1):
-            	newMatrix[rowIndex: rowIndex + eachTSRows] = self.matrix[matrixInd: matrixInd +eachTSRows]
-
-            	rowIndex += eachTSRows
-            	matrixInd += self.N
-
-        self.weights = np.dot(np.linalg.pinv(newMatrix).T, self.lastRowObservations.T)
-
-
-	# keyToSeriesDictionary: (Pandas dataframe) a key-value Series (time series)
-    # Same as the parent class (SVDModel)
+    # lambda_:                  (float) the regularization of the factors. The default keeps the columns with few observations
+    #                               well-posed (the sub-models are fitted on normalized observations)
+    # iterations:               (int) the maximum number of ALS iterations
+    # tol:                      (float) ALS stops when the change in the error is less than tol
+    # initialFactors:           (array) (optional) N x k row factors used as a warm start, e.g. Uk * sk of the previous sub-model
+    # other arguments are the same as SVDModel
+    def __init__(self, seriesToPredictKey, kSingularValuesToKeep, N, M, lambda_=0.1, iterations=100, tol=1e-9, initialFactors=None, **kwargs):
+
+        super(ALSModel, self).__init__(seriesToPredictKey, kSingularValuesToKeep, N, M, **kwargs)
+        self.p = 1.0
+        self.lambda_ = lambda_
+        self.iterations = iterations
+        self.tol = tol
+        self.initialFactors = initialFactors
+
+    # set Uk, sk, Vk from the factors U (N x k) and V (k x M) of the low rank matrix U V
+    def _setFactors(self, U, V):
+        (Qu, Ru) = np.linalg.qr(U)
+        (Qv, Rv) = np.linalg.qr(V.T)
+        (u, s, vt) = np.linalg.svd(np.dot(Ru, Rv.T))
+        self.sk = s
+        self.Uk = np.dot(Qu, u)
+        self.Vk = np.dot(Qv, vt.T)
+        self.matrix = tsUtils.matrixFromSVD(self.sk, self.Uk, self.Vk, probability=self.p)
+
+    # the rank used if kSingularValuesToKeep is None: the SVDWrapper threshold on the zero-filled matrix
+    def _estimateRank(self, matrix):
+        filled = np.nan_to_num(matrix)
+        return SVD(filled, method='numpy').decompose()
+
+    # keyToSeriesDictionary: (Pandas dataframe) a key-value Series (time series)
+    # Same as the parent class (SVDModel), missing values are kept in the matrix
     def fit(self, keyToSeriesDF):
 
         # assign data to class variables
-        super(ALSModel, self)._assignData(keyToSeriesDF, missingValueFill=False)
+        self._assignData(keyToSeriesDF, missingValueFill=False)
+        obs_matrix = self.matrix.copy()
+        observed = ~np.isnan(obs_matrix)
 
-        self.max = np.nanmax(self.matrix)
-        self.min = np.nanmin(self.matrix)
+        if self.kSingularValues is None:
+            self.kSingularValues = min(self._estimateRank(obs_matrix), self.M, self.N - 1)
 
-        # now use ALS to produce an estimated matrix
-        alsMod = ALS(self.matrix, method='als')
-        (U, V) = alsMod.reconstructMatrix(self.kSingularValues, 0.0, returnMatrix=False, tol=1e-9)
+        # warm start from the factors of the previous sub-model, if they are compatible
+        U0 = self.initialFactors
+        if U0 is not None and np.shape(U0) != (self.N, self.kSingularValues):
+            U0 = None
+        self.initialFactors = None
 
-        self.matrix = np.dot(U, V)
+        # now use ALS to produce an estimated matrix
+        alsMod = ALS(obs_matrix.copy(), method='als')
+        (U, V) = alsMod.decompose(self.kSingularValues, self.lambda_, self.iterations, self.tol, U=U0, verbose=False)
+        self._setFactors(U, V)
 
-        self.matrix[self.matrix > self.max] = self.max
-        self.matrix[self.matrix < self.min] = self.min
+        from sklearn.metrics import r2_score
+        for i in range(self.no_ts):
+            obs = obs_matrix[:, i::self.no_ts].flatten('F')
+            mask = observed[:, i::self.no_ts].flatten('F')
+            if mask.sum() > 1:
+                self.imputation_model_score[i] = r2_score(obs[mask], self.denoisedTS(ts = i)[mask])
 
         # we need to assign some values to the lastRowObservations where there are still NaNs
-        # impute those with the ALS-estimated/iputed values
-        for i in range(0, len(self.lastRowObservations)):
-        	if (np.isnan(self.lastRowObservations[i])):
-        		self.lastRowObservations[i] = self.matrix[-1, i]
+        # impute those with the ALS-estimated/imputed values
+        missing = np.isnan(self.lastRowObservations)
+        self.lastRowObservations[missing] = self.matrix[-1, missing]
 
         # set weights (same as the parent class now that we have the SVD of the ALS-estimated matrix)
         self._computeWeights()
-	
-	# return the imputed matrix, same as the parent class (SVDModel)
-    def denoisedDF(self):
 
-    	return super(ALSModel, self).denoisedDF()
+    # add the new columns in D (flattened, may contain NaNs): their factors are solved with the row factors fixed
+    # (folding-in), then the SVD of the factors and the weights are recomputed
+    def updateSVD(self, D, method = 'UP'):
+        assert (len(D) % self.N == 0)
+        D = np.array(D, dtype=float).reshape([self.N, int(len(D)/self.N)], order = 'F')
+        assert D.shape[1] <= D.shape[0]
 
-	# same params as the predict() method of the parent class (SVDModel)       
-    def predict(self, otherKeysToSeriesDFNew, predictKeyToSeriesDFNew, bypassChecks=False):
+        U = self.Uk * self.sk
+        Vnew = ALS(D, method='als').foldIn(U, self.lambda_)
+        self._setFactors(U, np.concatenate([self.Vk.T, Vnew], 1))
+        self.M = self.Vk.shape[0]
 
-    	return super(ALSModel, self).predict(otherKeysToSeriesDFNew, predictKeyToSeriesDFNew, bypassChecks)
-
-    def updateSVD(self, D):
-        return super(ALSModel, self).updateSVD(self, D)
\ No newline at end of file
+        self.lastRowObservations = self.matrix[-1,:]
+        self.TimesUpdated +=1
+        self._computeWeights()
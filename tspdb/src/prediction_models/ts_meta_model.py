@@ -1,8 +1,38 @@
 import numpy as np
 import pandas as pd
 from  tspdb.src.prediction_models.ts_svd_model import SVDModel
+from  tspdb.src.prediction_models.ts_als_model import ALSModel
+from tspdb.src.tsUtils import RunningMoments
 from math import ceil
-from sklearn.preprocessing import StandardScaler
+
+def page_dimensions(T, L, col_to_row_ratio, no_ts, persist_L = False):
+    """
+    the number of entries T and rows L of the sub-models page matrices, and their col_to_row_ratio, as set by TSMM for
+    the requested T, L (None to derive it from col_to_row_ratio) and no_ts. The number of columns has to be even and
+    divisible by no_ts, the last returned value is true if T and col_to_row_ratio were changed for it
+    """
+    if L is None:
+        L = int(np.sqrt(T / col_to_row_ratio))
+        M = int(L * col_to_row_ratio)
+        T = int(L * M)
+
+    else:
+        M = int(T/L)
+        T = int(L*M)
+        col_to_row_ratio = M/L
+
+    adjusted = M % (2*no_ts) != 0
+    if adjusted:
+        M = M + (2*no_ts -M %(2*no_ts))
+        # subtract a small amount to avoid issues with machine precision
+        col_to_row_ratio = M/L -1e-14
+
+        if not persist_L:
+            T = int(M*M/col_to_row_ratio)
+            L = int(np.sqrt(T / col_to_row_ratio))
+        else:
+            T = L*M
+    return T, L, col_to_row_ratio, adjusted
 
 class TSMM(object):
     # kSingularValuesToKeep:    (int) the number of singular values to retain
@@ -10,8 +40,17 @@ class TSMM(object):
     # T:                        (int) Number of entries in each submodel
     # gamma:                    (float) (0,1) fraction of T after which the model is updated
     # col_to_row_ratio:         (int) the ration of no. columns to the number of rows in each sub-model
+    # model_type:               (str) 'svd' (default) or 'als': the factorization used to fit the sub-models
+    # svd_method:               (str) 'numpy' (default) or 'gram': the SVD used by 'svd' sub-models (see SVDWrapper)
 
-    def __init__(self, kSingularValuesToKeep=None, T=int(1e5), gamma=0.2, T0=1000, col_to_row_ratio=1, SSVT=False, p=None, L=None, model_table_name='', persist_L = False, no_ts = 1, normalize = True, fill_in_missing = True):
+    model_classes = {'svd': SVDModel, 'als': ALSModel}
+
+    def __init__(self, kSingularValuesToKeep=None, T=int(1e5), gamma=0.2, T0=1000, col_to_row_ratio=1, SSVT=False, p=None, L=None, model_table_name='', persist_L = False, no_ts = 1, normalize = True, fill_in_missing = True, model_type = 'svd', svd_method = 'numpy'):
+        if model_type not in self.model_classes:
+            raise Exception('model_type must be one of %s, got %s' % (list(self.model_classes), model_type))
+        self.model_type = model_type
+        self.model_class = self.model_classes[model_type]
+        self.svd_method = svd_method
         self.kSingularValuesToKeep = kSingularValuesToKeep
         
         self.no_ts = no_ts
@@ -20,37 +59,22 @@ class TSMM(object):
         # if self.col_to_row_ratio % (self.no_ts*2) != 0:
         #     self.col_to_row_ratio = self.col_to_row_ratio + (2*self.no_ts-self.col_to_row_ratio %(2*self.no_ts))
         # print(self.col_to_row_ratio)
-        if L is None:
-            self.L = int(np.sqrt(T / self.col_to_row_ratio))
-            M = int(self.L * self.col_to_row_ratio)
-            self.T = int(self.L * M)
-
-        else:
-            self.L = L
-            M = int(T/L)
-            self.T = int(self.L*M)
-            self.col_to_row_ratio = M/L
-        
-        if M % (2*self.no_ts) != 0:
-            M = M + (2*self.no_ts -M %(2*self.no_ts))
-            # self.col_to_row_ratio = self.get_dimensions(M)
-            # if not persist_L: self.L = self.T//M 
-            # subtract a small amount to avoid issues with machine precision
-            self.col_to_row_ratio = M/self.L -1e-14
-            
-            if not persist_L:
-                self.T = int(M*M/self.col_to_row_ratio)
-                self.L = int(np.sqrt(self.T / self.col_to_row_ratio))
-            else:
-                self.T = self.L*M
+        self.T, self.L, self.col_to_row_ratio, adjusted = page_dimensions(T, L, self.col_to_row_ratio, self.no_ts, persist_L)
+        if adjusted:
             print ('Number of columns has to be even and divisible by the number of time series, thus T is changed into %s, and col_to_row_ratio to %s'%(self.T, self.col_to_row_ratio))
   
         self.normalize = normalize
         self.persist_L = persist_L
         self.gamma = gamma
         self.models = {}
+        # weights of the sub-models last used for a forecast and their average, see _average_weights
+        self._weights_cache = None
         self.T0 = T0
         self.TimeSeries = None
+        # per column moments of TimeSeries, maintained by updateTS and used to normalize the sub-models (see _window_moments)
+        self.moments = None
+        self._moments_buffer = None
+        self._moments_removed = 0
         self.TimeSeriesIndex = 0
         self.ReconIndex = 0
         self.MUpdateIndex = 0
@@ -97,7 +121,8 @@ class TSMM(object):
         # if the number of models is zero, get the estimate of p
         if len(self.models) == 0 and self.p == None:
             self.p = 1.0 - np.sum(np.isnan(NewEntries))/NewEntries.size
-            if self.fill_in_missing: self.p = 1.0
+            # ALS sub-models are fitted on the observed entries only and need no 1/p rescaling
+            if self.fill_in_missing or self.model_type == 'als': self.p = 1.0
         current_no_models = len(self.models)
         updated_no_models = self.get_model_index(self.TimeSeriesIndex + N) + 1
 
@@ -162,20 +187,57 @@ class TSMM(object):
 
         if self.TimeSeriesIndex == N or self.TimeSeries is None:
             self.TimeSeries = NewEntries
+            self.moments = RunningMoments.from_array(NewEntries)
+            self._moments_removed = 0
 
         elif self.TimeSeries.size < self.T:
+            moments = self._buffer_moments()
             TSarray = np.zeros([len(self.TimeSeries) + N//self.no_ts, self.no_ts])
             TSarray[:len(self.TimeSeries),:] = self.TimeSeries
             TSarray[len(self.TimeSeries):,:] = NewEntries
             self.TimeSeries = TSarray
+            moments.add(RunningMoments.from_array(NewEntries))
 
         else:
+            moments = self._buffer_moments()
+            moments.remove(RunningMoments.from_array(self.TimeSeries[:num_new_rows,:]))
+            self._moments_removed += min(num_new_rows, len(self.TimeSeries))
             self.TimeSeries[:num_ts_obs-num_new_rows,:] = self.TimeSeries[-num_ts_obs + num_new_rows:,:]
             self.TimeSeries[-num_new_rows:,:] = NewEntries
+            moments.add(RunningMoments.from_array(NewEntries))
 
         if self.TimeSeries.shape[0] > num_ts_obs:
-
+            self.moments.remove(RunningMoments.from_array(self.TimeSeries[:-num_ts_obs,:]))
+            self._moments_removed += len(self.TimeSeries) - num_ts_obs
             self.TimeSeries = self.TimeSeries[-num_ts_obs:,:]
+        self._moments_buffer = self.TimeSeries
+
+    def _buffer_moments(self):
+        """
+        moments of TimeSeries, recomputed if TimeSeries was set outside updateTS, and once as many rows as the buffer
+        holds were removed from the running moments, to bound the rounding errors of the removals
+        """
+        if self.moments is None or self._moments_buffer is not self.TimeSeries or self._moments_removed >= len(self.TimeSeries):
+            self.moments = RunningMoments.from_array(self.TimeSeries)
+            self._moments_buffer = self.TimeSeries
+            self._moments_removed = 0
+        return self.moments
+
+    def _window_moments(self, start, end):
+        """
+        moments of the rows start to end (excluded) of TimeSeries, from the running moments of TimeSeries minus the rows
+        outside the window, or directly from the window if it is the smaller part of the buffer
+        """
+        rows = len(self.TimeSeries)
+        start, end = max(start, 0), min(end, rows)
+        if rows - (end - start) > end - start:
+            return RunningMoments.from_array(self.TimeSeries[start:end,:])
+        moments = self._buffer_moments().copy()
+        if start > 0:
+            moments.remove(RunningMoments.from_array(self.TimeSeries[:start,:]))
+        if end < rows:
+            moments.remove(RunningMoments.from_array(self.TimeSeries[end:,:]))
+        return moments
 
     def fitModels(self):
             
@@ -198,15 +260,18 @@ class TSMM(object):
         # Build a new model
         if ModelIndex not in self.models:
             # start with the last T/2 entries from previous model
-            initEntries = self.TimeSeries[int(int(self.T / 2) - self.TimeSeriesIndex % (self.T / 2))//self.no_ts:,:]
+            first_row = int(int(self.T / 2) - self.TimeSeriesIndex % (self.T / 2))//self.no_ts
+            initEntries = self.TimeSeries[first_row:,:]
             start = self.TimeSeriesIndex - self.TimeSeriesIndex % int(self.T / 2) - int(self.T / 2)
             # if ModelIndex != 0: assert len(initEntries) == self.T / 2
             rect = 1
             if lenEntriesSinceCons == self.T // 2:
                 initEntries = self.TimeSeries[:,:]
+                first_row = 0
                 start = max(self.TimeSeriesIndex - self.T, 0)
             if ModelIndex == 0:
                 initEntries = self.TimeSeries[:,:]
+                first_row = 0
                 start = 0
 
             if self.persist_L: N = self.L
@@ -224,15 +289,15 @@ class TSMM(object):
             inc_obs = initEntries[:M_ts*N,:]
             
             if self.normalize:
-                scaler = StandardScaler()
-                inc_obs = scaler.fit_transform(inc_obs)
-                norm_means = scaler.mean_
-                norm_std = scaler.scale_
+                moments = self._window_moments(first_row, first_row + len(inc_obs))
+                norm_means = moments.mean
+                norm_std = moments.std()
+                inc_obs = (inc_obs - norm_means) / norm_std
             else:
                 norm_means = np.zeros(self.no_ts)
                 norm_std = np.ones(self.no_ts)
 
-            self.models[ModelIndex] = SVDModel('t1', self.kSingularValuesToKeep, N, M, start=int(start), SSVT=self.SSVT,
+            self.models[ModelIndex] = self._new_model(ModelIndex, N, M, start=int(start), SSVT=self.SSVT,
                                                probObservation=self.p, no_ts = self.no_ts, norm_mean = norm_means, norm_std = norm_std, fill_in_missing = self.fill_in_missing)
             flattened_obs = inc_obs.reshape([N,M], order = 'F')
             flattened_obs = flattened_obs[:,np.arange(M_ts*self.no_ts).reshape([self.no_ts,M_ts]).flatten('F')]
@@ -260,10 +325,11 @@ class TSMM(object):
             TSeries = self.TimeSeries[-TSlength//self.no_ts:,:]
             TSeries = TSeries[:(N * M)//self.no_ts,:]
             if self.normalize:
-                scaler = StandardScaler()
-                TSeries = scaler.fit_transform(TSeries)
-                norm_means = scaler.mean_
-                norm_std = scaler.scale_
+                first_row = len(self.TimeSeries[:-TSlength//self.no_ts,:])
+                moments = self._window_moments(first_row, first_row + len(TSeries))
+                norm_means = moments.mean
+                norm_std = moments.std()
+                TSeries = (TSeries - norm_means) / norm_std
             else:
                 norm_means = np.zeros(self.no_ts)
                 norm_std = np.ones(self.no_ts)
@@ -271,7 +337,7 @@ class TSMM(object):
             flattened_obs = TSeries.reshape([N,M], order = 'F')
             flattened_obs = flattened_obs[:,np.arange(M).reshape([self.no_ts,M_ts]).flatten('F')]
             
-            self.models[ModelIndex] = SVDModel('t1', self.kSingularValuesToKeep, N, M, start= int(Model.start),
+            self.models[ModelIndex] = self._new_model(ModelIndex, N, M, start= int(Model.start),
                                                TimesReconstructed=Model.TimesReconstructed + 1,
                                                TimesUpdated=Model.TimesUpdated, SSVT=self.SSVT, probObservation=self.p, 
                                                no_ts = self.no_ts, norm_mean = norm_means, norm_std = norm_std, fill_in_missing = self.fill_in_missing)
@@ -303,6 +369,20 @@ class TSMM(object):
                 Model.updated = True
                 
 
+    def _new_model(self, ModelIndex, N, M, **kwargs):
+        """
+        create sub-model ModelIndex of the class given by model_type. ALS sub-models are warm started from the row
+        factors of the model they replace, or of the previous sub-model
+        """
+        if self.model_type != 'als':
+            return self.model_class('t1', self.kSingularValuesToKeep, N, M, svdMethod = self.svd_method, **kwargs)
+        initialFactors = None
+        for previous in [ModelIndex, ModelIndex - 1]:
+            if previous in self.models and self.models[previous].Uk is not None and self.models[previous].N == N:
+                initialFactors = self.models[previous].Uk * self.models[previous].sk
+                break
+        return self.model_class('t1', self.kSingularValuesToKeep, N, M, initialFactors = initialFactors, **kwargs)
+
     def _denoiseTS(self, models=None, index=None, range_=True):
         # denoise the whole time series if no specific  submodels are selected
         if models is None:
@@ -369,22 +449,91 @@ class TSMM(object):
         UsedModels = [models[i] for i in range(n - NoModels, n)]
 
         if dataPoints is None and (index is None or index == self.TimeSeriesIndex + 1):
-            TSDF = pd.DataFrame(data={'t1': self.TimeSeries[-self.L:]})
-
-            predicions = np.array([mod.predict(pd.DataFrame(data={}), TSDF) for mod in UsedModels])
-            return np.mean(predicions)
+            return self.predict_array(self.TimeSeries[-self.L:], models = UsedModels)
 
         elif dataPoints is None and index <= self.TimeSeriesIndex:
             slack = self.TimeSeriesIndex - index + 1
             if slack > (self.T - self.L): raise Exception
-            TSDF = pd.DataFrame(data={'t1': self.TimeSeries[-self.L - slack:-slack]})
-            predicions = np.array([mod.predict(pd.DataFrame(data={}), TSDF) for mod in UsedModels])
-            return np.mean(predicions)
+            return self.predict_array(self.TimeSeries[-self.L - slack:-slack], models = UsedModels)
 
         elif dataPoints is not None:
             assert len(dataPoints) == self.L - 1
-            TSDF = pd.DataFrame(data={'t1': dataPoints})
-            predicions = np.array([mod.predict(pd.DataFrame(data={}), TSDF) for mod in UsedModels])
-            return np.mean(predicions)
+            return self.predict_array(np.asarray(dataPoints, dtype = float), models = UsedModels)
         else:
             return 0
+
+    def _average_weights(self, models):
+        """
+        average forecasting weights (oldest lag first) of models, zero padded on the oldest lags for sub-models with
+        fewer rows. The average is cached until the weights of one of the models change
+        """
+        weights = [mod.weights for mod in models]
+        cached = self._weights_cache
+        if cached is None or len(cached[0]) != len(weights) or any(a is not b for a, b in zip(cached[0], weights)):
+            average = np.zeros(max(len(w) for w in weights))
+            for w in weights:
+                average[len(average) - len(w):] += w
+            self._weights_cache = (weights, average / len(weights))
+        return self._weights_cache[1]
+
+    def predict_array(self, window, NoModels=None, models=None):
+        """
+        Forecast the point following window as _predict does (the average of the sub-models forecasts), without
+        DataFrames: the sub-models weights are averaged once and the forecast is a single dot product.
+        ----------
+        Parameters
+        ----------
+        window: array
+            the past observations (oldest first), at least as many as the weights of the used sub-models (L - 1)
+
+        NoModels: int optional (default=None)
+            number of most recent sub-models used, all if None
+
+        models: list or dict optional (default=None)
+            sub-models used, self.models if None
+        ----------
+        Returns
+        ----------
+        float
+            the forecast
+        """
+        weights = self._average_weights(self._used_models(NoModels, models))
+        window = np.asarray(window, dtype = float)
+        if len(window) < len(weights):
+            raise Exception('window must have at least %s observations' % len(weights))
+        return float(np.dot(window[-len(weights):], weights))
+
+    def predict_windows(self, windows, NoModels=None, models=None):
+        """
+        Batched predict_array: the forecasts following every row of windows, computed with one matrix product
+        ----------
+        Parameters
+        ----------
+        windows: array, shape [no_windows, window_length]
+            the past observations (oldest first) of each forecast, window_length >= L - 1
+
+        NoModels, models:
+            see predict_array
+        ----------
+        Returns
+        ----------
+        array, shape [no_windows]
+            the forecasts
+        """
+        weights = self._average_weights(self._used_models(NoModels, models))
+        windows = np.asarray(windows, dtype = float)
+        if windows.ndim != 2 or windows.shape[1] < len(weights):
+            raise Exception('windows must be a 2-D array with at least %s columns' % len(weights))
+        return np.dot(windows[:, -len(weights):], weights)
+
+    def _used_models(self, NoModels=None, models=None):
+        # the NoModels most recent sub-models of models (a dict indexed by model number, or a list of sub-models)
+        if models is None:
+            models = self.models
+        if isinstance(models, dict):
+            models = [models[i] for i in sorted(models)]
+        if len(models) == 0:
+            raise Exception('Before predicting, the model needs at least one fitted sub-model')
+        if NoModels is None or NoModels > len(models) or NoModels < 1:
+            NoModels = len(models)
+        return models[len(models) - NoModels:]
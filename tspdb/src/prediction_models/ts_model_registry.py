@@ -0,0 +1,125 @@
+import numpy as np
+from  tspdb.src.prediction_models.ts_svd_model import SVDModel
+
+class ModelRegistry(object):
+    """
+    Dict-like container of the sub-models of a TSMM loaded from the database. Only the summary metadata of each
+    sub-model (the rows of the model_name_m table) is kept, in compact NumPy arrays; an SVDModel object is materialized
+    the first time a sub-model is accessed. Sub-models assigned to the registry (e.g. newly fitted ones) are kept as is.
+    ----------
+    Parameters
+    ----------
+    info: list
+        rows of the model_name_m table: modelno, L, N, start, timesUpdated, timesRecons, imputation_acc, forecasting_acc,
+        forecasting_test_acc, norm_mean, norm_std
+
+    kSingularValuesToKeep: int
+        number of singular values retained in each sub-model
+
+    SSVT: boolean optional (default=false)
+        if true, sub-models use soft singular value thresholding
+
+    probObservation: float optional (default=1.0)
+        probability of observation of the sub-models
+
+    no_ts: int optional (default=1)
+        number of time series indexed by the model
+
+    model_class: class optional (default=SVDModel)
+        class of the sub-models (SVDModel or ALSModel)
+    """
+    # SVDModel attributes stored for sub-models which are not materialized
+    integer_attributes = ['N', 'M', 'start', 'TimesUpdated', 'TimesReconstructed']
+    array_attributes = ['imputation_model_score', 'forecast_model_score', 'forecast_model_score_test', 'norm_mean', 'norm_std']
+
+    def __init__(self, info, kSingularValuesToKeep, SSVT = False, probObservation = 1.0, no_ts = 1, model_class = SVDModel):
+        self.model_class = model_class
+        self.kSingularValuesToKeep = kSingularValuesToKeep
+        self.SSVT = SSVT
+        self.probObservation = probObservation
+        self.no_ts = no_ts
+        info = list(info)
+        self.modelno = np.array([int(row[0]) for row in info], dtype = np.int64)
+        self.metadata = {}
+        for i, attribute in enumerate(self.integer_attributes):
+            self.metadata[attribute] = np.array([int(row[i+1]) for row in info], dtype = np.int64)
+        for i, attribute in enumerate(self.array_attributes):
+            self.metadata[attribute] = np.array([list(row[i+6]) for row in info], dtype = float).reshape(len(info), -1)
+        self._position = {int(m): i for i, m in enumerate(self.modelno)}
+        self._models = {}
+
+    def _materialize(self, model_no):
+        i = self._position[model_no]
+        meta = self.metadata
+        return self.model_class('t1', self.kSingularValuesToKeep, int(meta['N'][i]), int(meta['M'][i]), start = int(meta['start'][i]),
+                        TimesReconstructed = int(meta['TimesReconstructed'][i]), TimesUpdated = int(meta['TimesUpdated'][i]),
+                        SSVT = self.SSVT, probObservation = self.probObservation, updated = False, no_ts = self.no_ts,
+                        imputation_model_score = list(meta['imputation_model_score'][i]), forecast_model_score = list(meta['forecast_model_score'][i]),
+                        forecast_model_score_test = list(meta['forecast_model_score_test'][i]), norm_mean = list(meta['norm_mean'][i]),
+                        norm_std = list(meta['norm_std'][i]))
+
+    def keys(self):
+        return sorted(set(self._position).union(self._models))
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __contains__(self, model_no):
+        return model_no in self._models or model_no in self._position
+
+    def __getitem__(self, model_no):
+        if model_no not in self._models:
+            if model_no not in self._position:
+                raise KeyError(model_no)
+            self._models[model_no] = self._materialize(model_no)
+        return self._models[model_no]
+
+    def __setitem__(self, model_no, model):
+        self._models[model_no] = model
+
+    def values(self):
+        """
+        return all sub-models, materializing them. Use get_attribute to read sub-model metadata without materializing
+        """
+        return [self[m] for m in self.keys()]
+
+    def items(self):
+        return [(m, self[m]) for m in self.keys()]
+
+    def loaded(self):
+        """
+        return a dict of the materialized sub-models
+        """
+        return dict(self._models)
+
+    def get_attribute(self, attribute):
+        """
+        return the value of attribute (one of integer_attributes or array_attributes) for all sub-models, ordered by
+        model number, reading the materialized sub-models from their objects and the others from the stored metadata
+        """
+        output = []
+        for m in self.keys():
+            if m in self._models:
+                output.append(getattr(self._models[m], attribute))
+            else:
+                output.append(self.metadata[attribute][self._position[m]])
+        return np.array(output, dtype = float)
+
+def updated_models(models):
+    """
+    return a dict of the updated sub-models in models (a dict or a ModelRegistry) without materializing the other ones
+    """
+    if isinstance(models, ModelRegistry):
+        models = models.loaded()
+    return {k: models[k] for k in models if models[k].updated}
+
+def model_attribute(models, attribute):
+    """
+    return the value of attribute for all sub-models in models (a dict or a ModelRegistry) as an array
+    """
+    if isinstance(models, ModelRegistry):
+        return models.get_attribute(attribute)
+    return np.array([getattr(m, attribute) for m in models.values()], dtype = float)
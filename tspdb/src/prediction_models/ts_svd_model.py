@@ -8,7 +8,6 @@ import numpy as np
 import pandas as pd
 from tspdb.src.algorithms.svdWrapper import SVDWrapper as SVD
 from tspdb.src import tsUtils
-from sklearn.metrics import r2_score
 class SVDModel(object):
 
     # seriesToPredictKey:       (string) the time series of interest (key)
@@ -16,7 +15,7 @@ class SVDModel(object):
     # N:                        (int) the number of rows of the matrix for each series
     # M:                        (int) the number of columns for the matrix for each series
     # probObservation:          (float) the independent probability of observation of each entry in the matrix
-    # svdMethod:                (string) the SVD method to use (optional)
+    # svdMethod:                (string) the SVD method to use (optional): 'numpy' or 'gram' (see SVDWrapper)
     # otherSeriesKeysArray:     (array) an array of keys for other series which will be used to predict 
     # includePastDataOnly:      (Boolean) defaults to True. If this is set to False, 
     #                               the time series in 'otherSeriesKeysArray' will include the latest data point.
@@ -113,13 +112,14 @@ class SVDModel(object):
                 rowIndex += eachTSRows
                 matrixInd += self.N
 
-        svdMod = SVD(newMatrix, method='numpy')
+        svdMod = SVD(newMatrix, method=self.svdMethod)
         (self.skw, self.Ukw, self.Vkw) = svdMod.reconstructMatrix(self.kSingularValues, returnMatrix=False)
         soft_threshold = 0
         if self.SSVT: soft_threshold = svdMod.next_sigma
         matrix = tsUtils.matrixFromSVD(self.skw, self.Ukw, self.Vkw, soft_threshold=soft_threshold, probability = self.p)
         newMatrixPInv = tsUtils.pInverseMatrixFromSVD(self.skw, self.Ukw, self.Vkw,soft_threshold=soft_threshold, probability = self.p)
         self.weights = np.dot(newMatrixPInv.T, self.lastRowObservations)
+        from sklearn.metrics import r2_score
         for i in range(self.no_ts):
             self.forecast_model_score[i] = r2_score(self.lastRowObservations[i::self.no_ts]/self.p, np.dot(matrix[:,i::self.no_ts].T,self.weights))
 
@@ -158,7 +158,8 @@ class SVDModel(object):
         else:
             return NewColsDenoised[ind]
 
-    def _assignData(self, keyToSeriesDF):
+    # missingValueFill: (Boolean) defaults to True. If False, missing values are kept as NaN in the matrix
+    def _assignData(self, keyToSeriesDF, missingValueFill=True):
 
         setAllKeys = set(self.otherSeriesKeysArray)
         setAllKeys.add(self.seriesToPredictKey)
@@ -166,17 +167,18 @@ class SVDModel(object):
         if (len(set(keyToSeriesDF.columns.values).intersection(setAllKeys)) != len(setAllKeys)):
             raise Exception('keyToSeriesDF does not contain ALL keys provided in the constructor.')
 
-        if (self.fill_in_missing == True):
-
-            keyToSeriesDF = keyToSeriesDF.fillna(method = 'ffill')
-            keyToSeriesDF = keyToSeriesDF.fillna(method = 'bfill')
-        else:
-            keyToSeriesDF = keyToSeriesDF.fillna(value = 0)
         T = self.N * self.M
         for key in setAllKeys:
             if (len(keyToSeriesDF[key]) < T):
                 raise Exception('All series (columns) provided must have length >= %d' %T)
 
+        # float copies of the series, filled in place
+        series = {}
+        for key in setAllKeys:
+            series[key] = np.array(keyToSeriesDF[key].values, dtype = float)
+            if (missingValueFill == True):
+                tsUtils.fill_missing(series[key], self.fill_in_missing)
+
 
         # initialize the matrix of interest
         single_ts_rows = self.N
@@ -187,12 +189,12 @@ class SVDModel(object):
 
         seriesIndex = 0
         for key in self.otherSeriesKeysArray: # it is important to use the order of keys set in the model
-            self.matrix[seriesIndex*single_ts_rows: (seriesIndex+1)*single_ts_rows, :] = tsUtils.arrayToMatrix(keyToSeriesDF[key][-1*T:].values, single_ts_rows, matrix_cols)
+            self.matrix[seriesIndex*single_ts_rows: (seriesIndex+1)*single_ts_rows, :] = tsUtils.arrayToMatrix(series[key][-1*T:], single_ts_rows, matrix_cols)
             seriesIndex += 1
 
         # finally add the series of interest at the bottom
        # tempMatrix = tsUtils.arrayToMatrix(keyToSeriesDF[self.seriesToPredictKey][-1*T:].values, self.N, matrix_cols)
-        self.matrix[seriesIndex*single_ts_rows: (seriesIndex+1)*single_ts_rows, :] = tsUtils.arrayToMatrix(keyToSeriesDF[self.seriesToPredictKey][-1*T:].values, single_ts_rows, matrix_cols)
+        self.matrix[seriesIndex*single_ts_rows: (seriesIndex+1)*single_ts_rows, :] = tsUtils.arrayToMatrix(series[self.seriesToPredictKey][-1*T:], single_ts_rows, matrix_cols)
         # set the last row of observations
         self.lastRowObservations = copy.deepcopy(self.matrix[-1, :])
 
@@ -209,7 +211,7 @@ class SVDModel(object):
         obs = self.matrix.flatten('F')
         obs_matrix = self.matrix.copy()
         # now produce a thresholdedthresholded/de-noised matrix. this will over-write the original data matrix
-        svdMod = SVD(self.matrix, method='numpy')
+        svdMod = SVD(self.matrix, method=self.svdMethod)
         (self.sk, self.Uk, self.Vk) = svdMod.reconstructMatrix(self.kSingularValues, returnMatrix=False)
         if self.kSingularValues is None:
             self.kSingularValues= len(self.sk)
@@ -217,6 +219,7 @@ class SVDModel(object):
         if self.SSVT: self.soft_threshold = svdMod.next_sigma
         # set weights
         self.matrix = tsUtils.matrixFromSVD(self.sk, self.Uk, self.Vk, self.soft_threshold,probability=self.p)
+        from sklearn.metrics import r2_score
         for i in range(self.no_ts):
             obs = obs_matrix[:,i::self.no_ts].flatten('F')
             self.imputation_model_score[i] = r2_score(obs,self.denoisedTS(ts = i))
@@ -226,8 +229,7 @@ class SVDModel(object):
         assert (len(D) % self.N == 0)
         if (self.fill_in_missing == True):
             # impute with the least informative value (middle)
-            D = pd.DataFrame(D).fillna(method = 'ffill').values
-            D = pd.DataFrame(D).fillna(method = 'ffill').values
+            D = tsUtils.ffill(np.asarray(D, dtype = float))
             
         else: D[np.isnan(D)] = 0
         D = D.reshape([self.N,int(len(D)/self.N)], order = 'F')
@@ -317,4 +319,16 @@ class SVDModel(object):
         projection = newDataArray#np.dot(self.Ukw, np.dot(newDataArray, self.Ukw).T)
         return np.dot(self.weights, projection)
 
+    # fast path of predict() for raw arrays: no DataFrames and no per-call checks
+    #
+    # window:                   (numpy array) the values predict() would assemble, i.e. for a model without other
+    #                           series the past points of seriesToPredictKey (oldest first). If longer than the
+    #                           weights, the most recent len(self.weights) points are used.
+    def predict_array(self, window):
+        return np.dot(self.weights, window[-len(self.weights):])
+
+    # batched predict_array(): one forecast per row of windows (2-D numpy array, one window per row)
+    def predict_windows(self, windows):
+        return np.dot(windows[:, -len(self.weights):], self.weights)
+
 
@@ -4,13 +4,85 @@
 #
 ######################################################
 import numpy as np
-from sklearn.metrics import mean_squared_error
 import copy
 from numpy.linalg import qr  as qr
 
 def unnormalize(arr, mean, std):
     return arr *std + mean
+
+class RunningMoments(object):
+    # per column count, mean and sum of squared deviations (M2) of the observed (non NaN) values of a block of rows.
+    # Blocks are added and removed with the pairwise (Chan et al.) form of Welford's update, so the moments of a sliding
+    # window are maintained from the added and dropped rows only
+    def __init__(self, count, mean, m2):
+        self.count = np.array(count, dtype = float)
+        self.mean = np.array(mean, dtype = float)
+        self.m2 = np.array(m2, dtype = float)
+
+    @classmethod
+    def from_array(cls, values):
+        values = np.asarray(values, dtype = float).reshape(len(values), -1)
+        observed = ~np.isnan(values)
+        count = observed.sum(0).astype(float)
+        mean = np.where(observed, values, 0).sum(0) / np.maximum(count, 1)
+        m2 = np.where(observed, values - mean, 0)
+        return cls(count, mean, (m2**2).sum(0))
+
+    def copy(self):
+        return RunningMoments(self.count, self.mean, self.m2)
+
+    def add(self, other):
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        safe = np.maximum(count, 1)
+        self.mean = self.mean + delta * other.count / safe
+        self.m2 = self.m2 + other.m2 + delta**2 * self.count * other.count / safe
+        self.count = count
+        return self
+
+    def remove(self, other):
+        count = self.count - other.count
+        safe = np.maximum(count, 1)
+        mean = np.where(count > 0, (self.count * self.mean - other.count * other.mean) / safe, 0)
+        delta = other.mean - mean
+        self.m2 = np.where(count > 0, np.maximum(self.m2 - other.m2 - delta**2 * count * other.count / np.maximum(self.count, 1), 0), 0)
+        self.mean, self.count = mean, count
+        return self
+
+    def std(self):
+        # population standard deviation, 1 for constant or unobserved columns (as sklearn's StandardScaler)
+        std = np.sqrt(self.m2 / np.maximum(self.count, 1))
+        constant = std <= 10 * np.finfo(float).eps * np.maximum(np.abs(self.mean), 1)
+        return np.where(constant, 1., std)
     
+def ffill(array):
+    # forward fill the NaNs of array in place along its first axis (leading NaNs are kept), and return it.
+    # each entry takes the value at the running maximum of the indices of the observed entries
+    missing = np.isnan(array)
+    if not missing.any():
+        return array
+    index = np.arange(len(array)).reshape((-1,) + (1,) * (array.ndim - 1))
+    index = np.where(missing, 0, index)
+    np.maximum.accumulate(index, axis = 0, out = index)
+    array[...] = np.take_along_axis(array, index, axis = 0)
+    return array
+
+def bfill(array):
+    # backward fill the NaNs of array in place along its first axis (trailing NaNs are kept), and return it
+    ffill(array[::-1])
+    return array
+
+def zero_fill(array):
+    # set the NaNs of array to zero in place, and return it
+    np.copyto(array, 0., where = np.isnan(array))
+    return array
+
+def fill_missing(array, fill_in_missing = True):
+    # fill the NaNs of the float array array in place: forward then backward filled if fill_in_missing, else zeros
+    if fill_in_missing:
+        return bfill(ffill(array))
+    return zero_fill(array)
+
 def updateSVD(D, uk, sk, vk):
     vk = vk.T
     m = vk.shape[1]
@@ -86,6 +158,7 @@ def pInverseMatrixFromSVD(sk, Uk, Vk, soft_threshold=0,probability=1.0):
 
 
 def rmse(array1, array2):
+    from sklearn.metrics import mean_squared_error
     return np.sqrt(mean_squared_error(array1, array2))
 
 
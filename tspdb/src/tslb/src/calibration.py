@@ -0,0 +1,133 @@
+######################################################
+#
+# Calibration cache of the compression ratio -> entropy regression
+#
+######################################################
+import os
+import numpy as np
+
+from tspdb.src.tslb.src.regModel import regModel
+
+# calibration shipped with the package (see build_calibration)
+CALIBRATION_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'calibration.npz')
+# sequence lengths of the shipped calibration
+DEFAULT_SIZES = [50, 100, 200, 500, 1000, 2000, 5000, 10000]
+DEFAULT_ALPHABETS = list(range(2, 11))
+# number of regModel samples of the shipped calibration, the default of get_lower_bound(s) so that they use it
+DEFAULT_SAMPLES = 100
+
+
+class Calibration():
+    # Linear regressions entropy = slope * compression_ratio + intercept (regModel.reg_inv), keyed by alphabet size n
+    # and sequence length size. For a size between two calibrated sizes, slope and intercept are interpolated
+    # linearly in log(size).
+    # entries = list of (n, size, samples, slope, intercept)
+    # workers, tol = passed to regModel when a calibration is fitted
+    def __init__(self, entries=[], workers=1, tol=None):
+        self.workers = workers
+        self.tol = tol
+        self.entries = {}
+        self.new_entries = []
+        for entry in entries:
+            self.add(*entry, new=False)
+
+    def add(self, n, size, samples, slope, intercept, new=True):
+        key = (int(n), int(size))
+        # keep the calibration fitted with the most samples
+        if key in self.entries and self.entries[key][0] >= samples:
+            return
+        self.entries[key] = (int(samples), float(slope), float(intercept))
+        if new:
+            self.new_entries.append((int(n), int(size), int(samples), float(slope), float(intercept)))
+
+    def lookup(self, n, size, samples):
+        # return (slope, intercept) for alphabet size n and sequence length size, or None if size is not within the
+        # calibrated sizes fitted with at least samples samples
+        sizes = sorted([s for (m, s), value in self.entries.items() if m == n and value[0] >= samples])
+        if size in sizes:
+            return self.entries[(n, size)][1:]
+        lower = [s for s in sizes if s < size]
+        upper = [s for s in sizes if s > size]
+        if len(lower) == 0 or len(upper) == 0:
+            return None
+        s1, s2 = lower[-1], upper[0]
+        w = (np.log(size) - np.log(s1)) / (np.log(s2) - np.log(s1))
+        slope = (1 - w) * self.entries[(n, s1)][1] + w * self.entries[(n, s2)][1]
+        intercept = (1 - w) * self.entries[(n, s1)][2] + w * self.entries[(n, s2)][2]
+        return slope, intercept
+
+    def get_entropy(self, compression_ratio, n, size, samples):
+        # mapping compression ratio to entropy, fitting (and caching) a regModel if size is not calibrated
+        coefficients = self.lookup(n, size, samples)
+        if coefficients is None:
+            coefficients = fit_calibration(n, size, samples, workers=self.workers, tol=self.tol)
+            self.add(n, size, samples, *coefficients)
+        slope, intercept = coefficients
+        return slope * compression_ratio + intercept
+
+    def to_array(self):
+        return np.array([[n, size] + list(value) for (n, size), value in sorted(self.entries.items())], dtype=float).reshape(-1, 5)
+
+    def save(self, path=CALIBRATION_FILE):
+        np.savez(path, calibration=self.to_array())
+
+
+def fit_calibration(n, size, samples, workers=1, tol=None):
+    # fit regModel and return the slope and intercept of the compression ratio -> entropy regression
+    # workers, tol: see regModel
+    model = regModel(n, size, samples, workers=workers, tol=tol)
+    model.fit()
+    return float(model.reg_inv.coef_[0]), float(model.reg_inv.intercept_)
+
+
+def load_calibration(path=CALIBRATION_FILE):
+    # load a calibration saved with Calibration.save, or an empty calibration if path does not exist
+    if not os.path.exists(path):
+        return Calibration()
+    with np.load(path) as data:
+        return Calibration([tuple(row) for row in data['calibration']])
+
+
+_default_calibration = None
+
+def default_calibration():
+    # the shipped calibration, loaded once per process
+    global _default_calibration
+    if _default_calibration is None:
+        _default_calibration = load_calibration()
+    return _default_calibration
+
+
+def db_calibration(GD, plpy):
+    # the calibration used by the SQL functions: the shipped one merged with the tspdb.tslb_calibration table,
+    # cached in GD (the plpython global dictionary of the session)
+    if 'tspdb_tslb_calibration' not in GD:
+        rows = plpy.execute("select n, size, samples, slope, intercept from tspdb.tslb_calibration")
+        entries = [tuple(row) for row in default_calibration().to_array()]
+        entries += [(row['n'], row['size'], row['samples'], row['slope'], row['intercept']) for row in rows]
+        GD['tspdb_tslb_calibration'] = Calibration(entries)
+    return GD['tspdb_tslb_calibration']
+
+
+def store_db_calibration(plpy, calibration):
+    # insert the calibrations fitted since the last call in tspdb.tslb_calibration
+    insert = plpy.prepare("insert into tspdb.tslb_calibration values ($1, $2, $3, $4, $5) on conflict (n, size) do update set samples = excluded.samples, slope = excluded.slope, intercept = excluded.intercept", ['int', 'int', 'int', 'double precision', 'double precision'])
+    for entry in calibration.new_entries:
+        plpy.execute(insert, list(entry))
+    calibration.new_entries = []
+
+
+def build_calibration(alphabets=DEFAULT_ALPHABETS, sizes=DEFAULT_SIZES, samples=DEFAULT_SAMPLES, path=CALIBRATION_FILE, workers=None):
+    # precompute the calibration for all alphabet sizes and sequence lengths and save it to path
+    calibration = load_calibration(path)
+    for n in alphabets:
+        for size in sizes:
+            if (n, size) not in calibration.entries or calibration.entries[(n, size)][0] < samples:
+                calibration.add(n, size, samples, *fit_calibration(n, size, samples, workers=workers))
+    calibration.save(path)
+    return calibration
+
+
+if __name__ == '__main__':
+    np.random.seed(0)
+    build_calibration()
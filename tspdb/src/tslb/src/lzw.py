@@ -4,6 +4,7 @@
 #
 ######################################################
 from io import StringIO
+import numpy as np
 
 def get_string(uncomp_numbers, n):
     # uncomp_number is a list of numbers
@@ -11,10 +12,54 @@ def get_string(uncomp_numbers, n):
     # make dictionary
     dictionary = {i : chr(i) for i in range(n)}
     # convert number list to string
-    uncompressed = str()        
-    for i in uncomp_numbers:
-        uncompressed = uncompressed + dictionary[i]
-    return uncompressed
+    return ''.join([dictionary[i] for i in uncomp_numbers])
+
+def lzw_code_count(uncomp_numbers):
+    # uncomp_numbers is a sequence (list or numpy array) of symbols
+    """Return the number of output codes of the LZW compression of a sequence of symbols.
+    Same count as len(compress(get_string(uncomp_numbers, n))), without building strings: symbols are mapped
+    to integer codes 0..n_symbols-1, words get codes from n_symbols, and the dictionary maps (prefix_code, symbol)
+    to the code of the extended word."""
+    symbols = np.asarray(uncomp_numbers).ravel()
+    if len(symbols) == 0:
+        return 0
+    _, symbols = np.unique(symbols, return_inverse = True)
+    n_symbols = int(symbols.max()) + 1
+    symbols = symbols.tolist()
+    count = 0
+    w = symbols[0]
+    if n_symbols <= 16:
+        # small alphabets: one list per symbol indexed by prefix code (-1 if the word is not in the dictionary)
+        table = [[-1] * n_symbols for _ in range(n_symbols)]
+        dict_size = n_symbols
+        for c in symbols[1:]:
+            column = table[c]
+            code = column[w]
+            if code < 0:
+                count += 1
+                column[w] = dict_size
+                for column in table:
+                    column.append(-1)
+                dict_size += 1
+                w = c
+            else:
+                w = code
+    else:
+        # the key prefix_code * n_symbols + symbol is unique since symbol < n_symbols
+        dictionary = {}
+        dict_size = n_symbols
+        for c in symbols[1:]:
+            key = w * n_symbols + c
+            code = dictionary.get(key)
+            if code is None:
+                count += 1
+                dictionary[key] = dict_size
+                dict_size += 1
+                w = c
+            else:
+                w = code
+    # Output the code for w.
+    return count + 1
 
 def compress(uncompressed):
     # uncompressed is a string
@@ -68,10 +113,8 @@ def decompress(compressed):
     return result.getvalue()
 
 def lzw_compression_ratio(uncomp_numbers, n):
-    uncompressed = get_string(uncomp_numbers, n)
-    # compression
-    compressed = compress(uncompressed)
-    compression_ratio = len(compressed)/len(uncompressed)
+    # compression, only the number of codes is needed
+    compression_ratio = lzw_code_count(uncomp_numbers)/len(uncomp_numbers)
 
     # print("uncomp_numbers   : ", uncomp_numbers)
     # print("uncompressed     : ", uncompressed)
@@ -10,14 +10,60 @@ from tspdb.src.tslb.src.lzw import *
 from tspdb.src.tslb.src.utils import *
 
 
+# number of samples drawn per batch; each batch has its own seed, so the samples do not depend on the number of workers
+BATCH_SIZE = 10
+
+
+def sample_ratios(n, size, samples, seed):
+    # draw samples random distributions over an alphabet of size n, a sequence of length size from each, and return
+    # their entropies and LZW compression ratios
+    rng = np.random.default_rng(seed)
+    true_entropy = []
+    ratio_list = []
+    for i in range(samples):
+        p = rng.uniform(0, 1, n)
+        p = p/np.sum(p)
+        true_entropy.append(entropy(p))
+        uncomp_numbers = rng.choice(n, size, p=p)
+        ratio_list.append(lzw_code_count(uncomp_numbers)/size)
+    return true_entropy, ratio_list
+
+
+def _sample_batch(args):
+    return sample_ratios(*args)
+
+
+def slope_interval(x, y, z=1.96):
+    # return the slope of the least squares regression of y on x and the half width of its confidence interval
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if len(x) < 3:
+        return np.nan, np.inf
+    xc = x - np.mean(x)
+    sxx = np.sum(xc**2)
+    if sxx == 0:
+        return np.nan, np.inf
+    slope = np.sum(xc*(y - np.mean(y)))/sxx
+    residuals = y - np.mean(y) - slope*xc
+    se = np.sqrt(np.sum(residuals**2)/(len(x) - 2)/sxx)
+    return slope, z*se
+
+
 class regModel():
     # n = alphabet size
     # size = sequence length
-    # samples = number of samples to collect
-    def __init__(self, n, size, samples):
+    # samples = number of samples to collect (the maximum number if tol is set)
+    # workers = number of worker processes drawing the samples (default 1: sampled in this process)
+    # seed = seed of the samples, if None it is drawn from np.random
+    # tol = if set, stop sampling once the half width of the 95% confidence interval of the slope of the
+    #       compression ratio -> entropy regression is below tol * |slope|
+    def __init__(self, n, size, samples, workers=1, seed=None, tol=None):
         self.n = n
         self.size = size
         self.samples = samples
+        self.workers = workers
+        self.seed = seed
+        self.tol = tol
 
         # ratio = ratio list to fit reg
         # entropy = entropy list to fit entropy
@@ -25,36 +71,59 @@ class regModel():
         self.entropy = None
         self.reg = None
         self.reg_inv = None
+        self.samples_used = 0
+
+    def _batches(self):
+        # (n, size, samples, seed) of each batch of samples
+        seed = self.seed
+        if seed is None:
+            seed = np.random.randint(2**31)
+        no_batches = int(np.ceil(self.samples/BATCH_SIZE))
+        seeds = np.random.SeedSequence(seed).spawn(no_batches)
+        return [(self.n, self.size, min(BATCH_SIZE, self.samples - i*BATCH_SIZE), seeds[i]) for i in range(no_batches)]
 
     def fit(self):
-        dictionary = {i : chr(i) for i in range(self.n)}
-        
-        ratio_list =[]
+        batches = self._batches()
+        workers = self.workers
+        if workers is None:
+            import os
+            workers = os.cpu_count() or 1
+        workers = max(min(workers, len(batches)), 1)
+
+        ratio_list = []
         true_entropy = []
-        
-        probabilities=[]
-        for i in range(self.samples):
-            probabilities.append(random_p(self.n))
-                
-        for p in probabilities:
-            true_entropy.append(entropy(p))
-            
-            uncompressed =str()        
-            uncomp_numbers = multinomial(self.size, p)
-            for i in uncomp_numbers:
-                uncompressed = uncompressed + dictionary[i]
-
-            compressed = compress(uncompressed)
-            compression_ratio = len(compressed)/len(uncompressed)
-            ratio_list.append(compression_ratio)
+        pool = None
+        if workers > 1:
+            import multiprocessing
+            pool = multiprocessing.get_context('fork').Pool(workers)
+        try:
+            # draw the batches in rounds of workers batches, checking the slope interval after each round
+            for i in range(0, len(batches), workers):
+                round_batches = batches[i: i + workers]
+                if pool is None:
+                    results = [_sample_batch(batch) for batch in round_batches]
+                else:
+                    results = pool.map(_sample_batch, round_batches)
+                for batch_entropy, batch_ratio in results:
+                    true_entropy += batch_entropy
+                    ratio_list += batch_ratio
+                if self.tol is not None:
+                    slope, half_width = slope_interval(ratio_list, true_entropy)
+                    if half_width <= self.tol*np.abs(slope):
+                        break
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
 
         self.ratio = ratio_list
         self.entropy = true_entropy
+        self.samples_used = len(ratio_list)
 
         # linear regression
         self.reg = LinearRegression(fit_intercept=True).fit(np.array(true_entropy[:]).reshape(-1, 1), np.array(self.ratio[:]))
         self.reg_inv = LinearRegression(fit_intercept=True).fit(np.array(self.ratio[:]).reshape(-1, 1), np.array(true_entropy[:]))
-        score = self.reg.score(np.array(true_entropy[:]).reshape(-1, 1), np.array(self.ratio[:])).round(3)
+        score = np.round(self.reg.score(np.array(true_entropy[:]).reshape(-1, 1), np.array(self.ratio[:])), 3)
 
 
 
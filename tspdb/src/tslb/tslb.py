@@ -3,6 +3,7 @@ from tspdb.src.tslb.src.continuous import *
 from tspdb.src.tslb.src.lzw import *
 from tspdb.src.tslb.src.regModel import regModel as regModel
 from tspdb.src.tslb.src.utils import *
+from tspdb.src.tslb.src.calibration import default_calibration, DEFAULT_SAMPLES
 
 
 def get_diff(series):
@@ -18,7 +19,9 @@ def transform_data(series):
     x_t[y_t < 0] = 2
     return x_t
 
-def get_lower_bound(test, samples=1000, k=3, discretization_method='quantization'):
+# calibration: Calibration object caching the compression ratio -> entropy regressions (see src/calibration.py),
+#              defaults to the calibration shipped with the package. Sizes which are not calibrated are fitted and added to it.
+def get_lower_bound(test, samples=DEFAULT_SAMPLES, k=3, discretization_method='quantization', calibration=None):
     # discretize the sequence
     if discretization_method == 'quantization':
         n = k
@@ -40,12 +43,67 @@ def get_lower_bound(test, samples=1000, k=3, discretization_method='quantization
     else:
         raise ValueError ('Choose discretization_method from {"change", "quantization", "None"}')
     
-    myRegModel = regModel(n, size, samples)
-    myRegModel.fit()
+    if calibration is None:
+        calibration = default_calibration()
 
     # convert format and get p_tilda
     uncomp_numbers = list(discretized_seq)
     ratio = lzw_compression_ratio(uncomp_numbers, n)
-    ent = myRegModel.get_entropy(ratio)
+    ent = calibration.get_entropy(ratio, n, size, samples)
     lb = h_inverse(ent, n, a=0.001)
     return lb
+
+
+def discretize_column(series, k=3, discretization_method='quantization'):
+    # discretize a whole column once, so that all its windows share the same bins
+    # returns the symbols (numpy array), the alphabet size and the index label of the last observation used by each symbol
+    values = np.asarray(series, dtype=float)
+    if discretization_method == 'quantization':
+        n = k
+        diff = values[1:] - values[:-1]
+        symbols = np.full(len(diff), np.nan)
+        valid = ~np.isnan(diff)
+        if valid.any():
+            symbols[valid], _ = discretize(diff[valid], n)
+        labels = series.index[1:]
+    elif discretization_method == 'change':
+        n = 3
+        diff = values[1:] - values[:-1]
+        symbols = np.select([diff == 0, diff > 0, diff < 0], [0., 1., 2.], default=np.nan)
+        labels = series.index[1:]
+    elif discretization_method == 'None':
+        valid = ~np.isnan(values)
+        n = len(np.unique(values[valid]))
+        if n > 0.5*valid.sum():
+            raise Exception ('The time series is not discrete, or there are not enough observations (no. observations < (alphabet size)/2 )')
+        symbols = values
+        labels = series.index
+    else:
+        raise ValueError ('Choose discretization_method from {"change", "quantization", "None"}')
+    return symbols, n, labels
+
+
+# data: DataFrame, one column per time series, rows ordered by time
+# window: number of discretized symbols in each window, step: shift between consecutive windows (default: window)
+# the columns are discretized once over their whole length, so the bounds of the windows of a column are comparable.
+# Windows with missing values get a NaN bound.
+def get_lower_bounds(data, window, step=None, samples=DEFAULT_SAMPLES, k=3, discretization_method='quantization', calibration=None):
+    if step is None:
+        step = window
+    if calibration is None:
+        calibration = default_calibration()
+    output = []
+    for column in data.columns:
+        symbols, n, labels = discretize_column(data[column], k, discretization_method)
+        # entropy -> lower bound, the alphabet size and the window length are the same for all windows
+        bounds = {}
+        for start in range(0, len(symbols) - window + 1, step):
+            seq = symbols[start: start + window]
+            lb = np.nan
+            if not np.isnan(seq).any():
+                ratio = lzw_code_count(seq)/window
+                if ratio not in bounds:
+                    bounds[ratio] = h_inverse(calibration.get_entropy(ratio, n, window, samples), n, a=0.001)
+                lb = bounds[ratio]
+            output.append([column, labels[start], labels[start + window - 1], lb])
+    return pd.DataFrame(output, columns=['column', 'window_start', 'window_end', 'lower_bound'])
@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+import time
+from tspdb.src.database_module.sql_imp import SqlImplementation
+
+def create_benchmark_table(interface, table_name = 'ts_agg_benchmark', no_rows = 10**7, freq = 1):
+	# build the table server side, one row every freq seconds with ~1% of the rows missing
+	interface.engine.execute('DROP TABLE IF EXISTS %s;' % table_name)
+	interface.engine.execute('''CREATE TABLE %s AS SELECT '2012-10-01 00:00:00'::timestamp + (n * interval '%s second') AS time,
+		sin(n/100.) + random() AS ts FROM generate_series(0, %s) AS n WHERE random() > 0.01;''' % (table_name, freq, no_rows - 1))
+	interface.engine.execute('CREATE INDEX ON %s (time);' % table_name)
+	interface.engine.execute('ANALYZE %s;' % table_name)
+
+def aggregation_benchmark(interface, table_name = 'ts_agg_benchmark', interval = 5., runs = 3):
+	start_ts = pd.Timestamp('2012-10-01 00:00:00')
+	end = pd.Timestamp(interface.engine.execute('SELECT max(time) FROM %s' % table_name).fetchone()[0])
+	for method in ['average', 'min', 'max']:
+		timing = {}
+		output = {}
+		for bucketed in [False, True]:
+			t = time.time()
+			for _ in range(runs):
+				output[bucketed] = interface.get_time_series(table_name, start_ts, end, start_ts = start_ts, value_column = 'ts', index_column = 'time', interval = interval, aggregation_method = method, bucketed = bucketed)
+			timing[bucketed] = (time.time() - t)/runs
+		range_join = np.array(output[False], dtype = float)
+		assert range_join.shape == output[True].shape
+		assert np.allclose(range_join, output[True], equal_nan = True)
+		print('%s: range join %.2f s, bucketing %.2f s, speedup %.1fx' % (method, timing[False], timing[True], timing[False]/timing[True]))
+
+def main():
+	interface = SqlImplementation(driver="postgresql", host="localhost", database="querytime_test",user="aalomar",password="AAmit32lids")
+	create_benchmark_table(interface)
+	aggregation_benchmark(interface)
+
+if __name__ == '__main__':
+	main()
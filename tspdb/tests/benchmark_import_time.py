@@ -0,0 +1,23 @@
+import subprocess
+import sys
+
+# entry points imported by the plpython functions: predict, forecast_next and create/update_pindex
+ENTRY_POINTS = ['tspdb.src.database_module.plpy_cache', 'tspdb.src.pindex.predict', 'tspdb.src.database_module.plpy_imp', 'tspdb.src.pindex.pindex_managment']
+HEAVY_MODULES = ['pandas', 'scipy', 'sklearn', 'sqlalchemy', 'dateutil']
+
+def import_time(module, runs = 5):
+	# import in a fresh interpreter, as a new postgres backend would
+	code = 'import time, sys\nt = time.perf_counter()\nimport %s\nprint(time.perf_counter() - t)\nprint(",".join(m for m in %r if m in sys.modules))' % (module, HEAVY_MODULES)
+	timings = []
+	for _ in range(runs):
+		output = subprocess.check_output([sys.executable, '-c', code]).decode().split('\n')
+		timings.append(float(output[0]))
+	return min(timings), output[1]
+
+def main():
+	for module in ENTRY_POINTS:
+		seconds, loaded = import_time(module)
+		print('%s: %.3f s, heavy modules loaded: %s' % (module, seconds, loaded or 'none'))
+
+if __name__ == '__main__':
+	main()
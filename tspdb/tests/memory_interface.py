@@ -0,0 +1,170 @@
+import re
+import numpy as np
+import pandas as pd
+from tspdb.src.database_module.db_class import Interface
+
+def _to_array(value):
+	# postgres array literals written by TSPI._array_str
+	if isinstance(value, str) and value.startswith('{'):
+		return np.array([float(v) for v in value[1:-1].split(',') if v != ''])
+	return value
+
+class MemoryInterface(Interface):
+	"""
+	Interface keeping the tables in pandas dataframes, used to run the pindex write and query paths without a database.
+	Predicates are evaluated with DataFrame.query and only support the forms used by tspdb.
+	"""
+	def __init__(self):
+		self.tables = {}
+		self.queries = []
+
+	def _predicate(self, df, predicate):
+		predicate = predicate.strip().rstrip(';')
+		order = re.search(r'\s*order by (.*)$', predicate, re.IGNORECASE)
+		if order is not None:
+			predicate = predicate[:order.start()]
+		predicate = re.sub(r'"(\w+)"', r'`\1`', predicate)
+		predicate = re.sub(r'(?<![<>!=])=(?!=)', '==', predicate)
+		if predicate.strip() not in ('', 'true'):
+			df = df.query(predicate)
+		if order is not None:
+			keys = [key.strip().split() for key in order.group(1).split(',')]
+			df = df.sort_values([key[0].strip('"') for key in keys], ascending = [len(key) == 1 or key[1].lower() != 'desc' for key in keys], kind = 'stable')
+		return df
+
+	def _table(self, table_name):
+		if table_name.startswith('('):
+			# union of selects of the form SELECT <no> as table_no, <columns> FROM <table>
+			frames = []
+			for table_no, columns, name in re.findall(r'SELECT (\d+) as table_no, (.*?) FROM ([\w.]+)', table_name):
+				columns = [c.strip().strip('"') for c in columns.split(',')]
+				df = self.tables[name][columns].copy()
+				df.insert(0, 'table_no', int(table_no))
+				frames.append(df)
+			return pd.concat(frames, ignore_index = True)
+		return self.tables.get(table_name, pd.DataFrame())
+
+	def execute_query(self, query):
+		self.queries.append(query)
+		# pindex version bumps (see pindex_managment.bump_pindex_version)
+		bump = re.match(r"insert into (\w+\.pindices_versions) values \('(\w+)', 1\)", query)
+		if bump is not None:
+			versions = self.tables.get(bump.group(1), pd.DataFrame({'index_name': [], 'version': []}))
+			if bump.group(2) in list(versions['index_name']):
+				versions.loc[versions['index_name'] == bump.group(2), 'version'] += 1
+			else:
+				versions = pd.concat([versions, pd.DataFrame({'index_name': [bump.group(2)], 'version': [1]})], ignore_index = True)
+			self.tables[bump.group(1)] = versions
+
+	def query_table(self, table_name, columns_queried = [], predicate = ''):
+		self.queries.append(('query_table', table_name))
+		df = self._table(table_name)
+		if len(df) == 0:
+			return []
+		df = self._predicate(df, predicate)
+		return [list(row) for row in df[columns_queried].itertuples(index = False)]
+
+	def create_table(self, table_name, df, primary_key = None, load_data = True, replace_if_exists = True, include_index = True,
+					 index_label = "row_id", type_dict = None):
+		self.tables[table_name] = df.iloc[:0].reset_index(drop = not include_index).rename(columns = {'index': index_label})
+		if load_data:
+			self.bulk_insert(table_name, df, include_index, index_label)
+
+	def bulk_insert(self, table_name, df, include_index = True, index_label = 'row_id'):
+		df = df.reset_index(drop = not include_index).rename(columns = {'index': index_label})
+		df = df.apply(lambda column: column.map(_to_array))
+		self.tables[table_name] = pd.concat([self.tables[table_name], df], ignore_index = True)
+
+	def insert(self, table_name, row, columns = None):
+		if columns is None:
+			columns = list(self.tables[table_name].columns)
+		row = pd.DataFrame([list(row)], columns = columns)
+		if table_name not in self.tables:
+			self.tables[table_name] = row
+		else:
+			self.tables[table_name] = pd.concat([self.tables[table_name], row], ignore_index = True)
+
+	def delete(self, table_name, predicate):
+		if table_name not in self.tables:
+			return
+		df = self.tables[table_name]
+		predicate = predicate.strip().rstrip(';')
+		if predicate == '':
+			self.tables[table_name] = df.iloc[:0]
+		else:
+			self.tables[table_name] = df.drop(self._predicate(df, predicate).index)
+
+	def drop_table(self, table_name):
+		self.tables.pop(table_name, None)
+
+	def table_exists(self, table_name, schema = 'public'):
+		return table_name in self.tables
+
+	def create_index(self, table_name, column, index_name = ''):
+		pass
+
+	def create_insert_trigger(self, table_name, index_name):
+		pass
+
+	def drop_trigger(self, table_name, index_name):
+		pass
+
+	def get_extreme_value(self, table_name, column_name, extreme = 'min'):
+		values = self.tables[table_name][column_name]
+		return values.min() if extreme == 'min' else values.max()
+
+	def get_time_diff(self, table_name, time_column, number_of_pts = 100):
+		return 1.
+
+	def get_time_series(self, name, start, end = None, start_ts = '1970/01/01 00:00:00', value_column = "ts", index_column = 'row_id', Desc = False, interval = 60, aggregation_method = 'average', bucketed = True):
+		self.queries.append(('get_time_series', name))
+		df = self.tables[name]
+		value_columns = value_column.split(',')
+		mask = df[index_column] >= start
+		if end is not None:
+			mask &= df[index_column] <= end
+		df = df[mask].sort_values(index_column, ascending = not Desc)
+		return df[value_columns].values.astype(float).reshape(-1, len(value_columns))
+
+	def get_coeff(self, table_name, column = 'average'):
+		self.queries.append(('get_coeff', table_name))
+		df = self.tables[table_name].sort_values('coeffpos', ascending = False)
+		return df[column.lower()].values
+
+	def get_coeff_model(self, index_name, model_no):
+		df = self.tables[index_name]
+		return df[df['modelno'] == model_no].sort_values('coeffpos', ascending = False)['coeffvalue'].values
+
+	def _factor(self, table_name, factor, k, predicate, return_modelno = True, order = 'row_id', return_weights_decom = False):
+		self.queries.append(('factor', table_name))
+		df = self._predicate(self.tables[table_name], predicate).sort_values(order, kind = 'stable')
+		columns = (['modelno'] if return_modelno else []) + [factor + str(i) for i in range(1, k + 1)]
+		if return_weights_decom:
+			columns += [factor + 'w' + str(i) for i in range(1, k + 1)]
+		return df[columns].values.astype(float)
+
+	def get_U_row(self, table_name, tsrow_range, models_range, k, return_modelno = False, return_weights_decom = False):
+		return self._factor(table_name, 'u', k, 'tsrow >= %s and tsrow <= %s and (modelno >= %s and modelno <= %s)' % (tsrow_range[0], tsrow_range[1], models_range[0], models_range[1]), return_modelno, return_weights_decom = return_weights_decom)
+
+	def get_V_row(self, table_name, tscol_range, k, value_index, models_range = [0, 10**10], return_modelno = False, return_weights_decom = False):
+		return self._factor(table_name, 'v', k, 'time_series = %s and tscolumn >= %s and tscolumn <= %s and (modelno >= %s and modelno <= %s)' % (value_index, tscol_range[0], tscol_range[1], models_range[0], models_range[1]), return_modelno, return_weights_decom = return_weights_decom)
+
+	def get_S_row(self, table_name, models_range, k, return_modelno = False, return_weights_decom = False):
+		return self._factor(table_name, 's', k, 'modelno >= %s and modelno <= %s' % (models_range[0], models_range[1]), return_modelno, order = 'modelno', return_weights_decom = return_weights_decom)
+
+	def get_SUV(self, table_name, tscol_range, tsrow_range, models_range, k, value_index, return_modelno = False):
+		S = self._factor(table_name + '_s', 's', k, 'modelno = %s or modelno = %s' % (models_range[0], models_range[1]), return_modelno, order = 'modelno')
+		V = self._factor(table_name + '_v', 'v', k, 'time_series = %s and tscolumn = %s' % (value_index, tscol_range[0]), return_modelno)
+		U = self._factor(table_name + '_u', 'u', k, 'tsrow = %s and (modelno = %s or modelno = %s)' % (tsrow_range[0], models_range[0], models_range[1]), return_modelno)
+		return U, S, V
+
+	def get_factor_rows(self, table_names, factor, ks, predicate, order = 'row_id'):
+		self.queries.append(('factor_rows', tuple(table_names)))
+		width = max(ks)
+		result = []
+		for table_name, k in zip(table_names, ks):
+			df = self._predicate(self.tables[table_name], predicate).sort_values(order, kind = 'stable')
+			rows = np.full([len(df), 1 + width], np.nan)
+			rows[:, :1 + k] = df[['modelno'] + [factor + str(i) for i in range(1, k + 1)]].values
+			result.append(rows[:, :1 + k])
+		return result
@@ -0,0 +1,39 @@
+import warnings
+import numpy as np
+import pandas as pd
+from tspdb.tests.memory_interface import MemoryInterface
+from tspdb.src.pindex.pindex_managment import TSPI, load_pindex_u
+
+def make_tspi(interface = None, direct_var = False, **kwargs):
+	# a pindex of the columns a and b of the table ts, indexed by time from 0 every time unit
+	arguments = dict(T = 1000, rank = 3, agg_interval = 1., start_time = 0, time_series_table_name = 'ts', time_column = 'time',
+		value_column = ['a', 'b'], index_name = 'pindex', direct_var = direct_var)
+	arguments.update(kwargs)
+	return TSPI(interface = interface, **arguments)
+
+def make_pindex(direct_var):
+	# the pindex tspdb.pindex created on 5000 noisy points of two periodic columns
+	np.random.seed(0)
+	t = np.arange(5000)
+	df = pd.DataFrame({'time': t, 'a': np.sin(2*np.pi*t/50) + 0.1*np.random.randn(5000), 'b': np.cos(2*np.pi*t/30) + 0.1*np.random.randn(5000)})
+	interface = MemoryInterface()
+	interface.create_table('ts', df, include_index = False)
+	TSPD = make_tspi(interface, direct_var, rank_var = 2)
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore')
+		TSPD.create_index()
+	return interface, TSPD
+
+def update_pindex(interface):
+	# insert 600 points into ts and update tspdb.pindex
+	t = np.arange(5000, 5600)
+	interface.bulk_insert('ts', pd.DataFrame({'time': t, 'a': np.sin(2*np.pi*t/50), 'b': np.cos(2*np.pi*t/30)}), include_index = False)
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore')
+		load_pindex_u(interface, 'tspdb.pindex').update_index()
+
+def baseline_coefficient_view(interface):
+	# pindices created before the running sums have a materialized view of the averages only
+	for name in ['tspdb.pindex_c_view', 'tspdb.pindex_variance_c_view']:
+		view = interface.tables[name]
+		interface.tables[name] = view[[column for column in view.columns if not column.startswith(('sum_', 'count_'))]]
@@ -0,0 +1,107 @@
+import numpy as np
+import time
+from scipy import sparse
+from tspdb.src.algorithms.alsWrapper import ALSWrapper
+
+def low_rank_matrix(N, M, k, missing):
+	np.random.seed(1)
+	Y = np.dot(np.random.randn(N, k), np.random.randn(k, M))
+	Y_missing = Y.copy()
+	Y_missing[np.random.rand(N, M) < missing] = np.nan
+	return Y, Y_missing
+
+def loop_als(matrix, W, V, lambda_, iterations):
+	# reference: the per-row / per-column implementation
+	N, M = matrix.shape
+	k = V.shape[0]
+	U = np.zeros([N, k])
+	V = V.copy()
+	for ii in range(iterations):
+		for u, Wu in enumerate(W):
+			left = np.linalg.pinv(np.dot(V, np.dot(np.diag(Wu), V.T)) + lambda_ * np.eye(k))
+			U[u] = np.dot(left, np.dot(V, np.dot(np.diag(Wu), matrix[u].T))).T
+		for i, Wi in enumerate(W.T):
+			left = np.linalg.pinv(np.dot(U.T, np.dot(np.diag(Wi), U)) + lambda_ * np.eye(k))
+			V[:,i] = np.dot(left, np.dot(U.T, np.dot(np.diag(Wi), matrix[:, i])))
+	return U, V
+
+def test_batched_als_matches_loop():
+	Y, Y_missing = low_rank_matrix(60, 40, 3, 0.3)
+	V0 = np.random.rand(3, 40)
+	als = ALSWrapper(Y_missing.copy())
+	U, V = als.decompose(3, 0.1, 5, 0, V = V0, verbose = False)
+	U_ref, V_ref = loop_als(als.matrix, als.W, V0, 0.1, 5)
+	assert np.allclose(U, U_ref)
+	assert np.allclose(V, V_ref)
+
+def test_sparse_mask():
+	Y, Y_missing = low_rank_matrix(200, 100, 3, 0.6)
+	V0 = np.random.rand(3, 100)
+	dense = ALSWrapper(Y_missing.copy())
+	sparse_als = ALSWrapper(Y_missing.copy(), sparse = True)
+	observed = ~np.isnan(Y_missing)
+	rows, cols = np.nonzero(observed)
+	from_scipy = ALSWrapper(sparse.coo_matrix((Y_missing[observed], (rows, cols)), shape = Y.shape))
+	U, V = dense.decompose(3, 0.0, 20, 0, V = V0, verbose = False)
+	for als in [sparse_als, from_scipy]:
+		U_s, V_s = als.decompose(3, 0.0, 20, 0, V = V0, verbose = False)
+		assert np.allclose(np.dot(U, V), np.dot(U_s, V_s))
+		assert np.isclose(dense.getError(dense.matrix, U, V, dense.W), als.getError(None, U_s, V_s, None))
+	# the missing entries are recovered
+	assert np.sqrt(np.mean((np.dot(U, V) - Y)**2)) < 1e-3
+
+def test_empty_rows():
+	Y, Y_missing = low_rank_matrix(30, 20, 2, 0.2)
+	Y_missing[5, :] = np.nan
+	U, V = ALSWrapper(Y_missing.copy()).decompose(2, 0.0, 10, 0, verbose = False)
+	assert np.all(np.isfinite(U)) and np.allclose(U[5], 0)
+
+def test_warm_start():
+	Y, Y_missing = low_rank_matrix(300, 200, 4, 0.5)
+	als = ALSWrapper(Y_missing.copy())
+	U, V = als.decompose(4, 0.0, 1000, 1e-12, verbose = False)
+	# a new matrix sharing the row space converges in a few iterations when started from U
+	Y2 = np.dot(U, np.random.randn(4, 200))
+	Y2[np.random.rand(300, 200) < 0.5] = np.nan
+	U2, V2 = ALSWrapper(Y2.copy()).decompose(4, 0.0, 3, 0, U = U, verbose = False)
+	observed = ~np.isnan(Y2)
+	assert np.allclose(np.dot(U2, V2)[observed], Y2[observed], atol = 1e-6)
+
+def test_als_pindex_model():
+	from tspdb.src.pindex.pindex_managment import TSPI, build_model_tables
+	from tspdb.src.prediction_models.ts_als_model import ALSModel
+	np.random.seed(0)
+	t = np.arange(6000)
+	true = np.column_stack([np.sin(2*np.pi*t/50) + 0.5*np.sin(2*np.pi*t/13), np.cos(2*np.pi*t/50)])
+	data = true + 0.1*np.random.randn(6000, 2)
+	data[np.random.rand(6000, 2) < 0.5] = np.nan
+	errors = {}
+	for model_type in ['svd', 'als']:
+		TSPD = TSPI(interface = None, T = 2000, rank = 4, agg_interval = 1., start_time = 0, time_series_table_name = 'ts', time_column = 'time',
+			value_column = ['a', 'b'], index_name = 'ts_index', model_type = model_type, fill_in_missing = model_type == 'svd')
+		TSPD.update_model(data[:4000].copy())
+		if model_type == 'als':
+			# incremental updates fold the new columns in
+			for i in range(4000, 6000, 100):
+				TSPD.update_model(data[i:i+100].copy())
+		else:
+			TSPD.update_model(data[4000:].copy())
+		denoised = TSPD.ts_model._denoiseTS()
+		errors[model_type] = np.sqrt(np.nanmean((denoised - true[:len(denoised)])**2))
+	assert TSPD.ts_model.p == 1.0
+	assert all(isinstance(m, ALSModel) for m in TSPD.ts_model.models.values())
+	assert max(m.TimesUpdated for m in TSPD.ts_model.models.values()) > 0
+	assert errors['als'] < errors['svd']
+	# sub-models are persisted in the same U/S/V layout
+	models = TSPD.ts_model.models
+	tables = build_model_tables(models, TSPD.ts_model.kSingularValuesToKeep, 2, models[0].N, models[0].M)
+	assert len(tables) == 5
+
+if __name__ == '__main__':
+	# benchmark on a page-matrix sized problem
+	Y, Y_missing = low_rank_matrix(1000, 1000, 5, 0.5)
+	for sparse_ in [False, True]:
+		als = ALSWrapper(Y_missing.copy(), sparse = sparse_)
+		t = time.time()
+		als.decompose(5, 0.0, 10, 0, verbose = False)
+		print('sparse = %s: %.3f s per iteration' % (sparse_, (time.time() - t) / 10))
@@ -0,0 +1,43 @@
+import numpy as np
+from tspdb.tests.pindex_fixtures import make_pindex
+from tspdb.src.pindex.backtest import backtest_pindex, _backtest_index, forecast_windows
+from tspdb.src.pindex import predict
+
+def test_forecast_windows():
+	windows = np.array([[1., 2.], [0., 1.]])
+	coeffs = np.array([0.5, 1.])
+	forecast = forecast_windows(windows, coeffs, coeffs, np.array([0., 1.]), 3)
+	assert np.allclose(forecast[0], [2.5, 3.5, 4.75]) and np.allclose(forecast[1], [2., 3.5, 5.5])
+
+def test_backtest_matches_forecast_range():
+	interface, TSPD = make_pindex(False)
+	L, k, T, last_model, MUpdateIndex = TSPD.ts_model.L, TSPD.k, TSPD.T, len(TSPD.ts_model.models) - 1, TSPD.ts_model.MUpdateIndex
+	for projected in [False, True]:
+		forecast, actual, deviation = _backtest_index(interface, 'tspdb.pindex', ['b', 'a'], [2000, 2300], 30, True, 1., 'average', projected)
+		for i, (column, value_index) in enumerate([('b', 1), ('a', 0)]):
+			for j, origin in enumerate([2000, 2300]):
+				args = ('ts', column, 'time', interface, origin, origin + 29)
+				mean = predict._get_forecast_range('tspdb.pindex', *args, MUpdateIndex, L, k, T, last_model, 1., 0, None, 2, value_index, projected = projected)
+				second_moment = predict._get_forecast_range('tspdb.pindex_variance', *args, MUpdateIndex, L, 1, T, last_model, 1., 0, None, 2, value_index, variance = True, projected = projected)
+				assert np.allclose(mean, forecast[i, j])
+				assert np.allclose(np.sqrt(np.clip(second_moment - mean**2, 0, None)), deviation[i, j])
+				assert np.allclose(actual[i, j], interface.tables['ts'][column].values[origin:origin + 30])
+
+def test_backtest_metrics():
+	interface, TSPD = make_pindex(True)
+	origins = list(range(1000, 5000, 50)) + [4995]
+	result = backtest_pindex(interface, 'tspdb.pindex', ['a', 'b'], origins, 10)
+	assert list(result.columns) == ['column', 'horizon', 'wape', 'rmse', 'coverage', 'no_origins']
+	assert list(result['column']) == ['a']*10 + ['b']*10 and list(result['horizon']) == list(range(1, 11))*2
+	forecast, actual, deviation = _backtest_index(interface, 'tspdb.pindex', ['a', 'b'], origins, 10, True, 1.959963984540054, 'average', False)
+	# the last origins are forecasted past the last observation
+	observed = ~np.isnan(actual)
+	assert not observed[:, -1].all() and observed[:, 0].all()
+	b = result[result['column'] == 'b']
+	error = (actual[1] - forecast[1])[:, 2]
+	error = error[~np.isnan(error)]
+	assert b['no_origins'].iloc[2] == len(error)
+	assert np.isclose(b['rmse'].iloc[2], np.sqrt(np.mean(error**2)))
+	assert np.isclose(b['wape'].iloc[2], np.abs(error).sum() / np.nansum(np.abs(actual[1][:, 2])))
+	assert ((result['coverage'] >= 0) & (result['coverage'] <= 1)).all()
+	assert np.isnan(backtest_pindex(interface, 'tspdb.pindex', ['a'], origins, 2, uq = False)['coverage']).all()
@@ -0,0 +1,38 @@
+import os
+import numpy as np
+import pandas as pd
+from tspdb.src.tslb.src.calibration import Calibration, load_calibration, default_calibration, CALIBRATION_FILE, DEFAULT_SIZES
+from tspdb.src.tslb.tslb import get_lower_bound
+
+def test_lookup_and_interpolation():
+	calibration = Calibration([(3, 100, 100, 4., -0.5), (3, 1000, 100, 7., -0.4)])
+	assert calibration.lookup(3, 100, 100) == (4., -0.5)
+	slope, intercept = calibration.lookup(3, 10**2.5, 100)
+	assert np.isclose(slope, 5.5) and np.isclose(intercept, -0.45)
+	# outside the calibrated sizes, other alphabets, or fitted with fewer samples
+	assert calibration.lookup(3, 2000, 100) is None
+	assert calibration.lookup(4, 500, 100) is None
+	assert calibration.lookup(3, 500, 200) is None
+
+def test_fit_on_miss(tmpdir):
+	np.random.seed(0)
+	calibration = Calibration()
+	calibration.get_entropy(0.5, 2, 60, 20)
+	assert list(calibration.entries) == [(2, 60)] and len(calibration.new_entries) == 1
+	calibration.get_entropy(0.5, 2, 60, 20)
+	assert len(calibration.new_entries) == 1
+	path = os.path.join(str(tmpdir), 'calibration.npz')
+	calibration.save(path)
+	assert load_calibration(path).entries == calibration.entries
+
+def test_shipped_calibration():
+	assert os.path.exists(CALIBRATION_FILE)
+	calibration = default_calibration()
+	for n in range(2, 11):
+		for size in DEFAULT_SIZES:
+			assert calibration.lookup(n, size, 100) is not None
+	np.random.seed(0)
+	series = pd.Series(np.random.randn(1001).cumsum())
+	lb = get_lower_bound(series, samples = 100, k = 3, calibration = calibration)
+	assert len(calibration.new_entries) == 0
+	assert 0 <= lb <= 1
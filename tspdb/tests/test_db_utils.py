@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+from tspdb.src.database_module.db_utils import bucket_range, bucket_bounds, bucket_sql, fill_buckets, factor_rows_sql, split_factor_rows, interval_microseconds
+
+def range_join_aggregate(times, values, origin, interval, start, end, agg):
+	# reference implementation of the generate_series right join
+	step = pd.Timedelta(seconds = interval)
+	output = []
+	n = origin
+	while n <= end:
+		if n + step > start:
+			selected = values[(times >= n) & (times < n + step)]
+			selected = selected[~np.isnan(selected)]
+			output.append(agg(selected) if len(selected) else np.nan)
+		n = n + step
+	return np.array(output)
+
+def bucket_aggregate(times, values, origin, interval, start, end, agg):
+	first_bucket, last_bucket = bucket_range(origin, interval, start, end)
+	lower, upper = bucket_bounds(origin, interval, first_bucket, last_bucket)
+	selected = (times >= lower) & (times < upper)
+	# integer microseconds, as bucket_sql computes the buckets
+	buckets = ((times[selected] - origin).asi8 // 1000) // interval_microseconds(interval)
+	df = pd.DataFrame({'bucket': buckets, 'value': values[selected]}).groupby('bucket')['value'].agg(agg)
+	rows = [[b, v] for b, v in df.items()]
+	return fill_buckets(rows, first_bucket, last_bucket, 1)[:, 0]
+
+def test_bucketing_matches_range_join():
+	np.random.seed(0)
+	origin = pd.Timestamp('2012-10-01 00:00:00')
+	times = pd.DatetimeIndex(origin + pd.to_timedelta(np.sort(np.random.choice(4000, 1500, replace = False)), unit = 's'))
+	values = np.random.randn(len(times))
+	values[np.random.rand(len(times)) < 0.1] = np.nan
+	for interval in [1., 5., 7.5, 60.]:
+		for start, end in [(origin, origin + pd.Timedelta(seconds = 3999)), (origin + pd.Timedelta(seconds = 123.4), origin + pd.Timedelta(seconds = 2000)), (origin + pd.Timedelta(seconds = 60), origin + pd.Timedelta(seconds = 60))]:
+			for agg, agg_name in [(np.mean, 'mean'), (np.min, 'min'), (np.max, 'max')]:
+				expected = range_join_aggregate(times, values, origin, interval, start, end, agg)
+				result = bucket_aggregate(times, values, origin, interval, start, end, agg_name)
+				assert np.allclose(expected, result, equal_nan = True)
+
+def test_bucket_edges():
+	# rows on bucket edges whose offset divided by the interval in floating point falls below the edge
+	origin = pd.Timestamp('2012-10-01 00:00:00')
+	times = pd.DatetimeIndex(origin + pd.to_timedelta(np.arange(100) * 100, unit = 'ms'))
+	values = np.arange(100, dtype = float)
+	assert np.floor(0.3 / 0.1) == 2
+	start, end = origin, origin + pd.Timedelta(seconds = 9.9)
+	expected = range_join_aggregate(times, values, origin, 0.1, start, end, np.mean)
+	assert np.array_equal(expected, values)
+	assert np.array_equal(bucket_aggregate(times, values, origin, 0.1, start, end, 'mean'), expected)
+	assert bucket_sql('"ts"', '"time"', ['"a"'], 'AVG', origin, 0.1).startswith('''select (extract(epoch from (m."time" - '2012-10-01 00:00:00.000000'::timestamp))*1000000)::bigint/100000 as bucket''')
+
+def test_fill_buckets():
+	rows = [[3, 1., 2.], [5, None, 4.]]
+	output = fill_buckets(rows, 2, 6, 2)
+	assert output.shape == (5, 2)
+	assert np.isnan(output[0]).all() and np.isnan(output[2]).all() and np.isnan(output[4]).all()
+	assert np.allclose(output[1], [1., 2.])
+	assert np.isnan(output[3, 0]) and output[3, 1] == 4.
+	assert np.allclose(fill_buckets(rows, 2, 6, 2, desc = True)[::-1], output, equal_nan = True)
+	assert fill_buckets([], 2, 1, 1).shape == (0, 1)
+
+def test_factor_rows_sql():
+	query, columns = factor_rows_sql(['pindex_u', 'pindex_variance_u'], 'u', [3, 1], 'tsrow = 2', order = 'row_id')
+	assert query.count('SELECT') == 2 and 'UNION ALL' in query
+	assert 'NULL::double precision as u2' in query and 'NULL::double precision as u3' in query
+	assert columns == ['table_no', 'modelno', 'u1', 'u2', 'u3']
+	rows = [[0, 1, 1., 2., 3.], [0, 2, 4., 5., 6.], [1, 1, 7., None, None]]
+	U, U_var = split_factor_rows(rows, [3, 1])
+	assert np.array_equal(U, [[1, 1, 2, 3], [2, 4, 5, 6]]) and np.array_equal(U_var, [[1, 7]])
+	assert split_factor_rows([], [3, 1])[1].shape == (0, 2)
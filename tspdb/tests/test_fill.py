@@ -0,0 +1,21 @@
+import numpy as np
+import pandas as pd
+from tspdb.src.tsUtils import ffill, bfill, zero_fill, fill_missing
+
+def test_fill_kernels_match_pandas():
+	np.random.seed(0)
+	values = np.random.randn(200, 3)
+	values[np.random.rand(200, 3) < 0.3] = np.nan
+	values[:5, 1] = np.nan
+	values[-4:, 2] = np.nan
+	df = pd.DataFrame(values)
+	assert np.allclose(ffill(values.copy()), df.ffill().values, equal_nan = True)
+	assert np.allclose(bfill(values.copy()), df.bfill().values, equal_nan = True)
+	assert np.allclose(zero_fill(values.copy()), df.fillna(0).values)
+	assert np.allclose(fill_missing(values.copy()), df.ffill().bfill().values)
+	# one dimensional arrays are filled in place
+	column = values[:, 1].copy()
+	fill_missing(column)
+	assert np.allclose(column, df[1].ffill().bfill().values)
+	# all missing
+	assert np.isnan(fill_missing(np.full(4, np.nan))).all()
@@ -0,0 +1,63 @@
+import numpy as np
+from tspdb.tests.pindex_fixtures import make_pindex
+from tspdb.src.pindex import predict
+
+def check_fused_matches_two_pass(direct_var):
+	interface, TSPD = make_pindex(direct_var)
+	L, k, k_var, T, last_model = TSPD.ts_model.L, TSPD.k, TSPD.k_var, TSPD.T, len(TSPD.ts_model.models) - 1
+	for t1, t2 in [(10, 20), (100, 900), (0, 2400), (2000, 2400)]:
+		for value_index, column in enumerate(['a', 'b']):
+			args = ('ts', column, 'time', interface, t1, t2)
+			mean = predict._get_imputation_range('tspdb.pindex', *args, L, k, T, last_model, value_index, 2)
+			var = predict._get_imputation_range('tspdb.pindex_variance', *args, L, k_var, T, last_model, value_index, 2)
+			fused = predict._get_imputation_range_uq('tspdb.pindex', *args, L, k, k_var, T, last_model, value_index, 2)
+			assert np.allclose(mean, fused[0]) and np.allclose(var, fused[1])
+			for t in [t1, t2]:
+				args = ('ts', column, 'time', interface, t)
+				mean = predict._get_imputation('tspdb.pindex', *args, L, k, T, last_model, 2, value_index)
+				var = predict._get_imputation('tspdb.pindex_variance', *args, L, k_var, T, last_model, 2, value_index)
+				assert np.allclose([mean, var], predict._get_imputation_uq('tspdb.pindex', *args, L, k, k_var, T, last_model, 2, value_index))
+	MUpdateIndex = TSPD.ts_model.MUpdateIndex
+	args = ('ts', 'b', 'time', interface, 2500, 2530)
+	mean = predict._get_forecast_range('tspdb.pindex', *args, MUpdateIndex, L, k, T, last_model, 1., 0, None, 2, 1)
+	second_moment = predict._get_forecast_range('tspdb.pindex_variance', *args, MUpdateIndex, L, k_var, T, last_model, 1., 0, None, 2, 1, variance = True)
+	fused = predict._get_forecast_range_uq('tspdb.pindex', *args, 1., 0, 2, 1)
+	assert np.allclose(mean, fused[0]) and np.allclose(second_moment, fused[1])
+
+def test_fused_matches_two_pass():
+	check_fused_matches_two_pass(False)
+
+def test_fused_matches_two_pass_direct_var():
+	check_fused_matches_two_pass(True)
+
+def test_fused_halves_queries(monkeypatch):
+	interface, TSPD = make_pindex(True)
+	interface.queries = []
+	prediction, interval = predict.get_prediction_range('tspdb.pindex', 'ts', 'a', interface, 100, 900)
+	fused_queries = len(interface.queries)
+	monkeypatch.setattr(predict, '_get_imputation_range_uq', lambda *args, **kwargs: None)
+	interface.queries = []
+	prediction_, interval_ = predict.get_prediction_range('tspdb.pindex', 'ts', 'a', interface, 100, 900)
+	assert np.allclose(prediction, prediction_) and np.allclose(interval, interval_)
+	# besides the routing and meta queries, the fused path needs at most half of the queries
+	assert 2 * (fused_queries - 2) <= len(interface.queries) - 2
+
+def test_confidence_level_checked():
+	interface, TSPD = make_pindex(False)
+	for c in [-1., 100.]:
+		for query in [lambda: predict.get_prediction('tspdb.pindex', 'ts', 'a', interface, 100, c = c), lambda: predict.get_prediction_range('tspdb.pindex', 'ts', 'a', interface, 100, 110, c = c)]:
+			try:
+				query()
+				assert False
+			except Exception as e:
+				assert 'confidence interval c' in str(e)
+
+def test_projected_without_projected_table():
+	interface, TSPD = make_pindex(False)
+	expected = [predict.get_prediction_range('tspdb.pindex', 'ts', 'a', interface, 4990, 5020, projected = True, uq = uq) for uq in [False, True]]
+	# pindices written before the projected coefficients were stored
+	for name in ['tspdb.pindex_c_projected', 'tspdb.pindex_variance_c_projected']:
+		interface.drop_table(name)
+	for uq, expected_ in zip([False, True], expected):
+		result = predict.get_prediction_range('tspdb.pindex', 'ts', 'a', interface, 4990, 5020, projected = True, uq = uq)
+		assert np.allclose(expected_, result)
@@ -0,0 +1,32 @@
+import numpy as np
+import multiprocessing
+from tspdb.src.pindex.group_pindex import cluster_columns, _fit_group
+
+def correlated_columns(n = 3000):
+	# two groups of three columns driven by independent random walks, interleaved
+	np.random.seed(0)
+	base = np.random.randn(n, 2).cumsum(0)
+	data = np.column_stack([base[:, i % 2] + 0.1*np.random.randn(n) for i in range(6)])
+	return data
+
+def test_cluster_columns():
+	data = correlated_columns()
+	assert list(cluster_columns(data, 2)) == [0, 1, 0, 1, 0, 1]
+	assert list(cluster_columns(data, 1)) == [0]*6
+	data[::7, 1] = np.nan
+	assert list(cluster_columns(data, 2)) == [0, 1, 0, 1, 0, 1]
+
+def test_fit_groups_in_worker_processes():
+	data = correlated_columns()
+	kwargs = dict(T = 1000, rank = 3, agg_interval = 1., start_time = 0, time_series_table_name = 'ts', time_column = 'time', schema = 'tspdb')
+	jobs = [(dict(kwargs, value_column = ['a', 'c', 'e'], index_name = 'ts_g0'), data[:, ::2]), (dict(kwargs, value_column = ['b', 'd', 'f'], index_name = 'ts_g1'), data[:, 1::2])]
+	with multiprocessing.get_context('fork').Pool(2) as pool:
+		fitted = pool.map(_fit_group, jobs)
+	sequential = [_fit_group(job) for job in jobs]
+	for TSPD, TSPD_seq in zip(fitted, sequential):
+		assert TSPD.no_ts == 3
+		assert TSPD.ts_model.MUpdateIndex == TSPD_seq.ts_model.MUpdateIndex
+		assert len(TSPD.ts_model.models) == len(TSPD_seq.ts_model.models)
+		last = len(TSPD.ts_model.models) - 1
+		assert np.allclose(TSPD.ts_model.models[last].weights, TSPD_seq.ts_model.models[last].weights)
+	assert [TSPD.index_name for TSPD in fitted] == ['tspdb.ts_g0', 'tspdb.ts_g1']
@@ -0,0 +1,12 @@
+import subprocess
+import sys
+
+def loaded_modules(module):
+	code = 'import sys\nimport %s\nprint(",".join(sorted(sys.modules)))' % module
+	return subprocess.check_output([sys.executable, '-c', code]).decode().strip().split(',')
+
+def test_predict_path_imports_only_numpy():
+	for module in ['tspdb.src.pindex.predict', 'tspdb.src.database_module.plpy_imp', 'tspdb.src.database_module.plpy_cache']:
+		modules = loaded_modules(module)
+		for heavy in ['pandas', 'scipy', 'sklearn', 'sqlalchemy']:
+			assert heavy not in modules, '%s imports %s' % (module, heavy)
@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+from tspdb.src.tslb.tslb import get_lower_bound, get_lower_bounds
+from tspdb.src.tslb.src.calibration import default_calibration
+
+def make_data():
+	np.random.seed(0)
+	t = np.arange(2001)
+	return pd.DataFrame({'periodic': np.sin(2*np.pi*t/20) + 0.01*np.random.randn(2001), 'walk': np.random.randn(2001).cumsum()},
+		index = pd.date_range('2020-01-01', periods = 2001, freq = 'h'))
+
+def test_single_window_matches_get_lower_bound():
+	data = make_data()
+	calibration = default_calibration()
+	for method in ['quantization', 'change']:
+		result = get_lower_bounds(data, 2000, samples = 100, k = 3, discretization_method = method, calibration = calibration)
+		assert list(result['column']) == ['periodic', 'walk']
+		if method == 'quantization':
+			for column in data.columns:
+				lb = get_lower_bound(data[column], samples = 100, k = 3, calibration = calibration)
+				assert np.isclose(result.loc[result['column'] == column, 'lower_bound'].iloc[0], lb)
+	assert len(calibration.new_entries) == 0
+
+def test_sliding_windows():
+	data = make_data()
+	data.iloc[150, 1] = np.nan
+	result = get_lower_bounds(data, 500, step = 250, samples = 100, k = 3)
+	assert len(result) == 2*7
+	walk = result[result['column'] == 'walk']
+	assert walk['window_start'].iloc[0] == data.index[1] and walk['window_end'].iloc[0] == data.index[500]
+	assert walk['window_start'].iloc[1] == data.index[251]
+	# the missing value makes the diffs at 149 and 150 missing
+	assert np.isnan(walk['lower_bound'].iloc[0]) and not np.isnan(walk['lower_bound'].iloc[-1])
+	periodic = result[result['column'] == 'periodic']
+	# the periodic series is more predictable than the random walk
+	assert periodic['lower_bound'].mean() < walk['lower_bound'].iloc[1:].mean()
+
+def test_default_samples_use_shipped_calibration():
+	data = make_data()
+	calibration = default_calibration()
+	# no regModel fit for the calibrated sizes
+	assert np.isclose(get_lower_bound(data['walk'], calibration = calibration), get_lower_bound(data['walk'], samples = 100, calibration = calibration))
+	assert len(calibration.new_entries) == 0
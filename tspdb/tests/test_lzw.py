@@ -0,0 +1,30 @@
+import numpy as np
+import time
+from tspdb.src.tslb.src.lzw import compress, get_string, lzw_code_count, lzw_compression_ratio
+
+def test_code_count_matches_compress():
+	np.random.seed(0)
+	for n in [2, 3, 5, 16, 17, 40]:
+		for size in [1, 2, 10, 1000, 5000]:
+			p = np.random.dirichlet(np.ones(n))
+			seq = list(np.random.choice(n, size, p = p))
+			assert lzw_code_count(seq) == len(compress(get_string(seq, n)))
+			assert lzw_compression_ratio(seq, n) == len(compress(get_string(seq, n)))/size
+	assert lzw_code_count([]) == 0
+
+def test_code_count_any_symbols():
+	seq = np.array([3.5, 3.5, -1., 3.5, -1., -1., 7.])
+	codes = np.unique(seq, return_inverse = True)[1]
+	assert lzw_code_count(seq) == len(compress(get_string(list(codes), 3)))
+
+if __name__ == '__main__':
+	# benchmark on a 10^6-length sequence
+	np.random.seed(0)
+	seq = list(np.random.choice(3, 10**6, p = [0.5, 0.3, 0.2]))
+	t = time.time()
+	count = lzw_code_count(seq)
+	t_count = time.time() - t
+	t = time.time()
+	uncompressed = get_string(seq, 3)
+	assert len(compress(uncompressed)) == count
+	print('lzw_code_count: %.2f s, get_string + compress: %.2f s' % (t_count, time.time() - t))
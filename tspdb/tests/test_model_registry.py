@@ -0,0 +1,31 @@
+import numpy as np
+from tspdb.src.prediction_models.ts_model_registry import ModelRegistry, updated_models, model_attribute
+from tspdb.src.prediction_models.ts_svd_model import SVDModel
+
+def model_rows(no_models, no_ts = 2):
+	# rows as stored in the model_name_m table
+	return [[i, 10, 50, i*250, 3, 1, [0.9]*no_ts, [0.8]*no_ts, [np.nan]*no_ts, [float(i)]*no_ts, [1.]*no_ts] for i in range(no_models)]
+
+def test_registry_materializes_on_access():
+	registry = ModelRegistry(model_rows(1000), 3, no_ts = 2)
+	assert len(registry) == 1000
+	assert len(registry.loaded()) == 0
+	model = registry[999]
+	assert isinstance(model, SVDModel)
+	assert model.start == 999*250 and model.N == 10 and model.M == 50
+	assert model.norm_mean == [999., 999.]
+	assert registry[999] is model
+	assert list(registry.loaded().keys()) == [999]
+	assert 1000 not in registry
+
+def test_registry_updates():
+	registry = ModelRegistry(model_rows(5), 3, no_ts = 2)
+	registry[4].updated = True
+	registry[4].imputation_model_score = [0.5, 0.5]
+	registry[5] = SVDModel('t1', 3, 10, 50, start = 1250, no_ts = 2, imputation_model_score = [0.7, 0.7], norm_mean = [0., 0.], norm_std = [1., 1.])
+	assert len(registry) == 6
+	assert sorted(updated_models(registry).keys()) == [4, 5]
+	scores = model_attribute(registry, 'imputation_model_score')
+	assert scores.shape == (6, 2)
+	assert np.allclose(scores[:, 0], [0.9, 0.9, 0.9, 0.9, 0.5, 0.7])
+	assert len(registry.loaded()) == 2
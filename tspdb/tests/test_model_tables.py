@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+from types import SimpleNamespace
+from tspdb.src.pindex.pindex_managment import build_model_tables, _array_str
+
+def loop_model_tables(models, k, no_ts, N, M):
+	# reference implementation: the row by row construction previously used in write_tsmm_model
+	last_model = max(models.keys())
+	first_model = min(models.keys())
+	U_table = np.zeros([(len(models) - 1) * N + models[last_model].N, 1 + 2*k])
+	for i, m in sorted(models.items()):
+		j = i - first_model
+		if i == last_model:
+			U_table[j * N:, 1:1 + k] = m.Uk
+			U_table[j * N:, 1 + k: 1 + 2*k] = np.concatenate((m.Ukw,np.zeros([1,k])))
+			U_table[j * N:, 0] = int(i)
+		else:
+			U_table[j * N:(j + 1) * N, 1:1 + k] = m.Uk
+			U_table[j * N:(j + 1) * N, 1 + k:1 + 2*k] =  np.concatenate((m.Ukw,np.zeros([1,k])))
+			U_table[j * N:(j + 1) * N, 0] = int(i)
+	V_table = np.zeros([(len(models) - 1) * M + models[last_model].M, 1 + 2*k])
+	for i, m in sorted(models.items()):
+		j = i - first_model
+		if i == last_model:
+			V_table[j * M:, 1:1 + k] = m.Vk
+			V_table[j * M:, 1 + k: 1+ 2*k] = m.Vkw
+			V_table[j * M:, 0] = int(i)
+		else:
+			V_table[j * M:(j + 1) * M, 1:1 + k] = m.Vk
+			V_table[j * M:(j + 1) * M, 1 + k: 1+ 2*k] = m.Vkw
+			V_table[j * M:(j + 1) * M, 0] = int(i)
+	s_table = np.zeros([len(models), 1 + 2*k])
+	for i, m in sorted(models.items()):
+		j = i - first_model
+		s_table[j, 1:k + 1] = m.sk
+		s_table[j, k + 1:k*2 + 1] = m.skw
+		s_table[j, 0] = int(i)
+	id_c = 0
+	w_f = N - 1
+	w_l = len(models[last_model].weights)
+	c_table = np.zeros([(len(models)) * (w_f+no_ts), 3])
+	for i,m in sorted(models.items()):
+		for ts in range(no_ts):
+			bias = (-m.weights.sum() +1)*m.norm_mean[ts]
+			c_table[id_c, :] = [i, -ts-1, bias]
+			id_c += 1
+		coeNu = 0
+		for weig in m.weights[::-1]:
+			c_table[id_c, :] = [i, coeNu, weig]
+			id_c += 1
+			coeNu += 1
+		if i == last_model:
+			for q in range(w_f-w_l):
+				c_table[id_c, :] = [i, coeNu, 0]
+				id_c += 1
+				coeNu += 1
+	m_table = np.zeros([len(models), 7 + 5], 'object')
+	for i, m in sorted(models.items()):
+		m_table[i - first_model, :] = [i, m.N, m.M, m.start, m.M * m.N, m.TimesUpdated, m.TimesReconstructed, _array_str(list(m.imputation_model_score)), _array_str(list(m.forecast_model_score)), _array_str(list(m.forecast_model_score_test)), _array_str(list(m.norm_mean)), _array_str(list(m.norm_std))]
+	return U_table, V_table, s_table, c_table, m_table
+
+def random_models(first_model, no_models, k, no_ts, N, M):
+	models = {}
+	for i in range(first_model, first_model + no_models):
+		no_weights = N - 1 if i < first_model + no_models - 1 else N - 3
+		models[i] = SimpleNamespace(N = N, M = M, start = i * N * M // 2, TimesUpdated = 2, TimesReconstructed = 1,
+			Uk = np.random.randn(N, k), Ukw = np.random.randn(N - 1, k), Vk = np.random.randn(M, k), Vkw = np.random.randn(M, k),
+			sk = np.random.rand(k), skw = np.random.rand(k), weights = np.random.randn(no_weights),
+			imputation_model_score = list(np.random.rand(no_ts)), forecast_model_score = list(np.random.rand(no_ts)),
+			forecast_model_score_test = [np.nan] * no_ts, norm_mean = list(np.random.randn(no_ts)), norm_std = list(np.random.rand(no_ts)))
+	return models
+
+def test_vectorized_tables_match_loops():
+	np.random.seed(0)
+	for first_model, no_models, k, no_ts in [(0, 1, 3, 1), (0, 5, 3, 2), (7, 4, 5, 3)]:
+		N, M = 12, 30 * no_ts
+		models = random_models(first_model, no_models, k, no_ts, N, M)
+		udf, vdf, sdf, cdf, mdf = build_model_tables(models, k, no_ts, N, M)
+		U_table, V_table, s_table, c_table, m_table = loop_model_tables(models, k, no_ts, N, M)
+		assert np.array_equal(udf.values[:, :-1], U_table)
+		assert np.array_equal(udf.index, np.arange(first_model * N, first_model * N + len(U_table)))
+		assert np.array_equal(vdf.values[:, :-2], V_table)
+		assert np.array_equal(sdf.values, s_table)
+		assert np.array_equal(cdf.values, c_table)
+		assert np.array_equal(cdf.index, np.arange(first_model * (N - 1 + no_ts), first_model * (N - 1 + no_ts) + len(c_table)))
+		assert mdf.values.tolist() == m_table.tolist()
@@ -0,0 +1,40 @@
+import numpy as np
+from tspdb.tests.pindex_fixtures import make_tspi
+
+def check_var_model(direct_var):
+	np.random.seed(0)
+	data = np.random.randn(2500, 2).cumsum(0)
+	TSPD = make_tspi(direct_var = direct_var)
+	TSPD.update_model(data[:2000], wait = False)
+	TSPD.update_model(data[2000:], wait = False)
+	TSPD.wait_var_model()
+	# reference: the variance model fitted sequentially after the mean model
+	reference = make_tspi(direct_var = direct_var)
+	reference.ts_model.update_model(data)
+	if direct_var:
+		means = reference.ts_model._denoiseTS()[:reference.ts_model.MUpdateIndex//2]
+		reference.var_model.update_model(np.square(data[:len(means)] - means))
+	else:
+		reference.var_model.update_model(np.square(data[:2000]))
+		reference.var_model.update_model(np.square(data[2000:]))
+	assert TSPD.var_model.TimeSeriesIndex == reference.var_model.TimeSeriesIndex
+	assert sorted(TSPD.var_model.models.keys()) == sorted(reference.var_model.models.keys())
+	last = max(TSPD.var_model.models.keys())
+	assert np.allclose(TSPD.var_model.models[last].weights, reference.var_model.models[last].weights)
+
+def test_var_model_fitted_concurrently():
+	check_var_model(False)
+
+def test_var_model_fitted_after_mean_model():
+	check_var_model(True)
+
+def test_var_model_errors_are_raised():
+	TSPD = make_tspi()
+	TSPD._fit_var_model(np.ones([10, 3]))
+	try:
+		TSPD.wait_var_model()
+	except AssertionError:
+		pass
+	else:
+		raise AssertionError('the variance model error was not raised')
+	assert TSPD._var_fit is None
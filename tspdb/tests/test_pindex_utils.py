@@ -0,0 +1,124 @@
+import warnings
+import numpy as np
+import pandas as pd
+from tspdb.src.pindex.pindex_utils import coefficient_window_models, update_coefficient_window_sums, query_meta, OPTIONAL_META_COLUMNS, resolve_index
+from tspdb.src.pindex.pindex_managment import load_pindex_u, delete_pindex
+from tspdb.tests.memory_interface import MemoryInterface
+from tspdb.src.pindex.predict import get_prediction_range
+from tspdb.tests.pindex_fixtures import make_pindex, update_pindex, baseline_coefficient_view
+
+def window_averages(coeffs, last, windows):
+	# reference implementation of the coefficient averages view
+	rows = [np.mean([coeffs[m] for m in range(last + 1)], 0)]
+	for w in windows:
+		rows.append(np.mean([coeffs[m] for m in range(max(last - w + 1, 0), last + 1)], 0))
+	return np.array(rows)
+
+def test_incremental_window_sums():
+	np.random.seed(0)
+	windows = [1, 2, 10, 20, 100]
+	no_coeff = 7
+	stored = {}
+	sums, counts = np.zeros([len(windows) + 1, no_coeff]), np.zeros(len(windows) + 1)
+	last = -1
+	# each step rewrites the last model and appends a random number of new ones
+	for step in range(60):
+		new_last = last + np.random.randint(0, 4)
+		if new_last < 0: continue
+		updated = range(max(last, 0), new_last + 1)
+		new_coeffs = {m: np.random.randn(no_coeff) for m in updated}
+		models = coefficient_window_models(updated, last, new_last, windows)
+		old_coeffs = {m: stored[m] for m in models if m <= last}
+		sums, counts = update_coefficient_window_sums(sums, counts, old_coeffs, new_coeffs, last, new_last, windows)
+		stored.update(new_coeffs)
+		last = new_last
+		assert np.allclose(sums / counts[:, None], window_averages(stored, last, windows))
+
+def test_meta_without_optional_columns():
+	interface, TSPD = make_pindex(False)
+	expected = get_prediction_range('tspdb.pindex', 'ts', 'a', interface, 100, 5010)
+	# a pindex created before the optional columns were added to the _meta table
+	interface.tables['tspdb.pindex_meta'] = interface.tables['tspdb.pindex_meta'].drop(columns = list(OPTIONAL_META_COLUMNS))
+	assert query_meta(interface, 'tspdb.pindex', ['k', 'svd_method', 'materialized', 'L']) == [3, 'numpy', False, TSPD.ts_model.L]
+	result = get_prediction_range('tspdb.pindex', 'ts', 'a', interface, 100, 5010)
+	assert np.allclose(expected[0], result[0]) and np.allclose(expected[1], result[1])
+	t = np.arange(5000, 5020)
+	interface.bulk_insert('ts', pd.DataFrame({'time': t, 'a': np.zeros(20), 'b': np.zeros(20)}), include_index = False)
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore')
+		assert load_pindex_u(interface, 'tspdb.pindex') is False
+		t = np.arange(5020, 5500)
+		interface.bulk_insert('ts', pd.DataFrame({'time': t, 'a': np.sin(t/8), 'b': np.cos(t/5)}), include_index = False)
+		TSPD = load_pindex_u(interface, 'tspdb.pindex')
+		assert TSPD.svd_method == 'numpy' and TSPD.model_type == 'svd' and not TSPD.materialize_denoised
+
+def test_meta_null_svd_method():
+	interface, TSPD = make_pindex(False)
+	interface.tables['tspdb.pindex_meta']['svd_method'] = None
+	interface.tables['tspdb.pindex_meta']['model_type'] = None
+	t = np.arange(5000, 5500)
+	interface.bulk_insert('ts', pd.DataFrame({'time': t, 'a': np.sin(t/8), 'b': np.cos(t/5)}), include_index = False)
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore')
+		TSPD = load_pindex_u(interface, 'tspdb.pindex')
+	assert TSPD.svd_method == 'numpy' and TSPD.model_type == 'svd'
+	assert TSPD.ts_model.svd_method == 'numpy' and TSPD.var_model.svd_method == 'numpy'
+
+class OldCatalogInterface(MemoryInterface):
+	# a database whose tspdb catalog predates column-group pindices
+	def query_table(self, table_name, columns_queried = [], predicate = ''):
+		if table_name == 'tspdb.pindices_groups':
+			raise Exception('relation "tspdb.pindices_groups" does not exist')
+		return MemoryInterface.query_table(self, table_name, columns_queried, predicate)
+
+	def delete(self, table_name, predicate):
+		if table_name == 'tspdb.pindices_groups':
+			raise Exception('relation "tspdb.pindices_groups" does not exist')
+		MemoryInterface.delete(self, table_name, predicate)
+
+def test_resolve_index_cached():
+	interface = MemoryInterface()
+	interface.create_table('tspdb.pindices_groups', pd.DataFrame({'index_name': ['group'], 'value_column': ['a'], 'group_index': ['group_g0']}), include_index = False)
+	for i in range(3):
+		assert resolve_index(interface, 'tspdb.pindex', 'a') == 'tspdb.pindex'
+		assert resolve_index(interface, 'tspdb.group', 'a') == 'tspdb.group_g0'
+	assert interface.queries.count(('query_table', 'tspdb.pindices_groups')) == 2
+	# deleting a pindex clears the routes
+	delete_pindex(interface, 'group')
+	assert resolve_index(interface, 'tspdb.group', 'a') == 'tspdb.group'
+
+def test_routes_changed_by_another_session():
+	interface, TSPD = make_pindex(False)
+	interface.create_table('tspdb.pindices_groups', pd.DataFrame({'index_name': ['group'], 'value_column': ['a'], 'group_index': ['pindex']}), include_index = False)
+	expected = get_prediction_range('tspdb.group', 'ts', 'a', interface, 100, 200, uq = False)
+	# another session moves the column to a new group pindex and deletes the cached one
+	other = MemoryInterface()
+	other.tables = interface.tables
+	for name in [name for name in list(other.tables) if name.startswith('tspdb.pindex_')]:
+		other.tables[name.replace('tspdb.pindex_', 'tspdb.regrouped_')] = other.tables[name].copy()
+	other.tables['tspdb.pindices_groups'] = pd.DataFrame({'index_name': ['group'], 'value_column': ['a'], 'group_index': ['regrouped']})
+	delete_pindex(other, 'pindex')
+	assert resolve_index(interface, 'tspdb.group', 'a') == 'tspdb.pindex'
+	assert np.allclose(get_prediction_range('tspdb.group', 'ts', 'a', interface, 100, 200, uq = False), expected)
+	assert resolve_index(interface, 'tspdb.group', 'a') == 'tspdb.regrouped'
+
+def test_old_catalog():
+	interface, TSPD = make_pindex(False)
+	old = OldCatalogInterface()
+	old.tables = interface.tables
+	assert resolve_index(old, 'tspdb.pindex', 'a') == 'tspdb.pindex'
+	assert len(get_prediction_range('tspdb.pindex', 'ts', 'a', old, 100, 200, uq = False)) == 101
+	delete_pindex(old, 'pindex')
+	assert 'tspdb.pindex_meta' not in old.tables and 'tspdb.pindex_u' not in old.tables
+
+def test_update_baseline_coefficient_view():
+	interface, _ = make_pindex(False)
+	baseline, _ = make_pindex(False)
+	baseline_coefficient_view(baseline)
+	update_pindex(interface)
+	update_pindex(baseline)
+	assert any(query == 'DROP MATERIALIZED VIEW IF EXISTS tspdb.pindex_c_view' for query in baseline.queries)
+	for name in ['tspdb.pindex_c_view', 'tspdb.pindex_variance_c_view']:
+		expected, result = interface.tables[name].sort_values('coeffpos'), baseline.tables[name].sort_values('coeffpos')
+		assert list(expected.columns) == list(result.columns)
+		assert np.allclose(expected.values.astype(float), result.values.astype(float), equal_nan = True)
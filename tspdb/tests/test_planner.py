@@ -0,0 +1,66 @@
+import warnings
+import numpy as np
+import pandas as pd
+import pytest
+from tspdb.tests.memory_interface import MemoryInterface
+from tspdb.src.algorithms.svdWrapper import SVDWrapper
+from tspdb.src.pindex.planner import parse_memory, estimate_memory, plan_pindex
+from tspdb.src.pindex.pindex_managment import TSPI
+
+def test_parse_memory():
+	assert parse_memory('512MB') == 512*2**20 and parse_memory('2 gb') == 2*2**30 and parse_memory(1000) == 1000
+	with pytest.raises(Exception):
+		parse_memory('2 parsecs')
+
+def test_gram_svd_matches_numpy():
+	np.random.seed(0)
+	for shape in [(20, 200), (200, 20)]:
+		matrix = np.dot(np.random.randn(shape[0], 3), np.random.randn(3, shape[1])) + 0.01*np.random.randn(*shape)
+		sk, Uk, Vk = SVDWrapper(matrix, method = 'numpy').reconstructMatrix(3)
+		sk_, Uk_, Vk_ = SVDWrapper(matrix, method = 'gram').reconstructMatrix(3)
+		assert np.allclose(sk, sk_)
+		assert np.allclose(np.dot(Uk * sk, Vk.T), np.dot(Uk_ * sk_, Vk_.T))
+		assert SVDWrapper(matrix, method = 'numpy').decompose() == SVDWrapper(matrix, method = 'gram').decompose()
+
+def test_estimate_memory():
+	numpy = estimate_memory(10**6, 4, 10**6, 316, k = 5)
+	gram = estimate_memory(10**6, 4, 10**6, 316, k = 5, svd_method = 'gram')
+	assert numpy['total'] == sum(value for name, value in numpy.items() if name != 'total')
+	assert gram['svd_workspace'] < numpy['svd_workspace'] and gram['series'] == numpy['series']
+	# the rank is counted as its worst case if it is estimated
+	assert estimate_memory(10**6, 4, 10**6, 316)['sub_models'] > numpy['sub_models']
+
+def test_plan_pindex():
+	plan = plan_pindex(10**5, 2, '1GB', 10**5, k = 3)
+	assert plan['T'] <= 10**5 and plan['k'] == 3
+	assert plan['svd_method'] == 'numpy' and plan['estimate']['total'] <= 2**30
+	# a tighter budget switches to the gram SVD, or reduces T if the SVD method is fixed
+	full = plan['estimate']['total']
+	gram = plan_pindex(10**5, 2, full - 1, 10**5, k = 3)
+	assert gram['T'] == plan['T'] and gram['svd_method'] == 'gram'
+	smaller = plan_pindex(10**5, 2, full - 1, 10**5, k = 3, svd_method = 'numpy')
+	assert smaller['T'] < plan['T'] and smaller['estimate']['total'] < full
+	with pytest.raises(Exception) as error:
+		plan_pindex(10**5, 2, '1MB', 10**5, k = 3)
+	assert 'memory_budget' in str(error.value) and 'series' in str(error.value)
+	# the requested L does not fit in T
+	with pytest.raises(Exception) as error:
+		plan_pindex(10**6, 1, '1GB', T = 1000, L = 1000)
+	assert 'T >= 2*L*no_ts = 2000' in str(error.value)
+
+def test_tspi_memory_budget():
+	np.random.seed(0)
+	t = np.arange(5000)
+	df = pd.DataFrame({'time': t, 'a': np.sin(2*np.pi*t/50) + 0.1*np.random.randn(5000)})
+	interface = MemoryInterface()
+	interface.create_table('ts', df, include_index = False)
+	budget = plan_pindex(5000, 1, '1GB', 2000, k = 3)['estimate']['total']
+	TSPD = TSPI(interface = interface, rank = 3, T = 10**5, time_series_table_name = 'ts', time_column = 'time', value_column = ['a'],
+		index_name = 'pindex', agg_interval = 1., start_time = 0, memory_budget = budget)
+	assert TSPD.plan['estimate']['total'] <= budget and TSPD.T < 10**5
+	# no data is read by the planner
+	assert ('get_time_series', 'ts') not in interface.queries
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore')
+		TSPD.create_index()
+	assert interface.query_table('tspdb.pindex_meta', ['svd_method', 'T']) == [[TSPD.svd_method, TSPD.T]]
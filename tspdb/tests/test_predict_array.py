@@ -0,0 +1,43 @@
+import io
+import contextlib
+import warnings
+import numpy as np
+import pandas as pd
+from tspdb.src.prediction_models.ts_meta_model import TSMM
+
+def fit_model():
+	np.random.seed(2)
+	t = np.arange(6000)
+	data = (np.sin(t/25) + 0.001*t + 0.2*np.random.randn(len(t)))[:, None]
+	model = TSMM(3, 2000, 0.5, 100, col_to_row_ratio = 5)
+	with warnings.catch_warnings(), contextlib.redirect_stdout(io.StringIO()):
+		warnings.simplefilter('ignore')
+		model.update_model(data.copy())
+	return model, data[:, 0]
+
+def test_predict_array():
+	model, series = fit_model()
+	sub_models = [model.models[i] for i in sorted(model.models)]
+	window = series[-model.L + 1:]
+	for sub_model in sub_models:
+		# the DataFrame path of SVDModel.predict
+		expected = sub_model.predict(pd.DataFrame(data={}), pd.DataFrame(data={'t1': window}))
+		assert np.isclose(sub_model.predict_array(window), expected)
+	expected = np.mean([sub_model.predict(pd.DataFrame(data={}), pd.DataFrame(data={'t1': window})) for sub_model in sub_models])
+	assert np.isclose(model.predict_array(window), expected)
+	assert np.isclose(model._predict(dataPoints = window), expected)
+	# the most recent sub-model only
+	assert np.isclose(model.predict_array(window, NoModels = 1), sub_models[-1].predict_array(window))
+
+def test_predict_windows():
+	model, series = fit_model()
+	windows = np.lib.stride_tricks.sliding_window_view(series, model.L - 1)[::37]
+	forecasts = model.predict_windows(windows)
+	assert forecasts.shape == (len(windows),)
+	assert np.allclose(forecasts, [model.predict_array(window) for window in windows])
+	sub_model = model.models[0]
+	assert np.allclose(sub_model.predict_windows(windows), [sub_model.predict_array(window) for window in windows])
+	# the averaged weights are recomputed once the sub-models change
+	cached = model._average_weights(model.models.values())
+	model.update_model(series[:1000, None].copy())
+	assert model._average_weights(model.models.values()) is not cached
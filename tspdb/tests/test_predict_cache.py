@@ -0,0 +1,153 @@
+import re
+import warnings
+import numpy as np
+import pandas as pd
+from tspdb.tests.pindex_fixtures import make_pindex
+from tspdb.src.pindex.pindex_managment import load_pindex_u
+from tspdb.src.pindex.predict import get_prediction_range
+from tspdb.src.database_module.predict_cache import PredictCache, cached_prediction_range, configure, get_cache, FLUSH_EVERY
+
+class FakePlpy(object):
+	# answers the queries of predict_cache from dictionaries
+	def __init__(self):
+		self.versions = {}
+		self.stats = {}
+		self.shared = {}
+
+	def prepare(self, query, types):
+		return query
+
+	def execute(self, query, args = None):
+		if 'pindices_versions' in query:
+			return [{'version': self.versions.get(args[0], 0)}]
+		if 'predict_cache_stats' in query:
+			stats = self.stats.setdefault((args[0], args[1]), [0, 0, 0.])
+			for i in range(3):
+				stats[i] += args[2 + i]
+			return []
+		if query.startswith('select'):
+			row = self.shared.get(args[0])
+			if row is None or row['version'] != args[1]:
+				return []
+			return [row]
+		self.shared[args[0]] = {'version': args[1], 'prediction': args[2], 'interval': args[3], 'seconds': args[4]}
+		return []
+
+class FakePredict(object):
+	def __init__(self):
+		self.calls = 0
+
+	def __call__(self, index_name, table_name, value_column, interface, t1, t2, uq = True, uq_method = 'Gaussian', c = 95., projected = False):
+		self.calls += 1
+		prediction = np.arange(t1, t2 + 1, dtype = float)
+		if uq:
+			return prediction, np.ones(len(prediction))*c/100
+		return prediction
+
+def test_lru_eviction():
+	cache = PredictCache(max_values = 10)
+	cache.put('a', 1, np.zeros(4), 1.)
+	cache.put('b', 1, (np.zeros(2), np.zeros(2)), 1.)
+	assert cache.get('a', 1) is not None
+	cache.put('c', 1, np.zeros(4), 1.)
+	# 'b' is the least recently used entry
+	assert cache.get('b', 1) is None and cache.get('a', 1) is not None and cache.get('c', 1) is not None
+	assert cache.no_values == 8
+	# larger than the cache
+	cache.put('d', 1, np.zeros(11), 1.)
+	assert cache.get('d', 1) is None and cache.no_values == 8
+	# older version
+	assert cache.get('a', 2) is None and cache.no_values == 4
+
+def test_cached_prediction_range():
+	interface, TSPD = make_pindex(False)
+	GD, plpy, predict = {}, FakePlpy(), FakePredict()
+	# imputed range, stamped with the pindex version only
+	args = ('tspdb.pindex', 'ts', 'a', 10, 20)
+	prediction, interval = cached_prediction_range(GD, plpy, predict, interface, *args, uq = True, c = 90.)
+	prediction_, interval_ = cached_prediction_range(GD, plpy, predict, interface, *args, uq = True, c = 90.)
+	assert predict.calls == 1
+	assert np.array_equal(prediction, prediction_) and np.array_equal(interval, interval_)
+	# different arguments are different entries
+	assert np.array_equal(cached_prediction_range(GD, plpy, predict, interface, *args, uq = False), prediction)
+	cached_prediction_range(GD, plpy, predict, interface, *args, uq = True, c = 95.)
+	cached_prediction_range(GD, plpy, predict, interface, 'tspdb.pindex', 'ts_copy', 'a', 10, 20, uq = True, c = 95.)
+	assert predict.calls == 4
+	# update_pindex bumps the version
+	plpy.versions['pindex'] = 1
+	cached_prediction_range(GD, plpy, predict, interface, *args, uq = False)
+	assert predict.calls == 5
+	stats = get_cache(GD).stats[('tspdb.pindex', 'a')]
+	assert stats[:2] == [1, 5]
+
+def test_shared_cache_and_stats():
+	interface, TSPD = make_pindex(False)
+	plpy, predict = FakePlpy(), FakePredict()
+	GD1, GD2 = {}, {}
+	configure(GD1, shared = True)
+	configure(GD2, max_values = 100, shared = True)
+	args = ('tspdb.pindex', 'ts', 'a', 0, 9)
+	prediction, interval = cached_prediction_range(GD1, plpy, predict, interface, *args)
+	prediction_, interval_ = cached_prediction_range(GD2, plpy, predict, interface, *args)
+	assert predict.calls == 1
+	assert np.array_equal(prediction, prediction_) and np.array_equal(interval, interval_)
+	for i in range(FLUSH_EVERY - 1):
+		cached_prediction_range(GD2, plpy, predict, interface, *args)
+	assert plpy.stats[('pindex', 'a')][:2] == [FLUSH_EVERY, 0]
+	assert get_cache(GD2).stats == {}
+
+class InterfacePlpy(FakePlpy):
+	# reads the pindex versions and the time series tables written to a MemoryInterface
+	def __init__(self, interface):
+		FakePlpy.__init__(self)
+		self.interface = interface
+
+	def execute(self, query, args = None):
+		if 'pindices_versions' in query:
+			versions = self.interface.tables.get('tspdb.pindices_versions', pd.DataFrame({'index_name': [], 'version': []}))
+			return [{'version': int(versions.loc[versions['index_name'] == args[0], 'version'].max() if args[0] in list(versions['index_name']) else 0)}]
+		stamp = re.search(r'from "(\w+)" as tspdb_row where tspdb_row."(\w+)" >= (\S+)', query)
+		if stamp is not None:
+			table, column = self.interface.tables[stamp.group(1)], stamp.group(2)
+			rows = table[table[column] >= int(stamp.group(3))]
+			return [{'count': len(rows), 'last': str(rows[column].max()), 'checksum': int(pd.util.hash_pandas_object(rows, index = False).sum())}]
+		return FakePlpy.execute(self, query, args)
+
+def test_small_insert_invalidates_forecasts():
+	interface, TSPD = make_pindex(False)
+	GD, plpy = {}, InterfacePlpy(interface)
+	args = ('tspdb.pindex', 'ts', 'a', 5010, 5030)
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore')
+		forecast = cached_prediction_range(GD, plpy, get_prediction_range, interface, *args, uq = False)
+		# fewer than 5 L new points: the model is not updated, but the forecasts use the new points
+		t = np.arange(5000, 5020)
+		interface.bulk_insert('ts', pd.DataFrame({'time': t, 'a': 5 + np.zeros(20), 'b': np.zeros(20)}), include_index = False)
+		assert load_pindex_u(interface, 'tspdb.pindex') is False
+		forecast_ = cached_prediction_range(GD, plpy, get_prediction_range, interface, *args, uq = False)
+	assert not np.allclose(forecast, forecast_)
+	assert np.allclose(forecast_, get_prediction_range(*args[:3], interface, *args[3:], uq = False))
+
+def test_unversioned_changes_invalidate_forecasts():
+	interface, TSPD = make_pindex(False)
+	GD, plpy = {}, InterfacePlpy(interface)
+	args = ('tspdb.pindex', 'ts', 'a', 5010, 5030)
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore')
+		forecast = cached_prediction_range(GD, plpy, get_prediction_range, interface, *args, uq = False)
+		imputation = cached_prediction_range(GD, plpy, get_prediction_range, interface, 'tspdb.pindex', 'ts', 'a', 4000, 4010, uq = False)
+		# rows inserted without an insert trigger (auto_update => false), the version is not bumped
+		t = np.arange(5000, 5020)
+		interface.bulk_insert('ts', pd.DataFrame({'time': t, 'a': 5 + np.zeros(20), 'b': np.zeros(20)}), include_index = False)
+		inserted = cached_prediction_range(GD, plpy, get_prediction_range, interface, *args, uq = False)
+		assert not np.allclose(forecast, inserted)
+		assert np.allclose(inserted, get_prediction_range(*args[:3], interface, *args[3:], uq = False))
+		# an updated row
+		table = interface.tables['ts']
+		table.loc[table['time'] == 5005, 'a'] = 10.
+		updated = cached_prediction_range(GD, plpy, get_prediction_range, interface, *args, uq = False)
+		assert not np.allclose(inserted, updated)
+		assert np.allclose(updated, get_prediction_range(*args[:3], interface, *args[3:], uq = False))
+		# imputed ranges only depend on the models
+		assert np.array_equal(imputation, cached_prediction_range(GD, plpy, get_prediction_range, interface, 'tspdb.pindex', 'ts', 'a', 4000, 4010, uq = False))
+	assert get_cache(GD).stats[('tspdb.pindex', 'a')][:2] == [1, 4]
@@ -0,0 +1,56 @@
+import warnings
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from tspdb.tests.pindex_fixtures import make_pindex
+from tspdb.src.pindex.snapshot import export_pindex
+from tspdb.src.pindex.reader import PindexReader
+from tspdb.src.pindex import predict
+
+def make_reader(tmp_path, direct_var):
+	interface, TSPD = make_pindex(direct_var)
+	path = str(tmp_path / 'pindex')
+	export_pindex(interface, 'tspdb.pindex', path)
+	ts = interface.tables['ts']
+	return interface, PindexReader(path, observations = {column: ts[column].values for column in ['a', 'b']})
+
+def check_reader(tmp_path, direct_var):
+	interface, reader = make_reader(tmp_path, direct_var)
+	# imputed, forecasted one step ahead from observations and forecasted beyond the observations
+	times = [0, 250, 777, 2499, 2500, 3999, 4999, 5000, 5010]
+	columns = ['a', 'b'] * len(times)
+	times = np.repeat(times, 2)
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore')
+		expected = np.array([predict.get_prediction('tspdb.pindex', 'ts', column, interface, t) for column, t in zip(columns, times)])
+		prediction, deviation = reader.get_predictions(columns, times)
+		assert np.allclose(expected[:, 0], prediction) and np.allclose(expected[:, 1], deviation)
+		assert np.allclose(expected[:, 0], reader.get_predictions(columns, times, uq = False))
+		assert np.allclose(expected[0], reader.get_prediction('a', 0))
+		for t1, t2 in [(10, 20), (100, 900), (0, 2400), (4990, 5020), (5000, 5030)]:
+			expected = predict.get_prediction_range('tspdb.pindex', 'ts', 'b', interface, t1, t2, uq_method = 'Chebyshev', c = 90.)
+			result = reader.get_prediction_range('b', t1, t2, uq_method = 'Chebyshev', c = 90.)
+			assert np.allclose(expected[0], result[0]) and np.allclose(expected[1], result[1])
+		assert np.allclose(reader.forecast_next('a', 'average', 5), predict.get_prediction_range('tspdb.pindex', 'ts', 'a', interface, 5000, 5004, uq = False))
+
+def test_reader_matches_database(tmp_path):
+	check_reader(tmp_path, False)
+
+def test_reader_matches_database_direct_var(tmp_path):
+	check_reader(tmp_path, True)
+
+def test_reader_thread_pool(tmp_path):
+	interface, reader = make_reader(tmp_path, False)
+	batches = [np.arange(i, 6000, 97) for i in range(8)]
+	with ThreadPoolExecutor(4) as pool:
+		results = list(pool.map(lambda times: reader.get_predictions('a', times), batches))
+	for times, (prediction, deviation) in zip(batches, results):
+		expected = [reader.get_prediction('a', t) for t in times[::10]]
+		assert np.allclose(expected, np.array([prediction[::10], deviation[::10]]).T)
+	# forecasting needs the observations
+	reader = PindexReader(reader.snapshot)
+	assert np.isfinite(reader.get_prediction('a', 100, uq = False))
+	try:
+		reader.get_prediction('a', 5100)
+		assert False
+	except Exception as e:
+		assert 'observations of a' in str(e)
@@ -0,0 +1,35 @@
+import numpy as np
+import time
+from tspdb.src.tslb.src.regModel import regModel, slope_interval
+
+def test_samples_do_not_depend_on_workers():
+	serial = regModel(3, 500, 45, workers = 1, seed = 7)
+	serial.fit()
+	parallel = regModel(3, 500, 45, workers = 3, seed = 7)
+	parallel.fit()
+	assert serial.samples_used == parallel.samples_used == 45
+	assert serial.ratio == parallel.ratio and serial.entropy == parallel.entropy
+	assert np.isclose(serial.get_entropy(0.5), parallel.get_entropy(0.5))
+
+def test_global_seed():
+	models = []
+	for i in range(2):
+		np.random.seed(0)
+		models.append(regModel(2, 200, 20))
+		models[-1].fit()
+	assert models[0].ratio == models[1].ratio
+
+def test_adaptive_stop():
+	model = regModel(3, 500, 500, workers = 2, seed = 0, tol = 0.05)
+	model.fit()
+	assert model.samples_used < 500
+	slope, half_width = slope_interval(model.ratio, model.entropy)
+	assert half_width <= 0.05*abs(slope)
+	assert np.isclose(slope, model.reg_inv.coef_[0])
+
+if __name__ == '__main__':
+	# benchmark the calibration of a 10000-length sequence
+	for workers in [1, 4]:
+		t = time.time()
+		regModel(3, 10000, 100, workers = workers, seed = 0).fit()
+		print('workers = %s: %.2f s' % (workers, time.time() - t))
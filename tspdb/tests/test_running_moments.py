@@ -0,0 +1,41 @@
+import io
+import contextlib
+import warnings
+import numpy as np
+from sklearn.preprocessing import StandardScaler
+from tspdb.src.tsUtils import RunningMoments
+from tspdb.src.prediction_models.ts_meta_model import TSMM
+
+def test_add_and_remove_blocks():
+	np.random.seed(0)
+	values = np.random.randn(1000, 3) * [1., 10., 0.1] + [0., 100., -5.]
+	values[np.random.rand(1000, 3) < 0.1] = np.nan
+	moments = RunningMoments.from_array(values[:300])
+	for i in range(300, 1000, 70):
+		moments.add(RunningMoments.from_array(values[i:i + 70]))
+	moments.remove(RunningMoments.from_array(values[:450]))
+	scaler = StandardScaler().fit(values[450:])
+	assert np.allclose(moments.mean, scaler.mean_) and np.allclose(moments.std(), scaler.scale_)
+	assert np.array_equal(moments.count, (~np.isnan(values[450:])).sum(0))
+	# constant columns are not scaled
+	assert np.array_equal(RunningMoments.from_array(np.ones([10, 2])).std(), [1., 1.])
+
+def test_sub_model_normalization():
+	np.random.seed(1)
+	t = np.arange(12000)
+	data = np.column_stack([np.sin(t/30) + 0.002*t + 0.3*np.random.randn(len(t)), 5 + np.cos(t/20)*(1 + t/5000) + 0.3*np.random.randn(len(t))])
+	data[np.random.rand(*data.shape) < 0.05] = np.nan
+	model = TSMM(3, 2000, 0.5, 100, col_to_row_ratio = 5, no_ts = 2)
+	with warnings.catch_warnings(), contextlib.redirect_stdout(io.StringIO()):
+		warnings.simplefilter('ignore')
+		model.update_model(data[:3000].copy())
+		for i in range(3000, len(t), 700):
+			model.update_model(data[i:i + 700].copy())
+	# each sub-model is normalized with the moments of the rows it was fitted on, as StandardScaler would
+	for sub_model in model.models.values():
+		first = sub_model.start//2
+		window = data[first:first + sub_model.N*sub_model.M//2]
+		scaler = StandardScaler().fit(window)
+		assert np.allclose(sub_model.norm_mean, scaler.mean_) and np.allclose(sub_model.norm_std, scaler.scale_)
+	# the running moments follow the buffer of the last observations
+	assert np.allclose(model.moments.mean, np.nanmean(model.TimeSeries, 0))
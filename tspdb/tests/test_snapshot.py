@@ -0,0 +1,63 @@
+import warnings
+import numpy as np
+from tspdb.tests.memory_interface import MemoryInterface
+from tspdb.tests.pindex_fixtures import make_pindex, baseline_coefficient_view
+from tspdb.src.pindex.snapshot import export_pindex, load_snapshot, import_pindex
+from tspdb.src.pindex import predict
+
+def check_round_trip(path):
+	interface, TSPD = make_pindex(False)
+	manifest = export_pindex(interface, 'tspdb.pindex', path)
+	assert set(manifest['tables']) == set(prefix + suffix for prefix in ['', 'variance_'] for suffix in ['u', 'v', 's', 'c', 'm', 'c_view', 'c_projected'])
+	snapshot = load_snapshot(path)
+	assert snapshot.index_name == 'tspdb.pindex' and snapshot.meta['k'] == 3 and snapshot.meta['indexed_column'] == 'a,b'
+	for name in ['u', 'variance_v', 's', 'c', 'c_view']:
+		assert isinstance(snapshot.tables[name], np.memmap)
+		table = interface.tables['tspdb.pindex_' + name]
+		key = 'coeffpos' if name.startswith('c_') else ('modelno' if name == 's' else 'row_id')
+		table = table.sort_values(key, ascending = not name.startswith('c_'))
+		for column in table.columns:
+			assert np.allclose(snapshot.column(name, column), table[column].values.astype(float), equal_nan = True)
+	models = interface.tables['tspdb.pindex_m'].sort_values('modelno')
+	assert np.allclose(snapshot.column('m', 'norm_mean'), np.vstack(models['norm_mean'].values))
+	assert np.array_equal(snapshot.column('m', 'start'), models['start'].values.astype(float))
+	return interface
+
+def test_npy_snapshot(tmp_path):
+	check_round_trip(str(tmp_path / 'pindex'))
+
+def test_hdf5_snapshot(tmp_path):
+	check_round_trip(str(tmp_path / 'pindex.h5'))
+
+def test_import_snapshot(tmp_path):
+	path = str(tmp_path / 'pindex')
+	source = check_round_trip(path)
+	target = MemoryInterface()
+	target.create_table('ts', source.tables['ts'], include_index = False)
+	assert import_pindex(target, path, 'clone') == 'tspdb.clone'
+	for args in [(100, 900), (2400, 2600), (2600, 2650)]:
+		with warnings.catch_warnings():
+			warnings.simplefilter('ignore')
+			expected = predict.get_prediction_range('tspdb.pindex', 'ts', 'b', source, *args)
+			result = predict.get_prediction_range('tspdb.clone', 'ts', 'b', target, *args)
+		assert np.allclose(expected[0], result[0]) and np.allclose(expected[1], result[1])
+	assert list(target.tables['tspdb.pindices']['index_name']) == ['clone']
+	assert list(target.tables['tspdb.pindices_columns']['value_column']) == ['a', 'b']
+	# the pindex cannot be imported twice
+	try:
+		import_pindex(target, path, 'clone')
+		assert False
+	except Exception as e:
+		assert 'already exists' in str(e)
+
+def test_export_baseline_pindex(tmp_path):
+	interface, TSPD = make_pindex(False)
+	expected = export_pindex(interface, 'tspdb.pindex', str(tmp_path / 'expected'))
+	baseline_coefficient_view(interface)
+	for name in ['tspdb.pindex_c_projected', 'tspdb.pindex_variance_c_projected']:
+		interface.drop_table(name)
+	export_pindex(interface, 'tspdb.pindex', str(tmp_path / 'baseline'))
+	expected, result = load_snapshot(str(tmp_path / 'expected')), load_snapshot(str(tmp_path / 'baseline'))
+	for name in ['c_view', 'variance_c_view', 'c_projected', 'variance_c_projected']:
+		assert expected.columns[name] == result.columns[name]
+		assert np.allclose(expected.tables[name], result.tables[name], equal_nan = True)
@@ -0,0 +1,51 @@
+import warnings
+import numpy as np
+import pandas as pd
+from tspdb.tests.memory_interface import MemoryInterface
+from tspdb.src.pindex.tune import candidate_grid, tune_models, tune_pindex, pareto_frontier
+
+def periodic_series(n = 4000):
+	np.random.seed(0)
+	t = np.arange(n)
+	return np.column_stack([np.sin(2*np.pi*t/50) + 0.3*np.random.randn(n), np.cos(2*np.pi*t/30) + 0.3*np.random.randn(n)])
+
+def test_candidate_grid():
+	candidates = candidate_grid(T = [1000], L = [None, 20], k = [2, None], col_to_row_ratio = [1, 10])
+	assert len(candidates) == 6
+	assert {'T': 1000, 'L': 20, 'k': 2, 'col_to_row_ratio': None} in candidates
+	assert {'T': 1000, 'L': None, 'k': None, 'col_to_row_ratio': 10} in candidates
+
+def test_successive_halving():
+	data = periodic_series()
+	candidates = candidate_grid(T = [1000], k = [1, 2, 4], col_to_row_ratio = [1, 10, 50])
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore')
+		best, trials = tune_models(data, candidates, eta = 3, T0 = 100, workers = 1)
+		best_, trials_ = tune_models(data, candidates, eta = 3, T0 = 100, workers = 2)
+	# 9 candidates, 3 then 1 kept on 3 and 9 times more observations
+	assert list(trials.groupby('round').size()) == [9, 3, 1]
+	assert list(trials.groupby('round')['budget'].first()) == [355, 1065, 3195]
+	last = trials[trials['round'] == 2].iloc[0]
+	assert best == {'T': 1000, 'L': None, 'k': last['k'], 'col_to_row_ratio': last['col_to_row_ratio']}
+	# the kept candidates are the best scored of the previous round
+	first = trials[trials['round'] == 0].sort_values('score', ascending = False)
+	kept = trials[trials['round'] == 1]
+	assert set(zip(first['k'].iloc[:3], first['col_to_row_ratio'].iloc[:3])) == set(zip(kept['k'], kept['col_to_row_ratio']))
+	# worker processes fit the same models
+	assert best == best_ and np.allclose(trials['score'], trials_['score'])
+
+def test_pareto_frontier():
+	trials = pd.DataFrame({'fit_seconds': [1., 2., 3., 4., 0.5], 'score': [0.5, 0.4, 0.7, np.nan, 0.1]})
+	frontier = pareto_frontier(trials)
+	assert list(frontier['fit_seconds']) == [0.5, 1., 3.] and list(frontier['score']) == [0.1, 0.5, 0.7]
+
+def test_tune_pindex():
+	data = periodic_series()
+	interface = MemoryInterface()
+	interface.create_table('ts', pd.DataFrame({'time': np.arange(len(data)), 'a': data[:, 0], 'b': data[:, 1]}), include_index = False)
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore')
+		best, frontier = tune_pindex(interface, 'ts', 'time', ['a', 'b'], T = [1000, 2000], k = [2, 4], col_to_row_ratio = [10], T0 = 100, workers = 1)
+	assert best['T'] in [1000, 2000] and best['k'] in [2, 4]
+	assert (np.diff(frontier['fit_seconds']) >= 0).all() and (np.diff(frontier['score']) > 0).all()
+	assert interface.queries.count(('get_time_series', 'ts')) == 1